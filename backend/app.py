@@ -1,34 +1,56 @@
 import time
-from flask import Flask, request, jsonify, make_response
-from helper import extract_and_repair_json
+from flask import Flask, request, jsonify, make_response, Response, g
+from helper import extract_and_repair_json, TestCaseStreamParser
+from testcase_dedup import deduplicate_for_import
 from get_test_cases import JiraService
 from import_tests import XrayImport
 from jira_helper import JiraHelper
-import jwt, json, os
+from jobs import job_manager, import_job_manager
+from llm_cache import completion_cache
+from shared_state import shared_state
+from generation_store import generation_store, store_generation_results, GENERATION_STORE_PAGE_SIZE
+from rate_limiter import AdmissionRejected
+from metrics import current_route, track_stage, observe_request, metrics_payload
+from logging_config import setup_logging, start_request, request_id
+import jwt, json, os, hashlib, sqlite3, base64
 import datetime
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from cryptography.fernet import Fernet, InvalidToken
 from flask_cors import CORS
 
 import logging
-from logging.handlers import RotatingFileHandler
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+# Lets browser clients read the id of the stored generation
+CORS(app, expose_headers=["X-Generation-Id"])
 # app.config['DEBUG'] = True
 
 SECRET_KEY = os.getenv('SECRET_KEY')
-
-# Temporary in-memory storage
-vectorization_keys = {}
-
-# Setup logging
-if not app.debug:
-    handler = RotatingFileHandler('app.log', maxBytes=10000, backupCount=1)
-    handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    app.logger.addHandler(handler)
-    app.logger.setLevel(logging.INFO)
+# Seconds a stored vectorization API key stays usable
+VECTORIZATION_KEY_TTL = int(os.getenv("VECTORIZATION_KEY_TTL", "3600"))
+
+def vectorization_key_cipher():
+    # Derived from SECRET_KEY, so every worker can read what another stored and no plaintext key reaches the shared state
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(SECRET_KEY.encode()).digest()))
+
+@app.before_request
+def start_request_context():
+    g.request_started = time.perf_counter()
+    start_request(request.headers.get("X-Request-ID"))
+    # The URL rule rather than the path, so issue and job ids do not become labels
+    current_route.set(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def finish_request_context(response):
+    if "request_started" in g:
+        observe_request(current_route.get(), request.method, response.status_code,
+                        time.perf_counter() - g.request_started)
+    if request_id.get():
+        response.headers["X-Request-ID"] = request_id.get()
+    return response
 
 @app.route("/")
 def hello_world():
@@ -58,6 +80,67 @@ def post_example():
     return jsonify(response), 200  # Return a JSON response with a 200 status code
 
 
+def repair_test_case_results(results):
+    """Runs `extract_and_repair_json` over every successful outcome of a test case generation."""
+    for key, outcome in results.items():
+        # Incremental regeneration returns test cases already parsed
+        if outcome["status"] != "success" or not isinstance(outcome["result"], str):
+            continue
+        try:
+            with track_stage("extract_and_repair_json"):
+                outcome["result"] = extract_and_repair_json(outcome["result"])
+        except ValueError as e:
+            results[key] = {"status": "error", "error": str(e)}
+    return results
+
+
+def generation_payload(results):
+    """
+    Builds the response body and status code for `JiraService.start_generating` results.
+
+    A single-issue request keeps the flat response the frontend expects, while a
+    multi-issue request gets every outcome keyed by issue so failures are reported per issue.
+    A single issue rejected by LLM admission control gets a 429 with a retry-after hint.
+    """
+    if len(results) == 1:
+        outcome = next(iter(results.values()))
+        if outcome["status"] == "error" and "retry_after" in outcome:
+            return {"error": "AI API is busy, please retry later", "details": outcome["error"], "retry_after": outcome["retry_after"]}, 429
+        if outcome["status"] == "error":
+            return {"error": "Failed to generate test cases, details in console!", "details": outcome["error"]}, 500
+        return outcome["result"], 200
+    return results, 200
+
+
+def single_or_batch_response(results):
+    payload, status_code = generation_payload(results)
+    response = make_response(jsonify(payload), status_code)
+    if status_code == 429:
+        response.headers["Retry-After"] = str(payload["retry_after"])
+    if len(results) == 1 and "generation_id" in next(iter(results.values())):
+        # The flat single-issue body has no room for it
+        response.headers["X-Generation-Id"] = str(next(iter(results.values()))["generation_id"])
+    return response
+
+
+def run_generation_job(jira_email, jira_token, jira_issue_id, user_prompt, select_prompt, drsAccessToken=None, use_cache=True):
+    """Background job body: the same pipeline as /get_test_cases and /get_workflow."""
+    results = JiraService(jira_email, jira_token).start_generating(
+        jira_issue_id, user_prompt, select_prompt=select_prompt, drsAccessToken=drsAccessToken,
+        use_cache=use_cache
+    )
+    if select_prompt == "testcases":
+        repair_test_case_results(results)
+    store_generation_results(jira_email, select_prompt, results, user_prompt)
+    payload, status_code = generation_payload(results)
+    if status_code == 429:
+        # Kept on the job as status_code and retry_after, like the 429 of the synchronous routes
+        raise AdmissionRejected(payload["details"], payload["retry_after"])
+    if status_code != 200:
+        raise RuntimeError(payload["details"])
+    return payload
+
+
 @app.route("/get_test_cases", methods=["POST"])
 def get_test_cases():
     auth_header = request.headers.get("Authorization")
@@ -79,14 +162,79 @@ def get_test_cases():
 
     jira_issue_id = data.get("issue_id")
     user_prompt = data.get("user_prompt", "")
+    use_cache = not data.get("no_cache", False)
     
     try:
-        response = JiraService(jira_email, jira_token).start_generating(jira_issue_id, user_prompt, drsAccessToken=drsAccessToken)
-        repaired_json = extract_and_repair_json(response)
-        return jsonify(repaired_json), 200
+        results = JiraService(jira_email, jira_token).start_generating(jira_issue_id, user_prompt, drsAccessToken=drsAccessToken, use_cache=use_cache)
     except Exception as e:
         return jsonify({"error": "Failed to generate test cases, details in console!", "details": str(e)}), 500
 
+    repair_test_case_results(results)
+    store_generation_results(jira_email, "testcases", results, user_prompt)
+    return single_or_batch_response(results)
+
+
+@app.route("/stream_test_cases", methods=["POST"])
+def stream_test_cases():
+    """
+    Streams generated test cases as newline-delimited JSON while the model is still writing.
+
+    Every line is one event: {"type": "test_case", "issue": ..., "data": {...}} for each
+    complete test case, then {"type": "done", "issue": ..., "count": n, "generation_id": ...} per issue, or
+    {"type": "error", "issue": ..., "error": ...} if that issue's generation failed.
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    data = request.get_json()
+    drsAccessToken = request.cookies.get("jira")
+    jira_email = payload["email"]
+    jira_token = payload["token"]
+
+    jira_issue_id = data.get("issue_id")
+    user_prompt = data.get("user_prompt", "")
+    if isinstance(jira_issue_id, str):
+        jira_issue_id = [jira_issue_id]
+
+    def generate():
+        jira_service = JiraService(jira_email, jira_token)
+        for issue_key in dict.fromkeys(jira_issue_id or []):
+            parser = TestCaseStreamParser()
+            test_cases = []
+            try:
+                for chunk in jira_service.stream_generating(issue_key, user_prompt, drsAccessToken=drsAccessToken):
+                    for test_case in parser.feed(chunk):
+                        test_cases.append(test_case)
+                        yield json.dumps({"type": "test_case", "issue": issue_key, "data": test_case}) + "\n"
+            except AdmissionRejected as e:
+                yield json.dumps({"type": "error", "issue": issue_key, "error": str(e), "retry_after": e.retry_after}) + "\n"
+                continue
+            except Exception as e:
+                logger.error(f"Streaming generation failed for story {issue_key}: {e}")
+                yield json.dumps({"type": "error", "issue": issue_key, "error": str(e)}) + "\n"
+                continue
+            done = {"type": "done", "issue": issue_key, "count": len(test_cases)}
+            outcome = {"status": "success", "result": test_cases}
+            store_generation_results(jira_email, "testcases", {issue_key: outcome}, user_prompt)
+            if "generation_id" in outcome:
+                done["generation_id"] = outcome["generation_id"]
+            yield json.dumps(done) + "\n"
+
+    response = Response(generate(), mimetype="application/x-ndjson")
+    # Keep reverse proxies from buffering the stream
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 
 @app.route("/get_workflow", methods=["POST"])
 def get_workflow():
@@ -109,9 +257,133 @@ def get_workflow():
     
     jira_issue_id = data.get("issue_id")
     user_prompt = data.get("user_prompt", "")
+    use_cache = not data.get("no_cache", False)
     
-    response = JiraService(jira_email, jira_token).start_generating(jira_issue_id, user_prompt, select_prompt="workflow")
-    return jsonify(response), 200
+    results = JiraService(jira_email, jira_token).start_generating(jira_issue_id, user_prompt, select_prompt="workflow", use_cache=use_cache)
+    store_generation_results(jira_email, "workflow", results, user_prompt)
+    return single_or_batch_response(results)
+
+@app.route("/jobs/<select_prompt>", methods=["POST"])
+def submit_generation_job(select_prompt):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if select_prompt not in ("testcases", "workflow"):
+        return jsonify({"error": f"Unknown job type '{select_prompt}'"}), 404
+
+    data = request.get_json()
+    drsAccessToken = request.cookies.get("jira")
+    jira_email = payload["email"]
+    jira_token = payload["token"]
+
+    jira_issue_id = data.get("issue_id")
+    user_prompt = data.get("user_prompt", "")
+    use_cache = not data.get("no_cache", False)
+
+    job_id = job_manager.submit(
+        jira_email, select_prompt, run_generation_job,
+        jira_email, jira_token, jira_issue_id, user_prompt, select_prompt, drsAccessToken, use_cache
+    )
+    response = {'message': 'Generation job submitted', 'job_id': job_id, 'status': 'queued'}
+    return jsonify(response), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_generation_job(job_id):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    # ?wait=<seconds> turns the status check into a long-poll
+    wait = request.args.get("wait", default=0, type=float)
+    job = job_manager.wait(job_id, owner=payload["email"], timeout=wait)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    return jsonify(job), 200
+
+@app.route("/generations", methods=["GET"])
+def list_generations():
+    """
+    Lists the user's stored generations, newest first, without their results.
+
+    Query parameters: issue_key and kind ("testcases" or "workflow") filter the list, limit
+    sets the page size and cursor is the next_cursor of the previous page.
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    if not generation_store.enabled:
+        return jsonify({"error": "Generation store is disabled"}), 404
+
+    try:
+        entries, next_cursor = generation_store.list(
+            payload["email"],
+            issue_key=request.args.get("issue_key"),
+            kind=request.args.get("kind"),
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", default=GENERATION_STORE_PAGE_SIZE, type=int),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    except sqlite3.Error as e:
+        logger.error(f"Failed to list generations: {e}")
+        return jsonify({"error": "Generation store is unavailable"}), 503
+
+    return jsonify({"generations": entries, "next_cursor": next_cursor}), 200
+
+@app.route("/generations/<int:generation_id>", methods=["GET"])
+def get_generation(generation_id):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    try:
+        generation = generation_store.get(payload["email"], generation_id) if generation_store.enabled else None
+    except sqlite3.Error as e:
+        logger.error(f"Failed to load generation {generation_id}: {e}")
+        return jsonify({"error": "Generation store is unavailable"}), 503
+    if generation is None:
+        return jsonify({"error": "Generation not found or expired"}), 404
+
+    return jsonify(generation), 200
+
+def xray_owner(token):
+    """Import jobs belong to the Xray token that submitted them."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 @app.route("/post_test_cases", methods=["POST"])
 def post_test_cases():
@@ -127,15 +399,53 @@ def post_test_cases():
     testcase_json = json.loads(data.get('testcase_data'))
     xray_set = data.get('xray_test_sets')
     jira_issue_id = data.get('jira_issue_id')
+    # With "async": true the import runs in the background, see /import_jobs/<job_id>
+    run_async = data.get('async', False)
 
     try:
+        # Near-duplicate test cases are dropped before they become Xray issues
+        testcase_json, merged = deduplicate_for_import(testcase_json, data.get('dedup'), data.get('dedup_threshold'))
         formatted_data = XrayImport().format_test_cases(testcase_json, jira_issue_id, xray_set)
-        job_id = XrayImport().post_test_cases(token, formatted_data)
-        keys = XrayImport().get_job_keys(token, job_id)
-        return jsonify(keys), 200
+    except Exception as e:
+        return jsonify({"error": "Invalid test case data", "details": str(e)}), 400
+
+    if run_async:
+        import_job_id = import_job_manager.submit(
+            xray_owner(token), "xray_import", XrayImport().import_test_cases, token, formatted_data
+        )
+        response = {'message': 'Import submitted', 'job_id': import_job_id, 'status': 'queued', 'merged': merged}
+        return jsonify(response), 202
+
+    try:
+        result = XrayImport().import_test_cases(token, formatted_data)
     except Exception as e:
         return make_response(jsonify({"error": "XRay Authentication Failed!"}), 401)
 
+    if result["status"] == "successful":
+        # The plain key list, unless test cases were merged
+        if merged:
+            return jsonify({"keys": result["keys"], "merged": merged}), 200
+        return jsonify(result["keys"]), 200
+    if result["status"] == "partially_successful":
+        return jsonify({"keys": result["keys"], "errors": result["errors"], "merged": merged}), 207
+    return jsonify({"error": "XRay import failed", "details": result["errors"]}), 502
+
+@app.route("/import_jobs/<job_id>", methods=["GET"])
+def get_import_job(job_id):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+
+    # ?wait=<seconds> turns the status check into a long-poll
+    wait = request.args.get("wait", default=0, type=float)
+    job = import_job_manager.wait(job_id, owner=xray_owner(token), timeout=wait)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+
+    return jsonify(job), 200
+
 @app.route("/update_jira_workflow", methods=["POST"])
 def update_jira_workflow():
     auth_header = request.headers.get("Authorization")
@@ -161,7 +471,7 @@ def update_jira_workflow():
     except PermissionError as e:
         return jsonify({"error": str(e)}), 403
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error(f"Error: {e}")
         return jsonify({"error": "Failed to update issue", "details": str(e)}), 500
     
     response = {'message': 'Workflow Updated Successfully'}
@@ -189,9 +499,7 @@ def add_fields():
     labels = data.get("labels", [])
     component = data.get("component", None)
     
-    print(f"Adding fields to JIRA issue {key}...")
-    print(f"Label: {labels}")
-    print(f"Component: {component}")
+    logger.info(f"Adding fields to JIRA issue {key}: labels {labels}, component {component}")
     
     try:
         JiraHelper(jira_email, jira_token).add_fields(key, component, labels)
@@ -204,6 +512,97 @@ def add_fields():
     return jsonify(response), 200
 
 
+@app.route("/add_fields/bulk", methods=["POST"])
+def add_fields_bulk():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]  # Extract the token part of the header
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    jira_email = payload["email"]
+    jira_token = payload["token"]
+
+    # {"keys": [...], "labels": [...], "component": ...}; every issue gets the same fields
+    data = request.json
+    keys = data.get("keys")
+    if not isinstance(keys, list) or not keys:
+        return jsonify({"error": "keys must be a non-empty list of issue keys"}), 400
+    labels = data.get("labels", [])
+    component = data.get("component", None)
+
+    logger.info(f"Adding fields to {len(keys)} JIRA issues: labels {labels}, component {component}")
+
+    try:
+        results = JiraHelper(jira_email, jira_token).bulk_add_fields(keys, component, labels)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return jsonify({"error": "Failed to update issues", "details": str(e)}), 500
+
+    # Per-issue outcomes; one rejected issue does not fail the others
+    return jsonify(results), 200
+
+@app.route("/update_jira_workflow/bulk", methods=["POST"])
+def update_jira_workflow_bulk():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    jira_email = payload["email"]
+    jira_token = payload["token"]
+
+    # {"workflows": [{"jira_issue_id": ..., "workflow": ...}, ...]}
+    data = request.json
+    items = data.get("workflows")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "workflows must be a non-empty list"}), 400
+    workflows = {item.get("jira_issue_id"): item.get("workflow") for item in items}
+
+    try:
+        results = JiraHelper(jira_email, jira_token).bulk_set_workflow(workflows)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return jsonify({"error": "Failed to update issues", "details": str(e)}), 500
+
+    return jsonify(results), 200
+
+@app.route("/llm-cache/stats", methods=["GET"])
+def llm_cache_stats():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    return jsonify(completion_cache.stats()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = metrics_payload()
+    return Response(body, content_type=content_type)
+
+
 @app.route("/authenticate", methods=["POST"])
 def authenticateJira():
     
@@ -214,7 +613,7 @@ def authenticateJira():
     
     try:
         displayName = JiraService(jira_email, jira_token).jira_auth()
-        print(displayName)
+        logger.info(f"Authenticated Jira user {displayName}")
     except Exception as e:
         return make_response(jsonify({"error": "Internal Server Error", "message": str(e)}), 500)
     
@@ -232,6 +631,23 @@ def authenticateJira():
     response = {'message': 'Successfully created JWT', 'jwt': my_jwt, 'user': displayName}
     return jsonify(response), 200
 
+def conditional_response(response, data):
+    """
+    Returns `response` as JSON with an ETag derived from `data`.
+
+    When the client's If-None-Match already holds that ETag an empty 304 is returned
+    instead, so unchanged metadata is not sent again.
+    """
+    etag = hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    if etag in request.if_none_match:
+        result = make_response("", 304)
+    else:
+        result = make_response(jsonify(response), 200)
+    result.set_etag(etag)
+    # Let browsers keep the response but revalidate it on every use
+    result.headers["Cache-Control"] = "private, no-cache"
+    return result
+
 @app.route("/get-jira-labels", methods=["GET"])
 def get_jira_labels():
     auth_header = request.headers.get("Authorization")
@@ -249,10 +665,12 @@ def get_jira_labels():
     jira_email = payload["email"]
     jira_token = payload["token"]
 
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
+
     try:
-        labels = JiraHelper(jira_email, jira_token).get_labels()
+        labels = JiraHelper(jira_email, jira_token).get_labels(refresh=refresh)
         response = {'message': 'Successfully retrieved labels', 'labels': labels}
-        return jsonify(response), 200
+        return conditional_response(response, labels)
     except Exception as e:
         return jsonify({"error": "Error retrieving Jira labels"}), 500
 
@@ -273,11 +691,12 @@ def get_jira_components():
     jira_email = payload["email"]
     jira_token = payload["token"]
     project_id = request.args.get('project_id')
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
 
     try:
-        components = JiraHelper(jira_email, jira_token).get_components(project_id)
+        components = JiraHelper(jira_email, jira_token).get_components(project_id, refresh=refresh)
         response = {'message': 'Successfully retrieved components', 'components': components}
-        return jsonify(response), 200
+        return conditional_response(response, components)
     except Exception as e:
         return jsonify({"error": "Error retrieving Jira components", "details": str(e)}), 500
 
@@ -288,64 +707,106 @@ def authenticate_xray():
     client_secret = data.get("client_secret")
 
     if not client_id or not client_secret:
-        print("Client ID or client secret not provided.")
+        logger.warning("Client ID or client secret not provided.")
         return make_response(jsonify({"error": "Client ID or Client Secret not provided"}), 400)
 
     try:
-        print("Attempting to authenticate.")
+        logger.info("Attempting to authenticate.")
         auth_response = XrayImport().authenticate(client_id, client_secret)
         
-        print(f"Authentication status: {auth_response['status']}")
+        logger.info(f"Authentication status: {auth_response['status']}")
 
         if auth_response.get('status') == 200:
-            print("Authentication successful.")
+            logger.info("Authentication successful.")
             return jsonify({"message": "Authentication successful", "token": auth_response['data']}), 200
         elif auth_response.get('status') == 401:
             return make_response(jsonify({"error": "Authentication failed"}), 401)
         else:
-            print(f"Unexpected status: {auth_response.get('status')}")
+            logger.warning(f"Unexpected status: {auth_response.get('status')}")
             return make_response(jsonify({"error": "Unexpected status received", "status": auth_response.get('status')}), auth_response.get('status'))
 
     except Exception as e:
-        print(f"An exception occurred: {e}")
+        logger.exception(f"An exception occurred: {e}")
         return make_response(jsonify({"error": "Internal Server Error", "message": str(e)}), 500)
 
 @app.route('/store-vectorization-key', methods=['POST'])
 def store_vectorization_key():
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
     data = request.json
     vectorization_api_key = data.get('vectorization_api_key')
     
     if not vectorization_api_key:
         return jsonify({"error": "No vectorization API key provided"}), 400
 
-    # Store the vectorization key in the in-memory dictionary
-    vectorization_keys['key'] = {
-        'value': vectorization_api_key,
-        'timestamp': time.time()
-    }
+    # Shared by all workers, one encrypted key per user. It is kept for another TTL after it
+    # expires so that clients still get "expired" rather than "not found" in that time.
+    shared_state.set(
+        payload["email"],
+        "vectorization_key",
+        {
+            "value": vectorization_key_cipher().encrypt(vectorization_api_key.encode()).decode(),
+            "timestamp": time.time(),
+        },
+        ttl=2 * VECTORIZATION_KEY_TTL,
+    )
 
     return jsonify({"message": "Vectorization API key stored successfully"}), 200
 
 @app.route('/get-vectorization-key', methods=['GET'])
 def get_vectorization_key():
-    key_data = vectorization_keys.get('key')
-    
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    key_data = shared_state.get(payload["email"], "vectorization_key")
     if not key_data:
         return jsonify({"error": "No vectorization API key found"}), 404
-    
-    current_time = time.time()
-    key_timestamp = key_data['timestamp']
-    time_elapsed = current_time - key_timestamp
 
-    # Check if the key has expired (60 minutes = 3600 seconds)
-    if time_elapsed > 3600:
+    if time.time() - key_data["timestamp"] > VECTORIZATION_KEY_TTL:
         return jsonify({"error": "Vectorization API key has expired"}), 403
 
-    return key_data['value'], 200
+    try:
+        vectorization_api_key = vectorization_key_cipher().decrypt(key_data["value"].encode()).decode()
+    except InvalidToken:
+        # Stored under a different SECRET_KEY
+        return jsonify({"error": "No vectorization API key found"}), 404
+
+    return vectorization_api_key, 200
 
 @app.route('/clear-vectorization-key', methods=['DELETE'])
 def clear_vectorization_key():
-    vectorization_keys.pop('key', None)
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+    token = auth_header.split(' ')[1]
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+
+    shared_state.delete(payload["email"], "vectorization_key")
     return jsonify({"message": "Vectorization API key cleared successfully"}), 200
     
 if __name__ == "__main__":
@@ -0,0 +1,320 @@
+"""
+ASGI entrypoint: `uvicorn asgi:app --workers N`.
+
+/get_test_cases, /get_workflow and the blocking /post_test_cases import are served on the
+event loop through async_clients, so a request waiting on Jira, the documentation service,
+OpenAI or Xray holds no thread. Every other route, and any request with "async": true, is
+passed through to the Flask app unchanged.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from http.cookies import SimpleCookie
+
+import jwt
+from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app, SECRET_KEY, repair_test_case_results, generation_payload
+from get_test_cases import GENERATION_MAX_WORKERS, compose_prompts, story_search_query, generation_context
+from helper import extract_and_repair_json
+from incremental import Regeneration, STORY_INCREMENTAL
+from import_tests import XrayImport
+from testcase_dedup import deduplicate_for_import
+from generation_store import store_generation_results
+from rate_limiter import AdmissionRejected
+from metrics import current_route, observe_request, track_stage
+from logging_config import start_request
+import async_clients
+
+logger = logging.getLogger(__name__)
+
+# Threads serving the Flask routes; long-polls and streams each hold one while open
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))
+
+flask_asgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs blocking file or database I/O on the default executor, in the caller's context."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    )
+
+
+async def start_generating(jira_email, jira_token, user_story_list, additional_user_input,
+                           select_prompt="testcases", drsAccessToken=None, use_cache=True):
+    """Async `JiraService.start_generating`, returning the same per-issue outcomes."""
+    if isinstance(user_story_list, str):
+        user_story_list = [user_story_list]
+    user_story_list = list(dict.fromkeys(user_story_list or []))
+
+    server = os.getenv("JIRA_ENDPOINT")
+    openai_service = async_clients.AsyncOpenAIService(os.getenv("API_KEY"), user=jira_email)
+    semaphore = asyncio.Semaphore(max(1, GENERATION_MAX_WORKERS))
+
+    stories = {}
+    if len(user_story_list) > 1:
+        stories = await async_clients.fetch_issues(server, jira_email, jira_token, user_story_list)
+
+    async def generate(issue_key):
+        async with semaphore:
+            story_data = stories.get(issue_key)
+            if story_data is None:
+                story_data = await async_clients.fetch_issue(server, jira_email, jira_token, issue_key)
+            regeneration = None
+            if select_prompt == "testcases" and STORY_INCREMENTAL:
+                # Reads the stored generation from disk, off the loop
+                regeneration = await run_blocking(
+                    Regeneration, server, story_data, generation_context(additional_user_input), force=not use_cache
+                )
+                if regeneration.story_data_to_generate is None:
+                    return await run_blocking(regeneration.finish)
+                story_data = regeneration.story_data_to_generate
+            relevant_documentation = None
+            if select_prompt == "testcases":
+                relevant_documentation = await async_clients.get_documentation(
+                    drsAccessToken, story_search_query(story_data)
+                )
+            system_prompt, base_prompt = compose_prompts(
+                story_data, additional_user_input, select_prompt, relevant_documentation
+            )
+            result, complete = await openai_service.get_completion_with_status_async(
+                system_prompt, base_prompt, use_cache=use_cache
+            )
+            if not result:
+                raise RuntimeError(f"No completion returned from AI API for story {issue_key}")
+            if regeneration is not None:
+                with track_stage("extract_and_repair_json"):
+                    test_cases = extract_and_repair_json(result)
+                # A cut-off or unparsable completion is returned, but not kept as the story's test cases
+                return await run_blocking(regeneration.finish, test_cases, store=complete and bool(test_cases))
+            return result
+
+    outcomes = await asyncio.gather(*(generate(key) for key in user_story_list), return_exceptions=True)
+
+    results = {}
+    for issue_key, outcome in zip(user_story_list, outcomes):
+        if isinstance(outcome, AdmissionRejected):
+            results[issue_key] = {"status": "error", "error": str(outcome), "retry_after": outcome.retry_after}
+        elif isinstance(outcome, Exception):
+            logger.error(f"Failed to generate for story {issue_key}: {outcome}")
+            results[issue_key] = {"status": "error", "error": str(outcome)}
+        else:
+            results[issue_key] = {"status": "success", "result": outcome}
+    return results
+
+
+# Request / response plumbing
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+
+    def bearer_token(self):
+        auth_header = self.headers.get("authorization")
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return None
+        return auth_header.split(' ')[1]
+
+    def cookie(self, name):
+        cookies = SimpleCookie(self.headers.get("cookie", ""))
+        return cookies[name].value if name in cookies else None
+
+    def get_json(self):
+        return json.loads(self.body or b"null")
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+def replay(body):
+    """A `receive` callable that hands an already consumed body to the Flask app."""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+    return receive
+
+
+async def send_json(send, payload, status=200, headers=None):
+    body = json.dumps(payload).encode("utf-8")
+    response_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        # Same CORS headers as the Flask routes get from flask_cors
+        (b"access-control-allow-origin", b"*"),
+        (b"access-control-expose-headers", b"X-Generation-Id"),
+    ]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode(), str(value).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def decode_jwt(request):
+    """Returns (payload, None) for a valid app JWT, otherwise (None, (error, status))."""
+    token = request.bearer_token()
+    if token is None:
+        return None, ({"error": "Authorization header missing or invalid"}, 401)
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]), None
+    except ExpiredSignatureError:
+        return None, ({"error": "Token expired"}, 401)
+    except InvalidTokenError:
+        return None, ({"error": "Invalid token"}, 401)
+
+
+async def store_results(jira_email, kind, results, user_prompt):
+    # SQLite writes block, so they run off the loop like the deduplication
+    await run_blocking(store_generation_results, jira_email, kind, results, user_prompt)
+
+
+async def send_generation_payload(send, results):
+    payload, status_code = generation_payload(results)
+    headers = {"Retry-After": payload["retry_after"]} if status_code == 429 else {}
+    if len(results) == 1 and "generation_id" in next(iter(results.values())):
+        headers["X-Generation-Id"] = next(iter(results.values()))["generation_id"]
+    await send_json(send, payload, status_code, headers)
+
+
+# Routes
+
+async def get_test_cases(request, send):
+    payload, error = decode_jwt(request)
+    if error:
+        return await send_json(send, *error)
+
+    data = request.get_json()
+    use_cache = not data.get("no_cache", False)
+    try:
+        results = await start_generating(
+            payload["email"], payload["token"], data.get("issue_id"), data.get("user_prompt", ""),
+            drsAccessToken=request.cookie("jira"), use_cache=use_cache,
+        )
+    except Exception as e:
+        return await send_json(send, {"error": "Failed to generate test cases, details in console!", "details": str(e)}, 500)
+
+    repair_test_case_results(results)
+    await store_results(payload["email"], "testcases", results, data.get("user_prompt", ""))
+    await send_generation_payload(send, results)
+
+
+async def get_workflow(request, send):
+    payload, error = decode_jwt(request)
+    if error:
+        return await send_json(send, *error)
+
+    data = request.get_json()
+    use_cache = not data.get("no_cache", False)
+    results = await start_generating(
+        payload["email"], payload["token"], data.get("issue_id"), data.get("user_prompt", ""),
+        select_prompt="workflow", use_cache=use_cache,
+    )
+    await store_results(payload["email"], "workflow", results, data.get("user_prompt", ""))
+    await send_generation_payload(send, results)
+
+
+async def post_test_cases(request, send):
+    token = request.bearer_token()
+    if token is None:
+        return await send_json(send, {"error": "Authorization header missing or invalid"}, 401)
+
+    data = request.get_json()
+    try:
+        testcase_json = json.loads(data.get('testcase_data'))
+        # Deduplicating thousands of test cases takes a noticeable fraction of a second, off the loop
+        testcase_json, merged = await run_blocking(
+            deduplicate_for_import, testcase_json, data.get('dedup'), data.get('dedup_threshold')
+        )
+        formatted_data = XrayImport().format_test_cases(
+            testcase_json, data.get('jira_issue_id'), data.get('xray_test_sets')
+        )
+    except Exception as e:
+        return await send_json(send, {"error": "Invalid test case data", "details": str(e)}, 400)
+
+    try:
+        result = await async_clients.xray_import_test_cases(token, formatted_data)
+    except Exception as e:
+        logger.error(f"Xray import failed before any test was imported: {e}")
+        return await send_json(send, {"error": "XRay Authentication Failed!"}, 401)
+
+    if result["status"] == "successful":
+        if merged:
+            return await send_json(send, {"keys": result["keys"], "merged": merged})
+        return await send_json(send, result["keys"])
+    if result["status"] == "partially_successful":
+        return await send_json(send, {"keys": result["keys"], "errors": result["errors"], "merged": merged}, 207)
+    await send_json(send, {"error": "XRay import failed", "details": result["errors"]}, 502)
+
+
+native_routes = {
+    "/get_test_cases": get_test_cases,
+    "/get_workflow": get_workflow,
+    "/post_test_cases": post_test_cases,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_clients.close_http_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    handler = native_routes.get(scope.get("path")) if scope["type"] == "http" else None
+    if handler is None or scope["method"] != "POST":
+        return await flask_asgi(scope, receive, send)
+
+    body = await read_body(receive)
+    request = Request(scope, body)
+    try:
+        data = request.get_json()
+    except ValueError:
+        data = None
+    # Malformed bodies get Flask's usual error response, and background imports
+    # live in the Flask app's job manager
+    if not isinstance(data, dict) or (handler is post_test_cases and data.get("async", False)):
+        return await flask_asgi(scope, replay(body), send)
+
+    current_route.set(scope["path"])
+    rid = start_request(request.headers.get("x-request-id"))
+    started = time.perf_counter()
+
+    async def send_and_record(message):
+        if message["type"] == "http.response.start":
+            observe_request(scope["path"], "POST", message["status"], time.perf_counter() - started)
+            message = dict(message, headers=list(message["headers"]) + [(b"x-request-id", rid.encode())])
+        await send(message)
+
+    await handler(request, send_and_record)
@@ -0,0 +1,286 @@
+"""
+Non-blocking clients for the services the generation and import pipelines call.
+
+Used by the ASGI serving mode (see asgi.py). Every call goes through one shared
+`httpx.AsyncClient` per process, so hundreds of in-flight generations share a bounded
+pool of keep-alive connections instead of holding a thread each. Caches, rate limits and
+response handling are the same ones the blocking code paths use.
+"""
+import os
+import asyncio
+import logging
+import httpx
+
+from get_test_cases import (
+    DOCUMENTATION_API_URL, DOCUMENTATION_TIMEOUT, documentation_cache, documentation_cache_key,
+    documentation_request, documentation_chunks,
+)
+from openai_service import (
+    OpenAIService, Completion, LLM_RATE_LIMIT_RETRIES, estimated_tokens, rate_limit_delay, rate_limit_exhausted,
+)
+from issue_loader import story_fields, story_data_from_raw, IssueSearch
+from llm_router import llm_router, failover_delay
+from rate_limiter import admission_controller, AdmissionRejected
+from metrics import track_stage, timed, record_llm_request, outcome_of, RATE_LIMITED, ERROR
+import import_tests
+from import_tests import (
+    XrayImportError, ChunkImport, JobPolling, job_status_outcome, chunk_test_cases, merge_chunk_outcomes,
+    XRAY_POLL_DEADLINE, XRAY_IMPORT_CHUNK_SIZE, XRAY_IMPORT_CHUNK_MAX_BYTES, XRAY_IMPORT_CONCURRENCY,
+    XRAY_IMPORT_CHUNK_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Connections the process may hold open across all services
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+# Per-request timeout; completions are the slowest calls
+ASYNC_HTTP_TIMEOUT = float(os.getenv("ASYNC_HTTP_TIMEOUT", "120"))
+
+_http_client = None
+_documentation_inflight = {}
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=ASYNC_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Jira
+
+@timed("jira_fetch")
+async def fetch_issue(server, email, token, issue_key):
+    """Fetches the story fields the prompts use, in the shape of `issue_loader.load_issue`."""
+    response = await get_http_client().get(
+        f"{server}/rest/api/2/issue/{issue_key}",
+        params={"fields": ",".join(story_fields())},
+        auth=(email, token),
+    )
+    response.raise_for_status()
+    return story_data_from_raw(response.json())
+
+
+@timed("jira_fetch")
+async def fetch_issues(server, email, token, issue_keys):
+    """Async counterpart of `issue_loader.load_issues`; missing keys are left out of the result."""
+    search = IssueSearch(server, issue_keys, story_fields())
+    request = search.next_request()
+    while request is not None:
+        url, body = request
+        try:
+            response = await get_http_client().post(url, json=body, auth=(email, token))
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            if not search.request_failed(status):
+                logger.warning(f"Issue search failed, loading issues one by one: {e}")
+        else:
+            search.page_received(response.json())
+        request = search.next_request()
+    stories = {key: story_data_from_raw(raw) for key, raw in search.found.items()}
+    logger.info(f"Loaded {len(stories)} of {len(issue_keys)} issues with JQL search")
+    return stories
+
+
+# Documentation retrieval
+
+async def _fetch_documentation(drsAccessToken, searchQuery, top_p, min_relevance_score):
+    headers, params = documentation_request(drsAccessToken, searchQuery, top_p, min_relevance_score)
+    response = await get_http_client().get(
+        DOCUMENTATION_API_URL, headers=headers, params=params, timeout=DOCUMENTATION_TIMEOUT,
+    )
+    response.raise_for_status()
+    return documentation_chunks(response.json())
+
+
+async def get_documentation(drsAccessToken, searchQuery, top_p=10, min_relevance_score=0.6):
+    """
+    Async `get_test_cases.get_documentation`: same cache, same timeout, and identical
+    concurrent lookups share one request. Returns an empty list on failure.
+    """
+    cache_key = documentation_cache_key(drsAccessToken, searchQuery, top_p, min_relevance_score)
+    with track_stage("get_documentation") as stage:
+        cached = documentation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        inflight = _documentation_inflight.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                _fetch_documentation(drsAccessToken, searchQuery, top_p, min_relevance_score)
+            )
+            _documentation_inflight[cache_key] = inflight
+            inflight.add_done_callback(lambda _: _documentation_inflight.pop(cache_key, None))
+
+        try:
+            documentation = await asyncio.shield(inflight)
+        except Exception as e:
+            logger.warning(f"Failed to retrieve documentation: {e}")
+            stage.outcome = outcome_of(e)
+            return []
+        documentation_cache.set(cache_key, documentation)
+        return documentation
+
+
+# OpenAI
+
+def http_failover_delay(e):
+    """`failover_delay` for the errors of `AsyncOpenAIService._send`."""
+    if isinstance(e, httpx.HTTPStatusError):
+        return failover_delay(e.response.status_code, e.response.headers)
+    if isinstance(e, httpx.TransportError):
+        return failover_delay(None)
+    return None
+
+
+class AsyncOpenAIService(OpenAIService):
+    """
+    `OpenAIService` over httpx: the same parameters, cache, continuation, admission
+    control and deployment routing.
+    """
+
+    def _request(self, params, deployment):
+        payload = {key: value for key, value in params.items() if key != "engine"}
+        options = deployment.request_options(self.api_key)
+        base = (options["api_base"] or "").rstrip("/")
+        if options["api_type"] in ("azure", "azure_ad"):
+            url = f"{base}/openai/deployments/{options['engine']}/chat/completions"
+            return url, {"api-version": options["api_version"]}, {"api-key": options["api_key"]}, payload
+        payload["model"] = options["engine"]
+        return f"{base}/chat/completions", {}, {"Authorization": f"Bearer {options['api_key']}"}, payload
+
+    async def _send(self, params, deployment):
+        url, query, headers, payload = self._request(params, deployment)
+        response = await get_http_client().post(url, params=query, headers=headers, json=payload)
+        if response.status_code == 429 or response.status_code >= 500:
+            # Raised so the router fails over to another deployment
+            response.raise_for_status()
+        return response
+
+    async def _create_async(self, params):
+        tokens = estimated_tokens(params)
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            try:
+                await admission_controller.acquire_async(self.user, tokens)
+                response, deployment = await llm_router.call_async(
+                    lambda deployment: self._send(params, deployment), http_failover_delay,
+                    admit_hedge=lambda: admission_controller.try_acquire(self.user, tokens),
+                    refund_hedge=lambda: admission_controller.refund(self.user, tokens),
+                )
+            except httpx.HTTPStatusError as e:
+                # Every deployment tried answered 429 or 5xx
+                response = e.response
+            except (AdmissionRejected, httpx.HTTPError) as e:
+                record_llm_request(outcome_of(e))
+                raise
+            if response.status_code == 429:
+                record_llm_request(RATE_LIMITED)
+                admission_controller.refund(self.user, tokens)
+                delay = rate_limit_delay(response.headers, attempt)
+                if delay is None:
+                    raise rate_limit_exhausted(response.headers)
+                await asyncio.sleep(delay)
+                continue
+            if response.is_error:
+                record_llm_request(ERROR)
+            response.raise_for_status()
+            res = response.json()
+            self._record_usage(res.get("usage"), tokens)
+            return res, deployment
+
+    @timed("get_completion")
+    async def get_completion_with_status_async(self, system_prompt, user_prompt, use_cache=True):
+        """
+        Async `get_completion_with_status`. Unlike the blocking version, AI API errors are
+        raised rather than turned into an empty result.
+        """
+        completion = Completion(self, system_prompt, user_prompt)
+        if use_cache:
+            cached = completion.cached()
+            if cached is not None:
+                return cached, True
+
+        while completion.pending:
+            completion.add(*await self._create_async(completion.params))
+        return completion.store(), completion.complete
+
+
+# Xray
+
+@timed("post_test_cases")
+async def xray_post_test_cases(auth_token, test_cases):
+    response = await get_http_client().post(
+        import_tests.BASE_URL + "/import/test/bulk",
+        json=test_cases,
+        headers={"Authorization": f"Bearer {auth_token}"},
+    )
+    response.raise_for_status()
+    return response.json()["jobId"]
+
+
+@timed("get_job_keys")
+async def xray_get_job_result(auth_token, job_id, deadline=XRAY_POLL_DEADLINE):
+    """Async `XrayImport.get_job_result`: the same backoff, deadline and status handling."""
+    headers = {"Authorization": f"Bearer {auth_token}"}
+    polling = JobPolling(job_id, deadline)
+    while True:
+        response = await get_http_client().get(
+            import_tests.BASE_URL + f"/import/test/bulk/{job_id}/status", headers=headers
+        )
+        if response.status_code == 200:
+            data = response.json()
+            polling.status = data.get("status")
+            result = job_status_outcome(job_id, data)
+            if result is not None:
+                return result
+        elif response.status_code in (401, 403):
+            response.raise_for_status()
+        await asyncio.sleep(polling.next_delay())
+
+
+async def _xray_import_chunk(auth_token, chunk, retries):
+    attempts = ChunkImport(chunk, retries)
+    while attempts.next_attempt():
+        await asyncio.sleep(attempts.delay)
+        job_id = None
+        try:
+            job_id = await xray_post_test_cases(auth_token, attempts.tests())
+            result = await xray_get_job_result(auth_token, job_id)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (401, 403):
+                raise
+            attempts.failed(e, job_id)
+        except (XrayImportError, httpx.HTTPError) as e:
+            attempts.failed(e, job_id)
+        else:
+            attempts.imported(result)
+    return attempts.outcome()
+
+
+async def xray_import_test_cases(auth_token, test_cases, chunk_size=XRAY_IMPORT_CHUNK_SIZE,
+                                 max_bytes=XRAY_IMPORT_CHUNK_MAX_BYTES, concurrency=XRAY_IMPORT_CONCURRENCY,
+                                 retries=XRAY_IMPORT_CHUNK_RETRIES):
+    """Async `XrayImport.import_test_cases`, returning the same result dict."""
+    chunks = chunk_test_cases(test_cases, chunk_size, max_bytes)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(chunk):
+        async with semaphore:
+            return await _xray_import_chunk(auth_token, chunk, retries)
+
+    outcomes = await asyncio.gather(*(run(chunk) for chunk in chunks))
+    return merge_chunk_outcomes(outcomes)
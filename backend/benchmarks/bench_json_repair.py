@@ -0,0 +1,105 @@
+"""
+Benchmark for `helper.extract_and_repair_json` on large model outputs.
+
+Compares the current scanner with the previous character-by-character implementation
+on synthetic completions of a few hundred KB, including step text with an unbalanced "{"
+that the old brace counter split incorrectly.
+
+Usage (from the backend directory):
+    python benchmarks/bench_json_repair.py [--cases 1500] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper import extract_and_repair_json
+
+
+def legacy_extract_and_repair_json(input_string):
+    # Previous implementation, minus the print of the whole input
+    start_index = input_string.find('[')
+    if start_index == -1:
+        return 'No JSON array found in the input.'
+    end_index = input_string.rfind(']') + 1
+    if end_index == 0:
+        return 'No JSON array found in the input.'
+    json_part = input_string[start_index:end_index]
+    fixed_json_array = []
+    in_brackets = 0
+    current_object = ''
+    for char in json_part:
+        if char == '{':
+            if in_brackets == 0:
+                current_object = char
+            else:
+                current_object += char
+            in_brackets += 1
+        elif char == '}':
+            in_brackets -= 1
+            current_object += char
+            if in_brackets == 0:
+                try:
+                    obj = json.loads(current_object)
+                    fixed_json_array.append(obj)
+                except json.JSONDecodeError:
+                    pass
+        else:
+            if in_brackets > 0:
+                current_object += char
+    return json.dumps(fixed_json_array)
+
+
+def build_model_output(cases, braces_every=10):
+    test_cases = []
+    for n in range(cases):
+        action = "Type an opening brace { in the search box" if n % braces_every == 0 else "Open the settings page"
+        test_cases.append({
+            "summary": f"Verify settings search #{n}",
+            "description": "Checks that the settings search returns the expected entries for the current user.",
+            "precondition": "User is logged in with a role that can view settings.",
+            "steps": [
+                {"action": action, "data": f"query-{n}", "result": "Matching entries are listed"},
+                {"action": "Clear the search box", "data": "", "result": "All entries are listed again"},
+            ],
+        })
+    return "Here are the test cases you asked for:\n```json\n" + json.dumps(test_cases, indent=2) + "\n```\n"
+
+
+def timed(fn, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=1500, help="test cases in the synthetic output")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per implementation, best time is reported")
+    args = parser.parse_args()
+
+    text = build_model_output(args.cases)
+    print(f"Model output: {len(text) / 1024:.0f} KB, {args.cases} test cases")
+
+    sys.stdout = open(os.devnull, "w")
+    try:
+        legacy_time, legacy_result = timed(legacy_extract_and_repair_json, text, args.repeat)
+        current_time, current_result = timed(extract_and_repair_json, text, args.repeat)
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+
+    legacy_count = len(json.loads(legacy_result))
+    print(f"legacy : {legacy_time * 1000:8.1f} ms, {legacy_count} test cases recovered (returns a JSON string)")
+    print(f"current: {current_time * 1000:8.1f} ms, {len(current_result)} test cases recovered (returns Python objects)")
+    print(f"speedup: {legacy_time / current_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Load benchmark for the backend routes against local stub services.
+
+Starts the stub services (stub_services.py) and the backend in-process, wired to each
+other through environment variables, then drives every API route of app.py at the
+given concurrency and reports p50/p95/p99 latency and requests/sec per scenario.
+Nothing outside this machine is called.
+
+Usage (from the backend directory):
+    python benchmarks/bench_load.py [--server asgi] [--concurrency 16] [--requests 100]
+        [--scenarios get_test_cases,get_jira_labels] [--llm-latency 2 ...]
+        [--output results.json] [--compare baseline.json]
+
+--target http://host:port benchmarks an already running backend instead; it must be
+configured against the stub services (see stub_services.py), which can be started
+separately and named with --stub-url. Save a run with --output and pass it as
+--compare to a later run to see the change per scenario.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_services import StubConfig, start_stub_server
+
+PROJECT = "BENCH"
+
+
+def backend_environment(stub_url, llm_deployments=1):
+    """Environment that points the backend at the stub services, with rate limits out of the way."""
+    deployments = [{"name": f"bench-{n}", "engine": f"bench-{n}"} for n in range(1, llm_deployments + 1)]
+    return {
+        "LLM_DEPLOYMENTS": json.dumps(deployments) if llm_deployments > 1 else "",
+        "JIRA_ENDPOINT": stub_url,
+        "API_BASE": stub_url,
+        "API_TYPE": "azure",
+        "API_VERSION": "2023-05-15",
+        "API_MODEL": "bench",
+        "API_KEY": "bench",
+        "XRAY_BASE_URL": stub_url + "/api/v1",
+        "DOCUMENTATION_API_URL": stub_url + "/api/v1/documentation",
+        "SECRET_KEY": "benchmark-secret-key-for-local-runs",
+        "LLM_CACHE_DIR": tempfile.mkdtemp(prefix="bench_llm_cache_"),
+        "STORY_STORE_DIR": tempfile.mkdtemp(prefix="bench_story_store_"),
+        "SHARED_STATE_PATH": os.path.join(tempfile.mkdtemp(prefix="bench_shared_state_"), "shared_state.db"),
+        "GENERATION_STORE_PATH": os.path.join(tempfile.mkdtemp(prefix="bench_generations_"), "generations.db"),
+        "LLM_GLOBAL_RPM": "1000000",
+        "LLM_GLOBAL_TPM": "1000000000",
+        "LLM_USER_RPM": "1000000",
+        "LLM_USER_TPM": "1000000000",
+    }
+
+
+def start_backend(server):
+    """Imports the app (after the environment is set) and serves it on a free local port."""
+    if server == "asgi":
+        import uvicorn
+        import asgi
+
+        config = uvicorn.Config(asgi.app, host="127.0.0.1", port=0, log_level="warning", lifespan="on")
+        backend = uvicorn.Server(config)
+        threading.Thread(target=backend.run, name="backend", daemon=True).start()
+        while not backend.started:
+            time.sleep(0.05)
+        port = backend.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    import logging
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    backend = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=backend.serve_forever, name="backend", daemon=True).start()
+    return f"http://127.0.0.1:{backend.server_port}"
+
+
+class Client:
+    """Per-thread session holding the Jira JWT and Xray token obtained at start-up."""
+
+    def __init__(self, base_url, jwt_token, xray_token, use_cache):
+        self.base_url = base_url
+        self.jwt_token = jwt_token
+        self.xray_token = xray_token
+        self.use_cache = use_cache
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.cookies.set("jira", "bench-documentation-token")
+        return session
+
+    def request(self, method, path, token=None, **kwargs):
+        headers = {"Authorization": f"Bearer {token or self.jwt_token}"}
+        return self.session.request(method, self.base_url + path, headers=headers, timeout=600, **kwargs)
+
+    def generation_body(self, n, issues=1):
+        issue_id = [f"{PROJECT}-{n + i}" for i in range(issues)] if issues > 1 else f"{PROJECT}-{n}"
+        return {"issue_id": issue_id, "user_prompt": "", "no_cache": not self.use_cache}
+
+
+def import_body(n, size):
+    test_cases = [
+        {
+            "summary": f"Benchmark test {n}-{i}",
+            "description": "Imported by the load benchmark.",
+            "precondition": "None",
+            "steps": [{"action": "Do it", "data": "", "result": "It is done"}],
+        }
+        for i in range(size)
+    ]
+    return {"testcase_data": json.dumps(test_cases), "jira_issue_id": f"{PROJECT}-{n}", "xray_test_sets": ""}
+
+
+def wait_for_job(client, path, job_id, token=None):
+    while True:
+        response = client.request("GET", f"{path}/{job_id}?wait=30", token=token)
+        if response.status_code != 200 or response.json()["status"] in ("succeeded", "failed"):
+            return response.status_code == 200 and response.json()["status"] == "succeeded"
+
+
+def scenarios(args):
+    """Name -> fn(client, n) returning True on success. Multi-request flows are timed end to end."""
+    def get_test_cases(client, n):
+        return client.request("POST", "/get_test_cases", json=client.generation_body(n)).ok
+
+    def get_test_cases_batch(client, n):
+        return client.request("POST", "/get_test_cases", json=client.generation_body(n, args.batch_size)).ok
+
+    def stream_test_cases(client, n):
+        response = client.request("POST", "/stream_test_cases", json=client.generation_body(n), stream=True)
+        events = [json.loads(line) for line in response.iter_lines() if line]
+        return response.ok and bool(events) and events[-1]["type"] == "done"
+
+    def get_workflow(client, n):
+        return client.request("POST", "/get_workflow", json=client.generation_body(n)).ok
+
+    def generation_job(client, n):
+        response = client.request("POST", "/jobs/testcases", json=client.generation_body(n))
+        return response.status_code == 202 and wait_for_job(client, "/jobs", response.json()["job_id"])
+
+    def post_test_cases(client, n):
+        response = client.request("POST", "/post_test_cases", token=client.xray_token,
+                                  json=import_body(n, args.import_size))
+        return response.status_code == 200
+
+    def import_job(client, n):
+        body = dict(import_body(n, args.import_size), **{"async": True})
+        response = client.request("POST", "/post_test_cases", token=client.xray_token, json=body)
+        return response.status_code == 202 and wait_for_job(
+            client, "/import_jobs", response.json()["job_id"], token=client.xray_token
+        )
+
+    def update_jira_workflow(client, n):
+        body = {"jira_issue_id": f"{PROJECT}-{n}", "workflow": "1. Open\n2. Export"}
+        return client.request("POST", "/update_jira_workflow", json=body).ok
+
+    def add_fields(client, n):
+        body = {"labels": ["GenAi_testcase"], "component": "Component 1"}
+        return client.request("POST", f"/add_fields?key={PROJECT}-{n}", json=body).ok
+
+    def add_fields_bulk(client, n):
+        body = {"keys": [f"{PROJECT}-{n + i}" for i in range(args.batch_size)],
+                "labels": ["GenAi_testcase"], "component": "Component 1"}
+        return client.request("POST", "/add_fields/bulk", json=body).ok
+
+    def update_jira_workflow_bulk(client, n):
+        workflows = [{"jira_issue_id": f"{PROJECT}-{n + i}", "workflow": "1. Open\n2. Export"}
+                     for i in range(args.batch_size)]
+        return client.request("POST", "/update_jira_workflow/bulk", json={"workflows": workflows}).ok
+
+    def generations(client, n):
+        listed = client.request("GET", "/generations?limit=10")
+        entries = listed.json()["generations"] if listed.ok else []
+        if not entries:
+            return listed.ok
+        return client.request("GET", f"/generations/{entries[n % len(entries)]['id']}").ok
+
+    def get_jira_labels(client, n):
+        return client.request("GET", "/get-jira-labels").ok
+
+    def get_jira_labels_refresh(client, n):
+        return client.request("GET", "/get-jira-labels?refresh=true").ok
+
+    def get_jira_components(client, n):
+        return client.request("GET", f"/get-jira-components?project_id={PROJECT}&refresh=true").ok
+
+    def authenticate(client, n):
+        body = {"jira_email": "bench@example.com", "jira_token": "bench"}
+        return client.session.post(client.base_url + "/authenticate", json=body, timeout=60).ok
+
+    def authenticate_xray(client, n):
+        body = {"client_id": "bench", "client_secret": "bench"}
+        return client.session.post(client.base_url + "/authenticate-xray", json=body, timeout=60).ok
+
+    def vectorization_key(client, n):
+        stored = client.request("POST", "/store-vectorization-key", json={"vectorization_api_key": f"key-{n}"})
+        return stored.ok and client.request("GET", "/get-vectorization-key").ok
+
+    def llm_cache_stats(client, n):
+        return client.session.get(client.base_url + "/llm-cache/stats", timeout=60).ok
+
+    def metrics(client, n):
+        return client.session.get(client.base_url + "/metrics", timeout=60).ok
+
+    return {fn.__name__: fn for fn in (
+        get_test_cases, get_test_cases_batch, stream_test_cases, get_workflow, generation_job,
+        post_test_cases, import_job, update_jira_workflow, add_fields, update_jira_workflow_bulk,
+        add_fields_bulk, generations, get_jira_labels,
+        get_jira_labels_refresh, get_jira_components, authenticate, authenticate_xray,
+        vectorization_key, llm_cache_stats, metrics,
+    )}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, fn, total, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(n):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = fn(client, n)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<26}{'reqs':>6}{'errs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<26}{result['requests']:>6}{result['errors']:>6}{result['rps']:>9.1f}"
+              f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            def change(key):
+                return f"{(result[key] / previous[key] - 1) * 100:+.0f}%" if previous[key] else "n/a"
+            print(f"{'  vs baseline':<38}{change('rps'):>9}{change('p50_ms'):>10}{change('p95_ms'):>10}{change('p99_ms'):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask", help="how the in-process backend is served")
+    parser.add_argument("--target", help="URL of an already running backend to benchmark")
+    parser.add_argument("--stub-url", help="URL of already running stub services")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per scenario")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--scenarios", help="comma separated scenario names, all by default")
+    parser.add_argument("--batch-size", type=int, default=5, help="issues per get_test_cases_batch and bulk Jira write request")
+    parser.add_argument("--import-size", type=int, default=20, help="test cases per Xray import")
+    parser.add_argument("--llm-deployments", type=int, default=1, help="AI API deployments the backend routes completions over")
+    parser.add_argument("--use-cache", action="store_true", help="let generations reuse cached completions")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    StubConfig.add_arguments(parser)
+    args = parser.parse_args()
+
+    available = scenarios(args)
+    selected = args.scenarios.split(",") if args.scenarios else list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(available)})")
+
+    stub_url = args.stub_url
+    if not stub_url:
+        stub_url = start_stub_server(StubConfig.from_args(args)).url
+    base_url = args.target
+    if not base_url:
+        os.environ.update(backend_environment(stub_url, args.llm_deployments))
+        # The backend's pipeline logging would drown the report
+        sys.stdout = open(os.devnull, "w")
+        base_url = start_backend(args.server)
+
+    session = requests.Session()
+    jwt_token = session.post(base_url + "/authenticate", json={"jira_email": "bench@example.com", "jira_token": "bench"}).json()["jwt"]
+    xray_token = session.post(base_url + "/authenticate-xray", json={"client_id": "bench", "client_secret": "bench"}).json()["token"]
+    client = Client(base_url, jwt_token, xray_token, args.use_cache)
+
+    results = {}
+    for name in selected:
+        results[name] = run_scenario(client, available[name], args.requests, args.concurrency)
+
+    sys.stdout = sys.__stdout__
+    print(f"backend: {args.target or args.server}, concurrency {args.concurrency}, {args.requests} requests per scenario")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""
+Local stand-ins for the services the backend calls, for offline benchmarks.
+
+One HTTP server answers the Jira REST API (issues, search, transitions, bulk edit, labels,
+components), the Xray bulk import API (authenticate, import, job status), the OpenAI/Azure
+OpenAI chat completions API (including streaming) and the documentation (RAG) API. Latency,
+page counts, payload sizes and error rates are configurable, so runs are repeatable
+and cost nothing.
+
+Usage (from the backend directory):
+    python benchmarks/stub_services.py --port 8900 [--llm-latency 2 --error-rate 0.01 ...]
+
+then point the backend at it:
+    JIRA_ENDPOINT=http://127.0.0.1:8900
+    API_BASE=http://127.0.0.1:8900  API_TYPE=azure  API_VERSION=2023-05-15  API_MODEL=bench
+    XRAY_BASE_URL=http://127.0.0.1:8900/api/v1
+    DOCUMENTATION_API_URL=http://127.0.0.1:8900/api/v1/documentation
+
+bench_load.py starts this server itself unless given --stub-url.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import jwt
+
+
+class StubConfig:
+    """Knobs of the stub services. Latencies are mean seconds per request."""
+
+    def __init__(self, jira_latency=0.1, xray_latency=0.1, llm_latency=2.0, docs_latency=0.3,
+                 jitter=0.2, error_rate=0.0, label_total=1000, label_page_size=100,
+                 component_count=20, test_cases=10, steps=4, stream_chunk_chars=20,
+                 doc_chunks=10, doc_chunk_chars=1500, xray_pending_polls=1, llm_tail_rate=0.0,
+                 llm_tail_factor=10.0):
+        self.jira_latency = jira_latency
+        self.xray_latency = xray_latency
+        self.llm_latency = llm_latency
+        self.docs_latency = docs_latency
+        # Each latency is drawn uniformly from mean * (1 +/- jitter)
+        self.jitter = jitter
+        # Share of requests answered with an error (429 for the AI API, 503 elsewhere)
+        self.error_rate = error_rate
+        self.label_total = label_total
+        self.label_page_size = label_page_size
+        self.component_count = component_count
+        # Size of a completion: test cases per answer and steps per test case
+        self.test_cases = test_cases
+        self.steps = steps
+        self.stream_chunk_chars = stream_chunk_chars
+        self.doc_chunks = doc_chunks
+        self.doc_chunk_chars = doc_chunk_chars
+        # Status polls answered with "working" before an import job succeeds
+        self.xray_pending_polls = xray_pending_polls
+        # Share of completions that take llm_tail_factor times llm_latency, the AI API's slow tail
+        self.llm_tail_rate = llm_tail_rate
+        self.llm_tail_factor = llm_tail_factor
+
+    @classmethod
+    def add_arguments(cls, parser):
+        defaults = cls()
+        group = parser.add_argument_group("stub services")
+        for name, value in vars(defaults).items():
+            group.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(**{name: getattr(args, name) for name in vars(cls())})
+
+
+def completion_content(config, seed):
+    test_cases = [
+        {
+            "summary": f"Verify scenario {seed}-{n}",
+            "description": "Checks that the feature behaves as described in the acceptance criteria.",
+            "precondition": "User is logged in with a role that can use the feature.",
+            "steps": [
+                {"action": f"Perform step {s + 1}", "data": f"value-{s}", "result": "The expected result is shown"}
+                for s in range(config.steps)
+            ],
+        }
+        for n in range(config.test_cases)
+    ]
+    return "```json\n" + json.dumps(test_cases, indent=2) + "\n```"
+
+
+class StubState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.import_jobs = {}
+        self.bulk_tasks = {}
+        self.issue_counter = 0
+        self.requests = 0
+
+    def delay(self, mean):
+        if mean > 0:
+            jitter = self.config.jitter
+            time.sleep(mean * random.uniform(1 - jitter, 1 + jitter))
+
+    def fail(self):
+        return self.config.error_rate > 0 and random.random() < self.config.error_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StubServices/1.0"
+
+    routes = [
+        ("GET", r"/rest/api/2/serverInfo", "jira_server_info"),
+        ("GET", r"/rest/api/2/myself", "jira_myself"),
+        ("GET", r"/rest/api/2/issue/(?P<key>[^/]+)/transitions", "jira_transitions"),
+        ("POST", r"/rest/api/2/issue/(?P<key>[^/]+)/transitions", "jira_no_content"),
+        ("GET", r"/rest/api/2/issue/(?P<key>[^/]+)", "jira_issue"),
+        ("GET", r"/rest/api/2/search", "jira_search"),
+        ("POST", r"/rest/api/2/search", "jira_search"),
+        ("GET", r"/rest/api/(?P<version>[23])/search/jql", "jira_search_jql"),
+        ("POST", r"/rest/api/(?P<version>[23])/search/jql", "jira_search_jql"),
+        ("PUT", r"/rest/api/2/issue/(?P<key>[^/]+)", "jira_no_content"),
+        ("GET", r"/rest/api/3/label", "jira_labels"),
+        ("POST", r"/rest/api/3/bulk/issues/(?P<operation>fields|transition)", "jira_bulk_submit"),
+        ("GET", r"/rest/api/3/bulk/queue/(?P<task_id>[^/]+)", "jira_bulk_status"),
+        ("GET", r"/rest/api/2/project/(?P<key>[^/]+)/components", "jira_components"),
+        ("POST", r"/api/v1/authenticate", "xray_authenticate"),
+        ("POST", r"/api/v1/import/test/bulk", "xray_import"),
+        ("GET", r"/api/v1/import/test/bulk/(?P<job_id>[^/]+)/status", "xray_status"),
+        ("GET", r"/api/v1/documentation", "documentation"),
+        ("POST", r".*/chat/completions", "chat_completion"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        self.body = json.loads(raw_body) if raw_body else None
+        with self.state.lock:
+            self.state.requests += 1
+
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                return getattr(self, handler)(**match.groupdict())
+        self.send_json({"errorMessages": [f"No stub for {method} {url.path}"]}, 404)
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_unavailable(self):
+        self.send_json({"errorMessages": ["Stub failure"]}, 503)
+
+    # Jira
+
+    def jira_server_info(self):
+        self.send_json({
+            "baseUrl": f"http://{self.headers.get('Host')}",
+            "version": "1001.0.0", "versionNumbers": [1001, 0, 0],
+            "deploymentType": "Cloud", "buildNumber": 100001, "serverTitle": "Jira stub",
+        })
+
+    def jira_myself(self):
+        self.state.delay(self.state.config.jira_latency)
+        self.send_json({"accountId": "bench", "displayName": "Benchmark User", "active": True})
+
+    @staticmethod
+    def adf(text):
+        # Atlassian Document Format, which v3 returns for rich-text fields
+        return {"type": "doc", "version": 1, "content": [
+            {"type": "paragraph", "content": [{"type": "text", "text": line}]} for line in text.splitlines()
+        ]}
+
+    def issue_payload(self, key, fields=None, version="2"):
+        base = f"http://{self.headers.get('Host')}/rest/api/{version}"
+        issue_id = str(abs(hash(key)) % 10 ** 6)
+        all_fields = {
+            "summary": f"User can export the report of {key}",
+            "description": "As a user I want to export reports so that I can share them. " * 8,
+            "customfield_10059": "1. Open the report\n2. Click export\n3. Choose a format",
+            "customfield_10060": "Given a report, when the user exports it, then a file is downloaded. " * 4,
+            "labels": ["bench"],
+            "components": [],
+            "project": {"key": key.split("-")[0], "id": "10000"},
+        }
+        if version == "3":
+            for name in ("description", "customfield_10059", "customfield_10060"):
+                all_fields[name] = self.adf(all_fields[name])
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        if fields and "*all" not in fields:
+            all_fields = {name: value for name, value in all_fields.items() if name in fields}
+        return {"id": issue_id, "key": key, "self": f"{base}/issue/{issue_id}", "fields": all_fields}
+
+    def jira_issue(self, key):
+        self.state.delay(self.state.config.jira_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        self.send_json(self.issue_payload(key, self.query.get("fields")))
+
+    def search_keys(self, params):
+        # Answers `key in (...)` queries; every key is treated as an existing issue
+        match = re.search(r"key\s+in\s*\(([^)]*)\)", params.get("jql", ""), re.IGNORECASE)
+        return [key.strip().strip('"') for key in match.group(1).split(",")] if match else []
+
+    def jira_search(self):
+        self.state.delay(self.state.config.jira_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        params = self.body if self.body is not None else self.query
+        keys = self.search_keys(params)
+        start_at = int(params.get("startAt") or 0)
+        max_results = int(params.get("maxResults") or 50)
+        self.send_json({
+            "startAt": start_at, "maxResults": max_results, "total": len(keys),
+            "issues": [self.issue_payload(key, params.get("fields")) for key in keys[start_at:start_at + max_results]],
+        })
+
+    def jira_search_jql(self, version):
+        # Jira Cloud's search; the page token is just the offset of the next page
+        self.state.delay(self.state.config.jira_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        params = self.body if self.body is not None else self.query
+        keys = self.search_keys(params)
+        start_at = int(params.get("nextPageToken") or 0)
+        end = start_at + int(params.get("maxResults") or 50)
+        page = {"issues": [self.issue_payload(key, params.get("fields"), version) for key in keys[start_at:end]]}
+        if end < len(keys):
+            page["nextPageToken"] = str(end)
+        page["isLast"] = end >= len(keys)
+        self.send_json(page)
+
+    def jira_transitions(self, key):
+        self.state.delay(self.state.config.jira_latency)
+        self.send_json({"transitions": [{"id": "51", "name": "In Progress", "to": {"name": "In Progress"}}]})
+
+    def jira_no_content(self, key):
+        self.state.delay(self.state.config.jira_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def jira_labels(self):
+        self.state.delay(self.state.config.jira_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        config = self.state.config
+        start_at = int(self.query.get("startAt", 0))
+        page_size = int(self.query.get("maxResults", config.label_page_size))
+        values = [f"label-{n}" for n in range(start_at, min(start_at + page_size, config.label_total))]
+        self.send_json({
+            "values": values, "startAt": start_at, "maxResults": page_size,
+            "total": config.label_total, "isLast": start_at + page_size >= config.label_total,
+        })
+
+    def jira_components(self, key):
+        self.state.delay(self.state.config.jira_latency)
+        base = f"http://{self.headers.get('Host')}/rest/api/2"
+        self.send_json([
+            {"id": str(n), "name": f"Component {n}", "self": f"{base}/component/{n}"}
+            for n in range(self.state.config.component_count)
+        ])
+
+    def jira_bulk_submit(self, operation):
+        # Tasks finish at once; with --error-rate some issues are reported as failed
+        self.state.delay(self.state.config.jira_latency)
+        body = self.body or {}
+        if operation == "fields":
+            issue_ids = body.get("selectedIssueIdsOrKeys", [])
+        else:
+            issue_ids = [i for entry in body.get("bulkTransitionInputs", []) for i in entry["selectedIssueIdsOrKeys"]]
+        failed = {str(i): ["Stub failure"] for i in issue_ids if self.state.fail()}
+        task_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.bulk_tasks[task_id] = {
+                "taskId": task_id, "status": "COMPLETE", "progressPercent": 100,
+                "processedAccessibleIssues": [int(i) for i in issue_ids if str(i) not in failed],
+                "failedAccessibleIssues": failed, "totalIssueCount": len(issue_ids),
+            }
+        self.send_json({"taskId": task_id}, 201)
+
+    def jira_bulk_status(self, task_id):
+        self.state.delay(self.state.config.jira_latency)
+        with self.state.lock:
+            task = self.state.bulk_tasks.get(task_id)
+        if task is None:
+            return self.send_json({"errorMessages": ["Unknown task"]}, 404)
+        self.send_json(task)
+
+    # Xray
+
+    def xray_authenticate(self):
+        self.state.delay(self.state.config.xray_latency)
+        claims = {"sub": (self.body or {}).get("client_id"), "exp": int(time.time()) + 3600}
+        self.send_json(jwt.encode(claims, "stub-services-signing-key-0123456789"))
+
+    def xray_import(self):
+        self.state.delay(self.state.config.xray_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        job_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.import_jobs[job_id] = {"tests": len(self.body or []), "polls": 0}
+        self.send_json({"jobId": job_id})
+
+    def xray_status(self, job_id):
+        self.state.delay(self.state.config.xray_latency)
+        with self.state.lock:
+            job = self.state.import_jobs.get(job_id)
+            if job is None:
+                return self.send_json({"error": "Unknown job"}, 404)
+            job["polls"] += 1
+            if job["polls"] <= self.state.config.xray_pending_polls:
+                return self.send_json({"status": "working", "progress": []})
+            first = self.state.issue_counter
+            self.state.issue_counter += job["tests"]
+        issues = [{"id": str(first + n), "key": f"TEST-{first + n}"} for n in range(job["tests"])]
+        self.send_json({"status": "successful", "result": {"issues": issues, "errors": [], "warnings": []}})
+
+    # Documentation
+
+    def documentation(self):
+        self.state.delay(self.state.config.docs_latency)
+        if self.state.fail():
+            return self.send_unavailable()
+        config = self.state.config
+        words = (self.query.get("search_query") or "documentation").split()
+        chunks = []
+        for n in range(min(config.doc_chunks, int(self.query.get("max_items", config.doc_chunks)))):
+            text = " ".join(random.choice(words) for _ in range(config.doc_chunk_chars // 6))
+            chunks.append({"chunk": f"Section {n}: {text}"[:config.doc_chunk_chars], "score": 0.9})
+        self.send_json({"response": chunks})
+
+    # AI API
+
+    def chat_completion(self):
+        config = self.state.config
+        if self.state.fail():
+            self.state.delay(config.llm_latency / 10)
+            return self.send_json({"error": {"message": "Rate limit reached", "type": "requests"}}, 429,
+                                  {"Retry-After": "1"})
+
+        content = completion_content(config, random.randrange(10 ** 6))
+        prompt_chars = sum(len(m.get("content") or "") for m in self.body.get("messages", []))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = self.body.get("model", "bench")
+
+        if not self.body.get("stream"):
+            slow = config.llm_tail_rate > 0 and random.random() < config.llm_tail_rate
+            self.state.delay(config.llm_latency * (config.llm_tail_factor if slow else 1))
+            return self.send_json({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        # Server-sent events, with the latency spread over the chunks
+        pieces = [content[n:n + config.stream_chunk_chars] for n in range(0, len(content), config.stream_chunk_chars)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for n, piece in enumerate(pieces):
+            self.state.delay(config.llm_latency / len(pieces))
+            event = {
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config):
+        super().__init__(address, StubHandler)
+        self.state = StubState(config)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(config, host="127.0.0.1", port=0):
+    """Starts the stub services on a background thread and returns the server."""
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="stub-services", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    StubConfig.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), StubConfig.from_args(args))
+    print(f"Stub services listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
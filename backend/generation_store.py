@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import logging
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# SQLite database of generation results, shared by every worker process on the host; empty disables it
+GENERATION_STORE_PATH = os.getenv("GENERATION_STORE_PATH", "generations.db")
+# Generations older than this many days are deleted
+GENERATION_STORE_MAX_AGE_DAYS = float(os.getenv("GENERATION_STORE_MAX_AGE_DAYS", "30"))
+# Total compressed payload size before the oldest generations are deleted
+GENERATION_STORE_MAX_BYTES = int(os.getenv("GENERATION_STORE_MAX_BYTES", str(500 * 1024 * 1024)))
+# Retention runs after this many saves (and at startup)
+GENERATION_STORE_PRUNE_EVERY = int(os.getenv("GENERATION_STORE_PRUNE_EVERY", "100"))
+GENERATION_STORE_PAGE_SIZE = int(os.getenv("GENERATION_STORE_PAGE_SIZE", "20"))
+GENERATION_STORE_MAX_PAGE_SIZE = int(os.getenv("GENERATION_STORE_MAX_PAGE_SIZE", "100"))
+
+_schema = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    issue_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    user_prompt TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_user_created ON generations (user, created_at, id);
+CREATE INDEX IF NOT EXISTS generations_user_issue_created ON generations (user, issue_key, created_at, id);
+CREATE INDEX IF NOT EXISTS generations_created ON generations (created_at);
+"""
+
+# Columns of a listing entry; the payload is only read by `get`
+_summary_columns = "id, issue_key, kind, created_at, user_prompt, size"
+
+
+def _summary(row):
+    return {
+        "id": row[0], "issue_key": row[1], "kind": row[2], "created_at": row[3],
+        "user_prompt": row[4], "size": row[5],
+    }
+
+
+class GenerationStore:
+    """
+    SQLite store of generation results, so past test cases and workflows can be viewed again
+    without another model call.
+
+    Results are stored zlib-compressed, one row per issue and generation, and listed per user
+    newest first, optionally for one issue, with a keyset cursor so every page is an index
+    range scan. Every thread has its own connection; the database runs in WAL mode so
+    readers don't wait for writers. Rows older than `max_age` seconds, and the oldest rows
+    while the payloads exceed `max_bytes`, are deleted every `prune_every` saves.
+    """
+
+    def __init__(self, path=GENERATION_STORE_PATH, max_age=GENERATION_STORE_MAX_AGE_DAYS * 86400,
+                 max_bytes=GENERATION_STORE_MAX_BYTES, prune_every=GENERATION_STORE_PRUNE_EVERY):
+        self.path = path
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._saves = 0
+        self._initialized = False
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # Only takes effect on a new database, so it comes before anything writes to it
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                if not self._initialized:
+                    connection.executescript(_schema)
+                    self._initialized = True
+                    self.prune(connection)
+        return connection
+
+    @timed("store_generation")
+    def save(self, user, issue_key, kind, result, user_prompt=""):
+        """Stores one issue's generation result and returns its id."""
+        payload = zlib.compress(json.dumps(result).encode("utf-8"))
+        connection = self._connection()
+        cursor = connection.execute(
+            "INSERT INTO generations (user, issue_key, kind, created_at, user_prompt, size, payload) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user, issue_key, kind, time.time(), user_prompt or "", len(payload), payload),
+        )
+        with self._lock:
+            self._saves += 1
+            prune = self.prune_every > 0 and self._saves % self.prune_every == 0
+        if prune:
+            self.prune(connection)
+        return cursor.lastrowid
+
+    def list(self, user, issue_key=None, kind=None, cursor=None, limit=GENERATION_STORE_PAGE_SIZE):
+        """
+        Returns (entries, next_cursor) for a page of the user's generations, newest first.
+
+        Entries carry no payload. `cursor` is the `next_cursor` of the previous page; it is
+        None after the last page.
+        """
+        limit = max(1, min(int(limit), GENERATION_STORE_MAX_PAGE_SIZE))
+        query = f"SELECT {_summary_columns} FROM generations WHERE user = ?"
+        params = [user]
+        if issue_key:
+            query += " AND issue_key = ?"
+            params.append(issue_key)
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if cursor:
+            created_at, last_id = cursor.split(":")
+            query += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params.extend([float(created_at), float(created_at), int(last_id)])
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._connection().execute(query, params).fetchall()
+        entries = [_summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = f"{entries[-1]['created_at']!r}:{entries[-1]['id']}"
+        return entries, next_cursor
+
+    def get(self, user, generation_id):
+        """Returns the user's generation with its result, or None."""
+        row = self._connection().execute(
+            f"SELECT {_summary_columns}, payload FROM generations WHERE id = ? AND user = ?",
+            (generation_id, user),
+        ).fetchone()
+        if row is None:
+            return None
+        entry = _summary(row)
+        entry["result"] = json.loads(zlib.decompress(row[6]).decode("utf-8"))
+        return entry
+
+    def prune(self, connection=None):
+        """Applies the age and size retention; returns the number of deleted generations."""
+        connection = connection or self._connection()
+        deleted = 0
+        if self.max_age > 0:
+            deleted += connection.execute(
+                "DELETE FROM generations WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+        if self.max_bytes > 0:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+            # Delete down to 90% of the limit so retention doesn't run on every save
+            target = self.max_bytes * 0.9
+            while total > self.max_bytes:
+                rows = connection.execute(
+                    "SELECT id, size FROM generations ORDER BY created_at, id LIMIT 500"
+                ).fetchall()
+                if not rows:
+                    break
+                ids = []
+                for row_id, size in rows:
+                    if total <= target:
+                        break
+                    ids.append(row_id)
+                    total -= size
+                connection.execute(
+                    f"DELETE FROM generations WHERE id IN ({', '.join('?' * len(ids))})", ids
+                )
+                deleted += len(ids)
+                if total <= target:
+                    break
+        if deleted:
+            connection.execute("PRAGMA incremental_vacuum")
+            logger.info(f"Deleted {deleted} stored generations")
+        return deleted
+
+
+generation_store = GenerationStore()
+
+
+def store_generation_results(user, kind, results, user_prompt=""):
+    """
+    Saves every successful outcome of a `start_generating` result dict and adds its
+    "generation_id". A store failure is logged and does not fail the generation.
+    """
+    if not generation_store.enabled:
+        return results
+    for issue_key, outcome in results.items():
+        if outcome["status"] != "success":
+            continue
+        try:
+            outcome["generation_id"] = generation_store.save(user, issue_key, kind, outcome["result"], user_prompt)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to store generation for story {issue_key}: {e}")
+    return results
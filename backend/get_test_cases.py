@@ -1,11 +1,25 @@
 import os
+import hashlib
 import requests
-from jira import JIRA
 import re, json
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
 from openai_service import OpenAIService
+from jira_client import get_jira_client, jira_client_pool
+from issue_loader import load_issue, load_issues
+from ttl_cache import TTLCache
+from prompt_builder import build_test_case_prompt
+from rate_limiter import AdmissionRejected
+from metrics import track_stage, timed, outcome_of
+from helper import extract_and_repair_json
+from incremental import Regeneration, STORY_INCREMENTAL
+from logging_config import log_payload
+
+logger = logging.getLogger(__name__)
 
 system_prompt_for_test_cases = '''
 You are an assistant to an application that generates test cases for quality engineers (QEs) at a software company who are testing features and products currently under development. I will pass you the the name,description, workflow, and acceptance criteria (AC) specified for a development item. Using this information, please generate a json array of clear, reasonably detailed, and comprehensive test cases that will allowthe QEs to confirm that the defined functionality either works or does not work as intended. Each test case should clearly specify the set of actions that a QE should take to execute the test case. Generate enoughtest cases to confirm each aspect of the defined workflow. 
@@ -16,6 +30,17 @@ The array of test cases must adhere to the following json scheme:
 user_prompt_for_test_cases = "Given the information for the following development item, generate maximum set of test cases (in JSON Array provided) for {{summary}} with Description: {{description}}, Workflow: {{workflow}} and Acceptance Criteria: {{ac}} {{additional_user_input}}."
 
 prompt_for_workflow= "Generate Test strategy where functionality of {{summary}} with Description: {{description}} and Acceptance Criteria: {{ac}} {{additional_user_input}}. Please give scenarios titles only"
+
+# Upper bound on stories generated in parallel for a single batch request
+GENERATION_MAX_WORKERS = int(os.getenv("GENERATION_MAX_WORKERS", "8"))
+
+DOCUMENTATION_API_URL = os.getenv("DOCUMENTATION_API_URL", "https://gait-rag-services-poc.azurewebsites.net/api/v1/documentation")
+# Seconds to wait for the documentation service before generating without it
+DOCUMENTATION_TIMEOUT = float(os.getenv("DOCUMENTATION_TIMEOUT", "10"))
+DOCUMENTATION_CACHE_TTL = int(os.getenv("DOCUMENTATION_CACHE_TTL", "900"))
+
+documentation_session = requests.Session()
+documentation_cache = TTLCache(ttl=DOCUMENTATION_CACHE_TTL)
     
 
 def clean_text(text):
@@ -64,6 +89,34 @@ def get_search_query(title, description, acceptance_criteria):
     except:
         return search_query
 
+def documentation_cache_key(drsAccessToken, searchQuery, top_p, min_relevance_score):
+    token_hash = hashlib.sha256((drsAccessToken or "").encode("utf-8")).hexdigest()
+    return (searchQuery, top_p, min_relevance_score, token_hash)
+
+def documentation_request(drsAccessToken, searchQuery, top_p, min_relevance_score):
+    """The (headers, params) of a documentation lookup, shared with the async client."""
+    params = {
+        "search_query": searchQuery,
+        "max_items": top_p,
+        "min_relevance_score": min_relevance_score,
+    }
+
+    headers = {"Authorization": drsAccessToken or ""}
+    return headers, params
+
+def documentation_chunks(body):
+    return [element["chunk"] for element in body.get("response")]
+
+def _fetch_documentation(drsAccessToken, searchQuery, top_p, min_relevance_score):
+    headers, params = documentation_request(drsAccessToken, searchQuery, top_p, min_relevance_score)
+
+    response = documentation_session.get(
+        DOCUMENTATION_API_URL, headers=headers, params=params, timeout=DOCUMENTATION_TIMEOUT
+    )
+    response.raise_for_status()
+
+    return documentation_chunks(response.json())
+
 def get_documentation(drsAccessToken, searchQuery, top_p=10, min_relevance_score=0.6):
     """
     This function retrieves relevant documentation from a remote API using a provided access token and search query.
@@ -77,36 +130,71 @@ def get_documentation(drsAccessToken, searchQuery, top_p=10, min_relevance_score
     Returns:
         A list of strings containing the retrieved documentation snippets, or an empty list if retrieval fails.
 
-    Raises:
-        - Any exceptions raised during the API request or data processing (specific exceptions not listed).
-
     Notes:
-        - This function uses the `requests` library to make an HTTP GET request to a remote API.
-        - The API endpoint URL and expected data format are assumed to be known and not configurable through this function.
+        - Requests go through a shared keep-alive `requests.Session` and time out after
+          DOCUMENTATION_TIMEOUT seconds, so a slow service cannot stall the LLM call behind it.
+        - Successful results are cached for DOCUMENTATION_CACHE_TTL seconds per
+          (search query, top_p, min_relevance_score, access token). Identical lookups that
+          arrive while one is in flight wait for it instead of calling the API again.
+        - Failures are not cached.
+    """
+    cache_key = documentation_cache_key(drsAccessToken, searchQuery, top_p, min_relevance_score)
+    with track_stage("get_documentation") as stage:
+        try:
+            return documentation_cache.get_or_load(
+                cache_key,
+                lambda: _fetch_documentation(drsAccessToken, searchQuery, top_p, min_relevance_score),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to retrieve documentation: {e}")
+            stage.outcome = outcome_of(e)
+            return []
+
+def generation_context(additional_user_input):
+    """Everything besides the story that shapes its test cases; stored results are only reused for the same context."""
+    return json.dumps([additional_user_input, system_prompt_for_test_cases, user_prompt_for_test_cases])
 
+def story_search_query(story_data):
+    return get_search_query(story_data["summary"], story_data["description"], story_data["ac"])
+
+@timed("prompt_build")
+def compose_prompts(story_data, additional_user_input, select_prompt="testcases", relevant_documentation=None):
     """
-    relevant_documentation = ""
-    try:
+    Builds the (system prompt, user prompt) pair for a story.
 
-        url = "https://gait-rag-services-poc.azurewebsites.net/api/v1/documentation"
+    Args:
+        story_data: Story fields as returned by `issue_loader.load_issue` (dict).
+        additional_user_input: Extra text appended to the user prompt (string).
+        select_prompt (optional): "testcases" or "workflow". Defaults to "testcases".
+        relevant_documentation (optional): Documentation chunks for the test case prompt (list of strings).
 
-        params = {
-            "search_query": searchQuery,
-            "max_items": top_p,
-            "min_relevance_score": min_relevance_score,
-        }
+    Returns:
+        A tuple of the system prompt and the rendered user prompt (strings).
+    """
+    system_prompt = ""
+    if select_prompt == "testcases":
+        # setting system prompt for testcases
+        # base prompt is user prompt with additional details + any other user input
+        system_prompt = system_prompt_for_test_cases
 
-        headers = {"Authorization": drsAccessToken}
+        # Ranked documentation, trimmed to the prompt's token budget
+        base_prompt = build_test_case_prompt(
+            user_prompt_for_test_cases, relevant_documentation, story_search_query(story_data)
+        )
 
-        response = requests.request("GET", url, headers=headers, params=params).json()
-        response = response.get("response")
+    if select_prompt == "workflow":
+        base_prompt = prompt_for_workflow
 
-        relevant_documentation = [element["chunk"] for element in response]
+    for key in ["summary", "description", "workflow", "ac"]:
+        if story_data.get(key) is None:
+            continue
+        base_prompt = base_prompt.replace("{{" + key + "}}", story_data[key])
 
-        return relevant_documentation
+    base_prompt = base_prompt.replace("{{additional_user_input}}", additional_user_input)
 
-    except:
-        return relevant_documentation
+    log_payload(logger, "Prompts composed", system_prompt=system_prompt, payload=base_prompt)
+
+    return system_prompt, base_prompt
 
 class JiraService:
     def __init__(self, jira_email, jira_token):
@@ -116,76 +204,141 @@ class JiraService:
         self.openai_api_key = os.getenv("API_KEY")
 
     def jira_auth(self):
-        jiraOptions = {"server": self.server}
-        jira = JIRA(options=jiraOptions, basic_auth=(self.email, self.token))
-        user = jira.myself()
+        jira = get_jira_client(self.server, self.email, self.token)
+        try:
+            user = jira.myself()
+        except Exception:
+            jira_client_pool.invalidate(self.server, self.email, self.token)
+            raise
         return user["displayName"]
 
     def start_generating(
         self, user_story_list, additional_user_input, select_prompt="testcases",
-        drsAccessToken=None
+        drsAccessToken=None, use_cache=True
     ):
-        jiraOptions = {"server": self.server}
-        user_email = self.email
-        jira_token = self.token
-        jira = JIRA(options=jiraOptions, basic_auth=(user_email, jira_token))
-
-        for x, i in enumerate(user_story_list):
-            singleIssue = jira.issue(i)
-            print(f"issue id {singleIssue.key}")
-
-            if select_prompt == "testcases":
-                # setting system prompt for testcases
-                # base prompt is user prompt with additional details + any other user input
-                system_prompt = system_prompt_for_test_cases
-
-                searchQuery = get_search_query(
-                    singleIssue.fields.summary,
-                    singleIssue.fields.description,
-                    singleIssue.fields.customfield_10060,
-                )
-
-                print(
-                    f"Gathering relevant documentation from Azure AI Search for story."
+        """
+        Generates test cases (or a workflow) for every issue in `user_story_list` concurrently.
+
+        Args:
+            user_story_list: Jira issue keys to generate for (list of strings, or a single key).
+            additional_user_input: Extra text appended to every user prompt (string).
+            select_prompt (optional): "testcases" or "workflow". Defaults to "testcases".
+            drsAccessToken (optional): Access token for the documentation retrieval service.
+            use_cache (optional): Reuse cached completions for identical prompts. Defaults to True.
+
+        Returns:
+            A dict keyed by issue key, in input order. Each value is either
+            {"status": "success", "result": <completion>} or {"status": "error", "error": <message>}.
+            Errors caused by LLM rate limiting also carry "retry_after" (seconds).
+
+        Notes:
+            - Issues are processed on a bounded pool of GENERATION_MAX_WORKERS threads, so the
+              wall-clock time of a batch tracks its slowest story rather than the sum of all of them.
+            - A failure for one issue is reported in its entry and does not abort the others.
+            - Several issues are loaded up front with one JQL search; issues it did not return
+              are loaded one by one by their worker.
+        """
+        if isinstance(user_story_list, str):
+            user_story_list = [user_story_list]
+        user_story_list = list(dict.fromkeys(user_story_list))
+
+        jira = get_jira_client(self.server, self.email, self.token)
+
+        stories = {}
+        if len(user_story_list) > 1:
+            with track_stage("jira_fetch"):
+                stories = load_issues(jira, user_story_list)
+
+        results = {}
+        max_workers = max(1, min(GENERATION_MAX_WORKERS, len(user_story_list)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                issue_key: executor.submit(
+                    contextvars.copy_context().run, self.generate_for_issue, jira, x, issue_key, additional_user_input,
+                    select_prompt, drsAccessToken, use_cache, stories.get(issue_key)
                 )
-                relevant_documentation = get_documentation(drsAccessToken, searchQuery)
-
-                print(f"{x+1} Generating test cases for story..{i}")
-
-                if relevant_documentation:
-                    base_prompt = """
-                        Here's a summary of relevant content retrieved from Azure AI Search for your query:
-                        {}
-                        **User Query:** {}
-                    """.format(
-                        relevant_documentation, user_prompt_for_test_cases
-                    )
-                else:
-                    base_prompt = user_prompt_for_test_cases
-
-            if select_prompt == "workflow":
-                print(f"{x+1} Generating workflow for story..{i}")
-                base_prompt = prompt_for_workflow
-
-            story_data = {
-                "id": singleIssue.id,
-                "key": singleIssue.key,
-                "summary": singleIssue.fields.summary,
-                "description": singleIssue.fields.description,
-                "workflow": singleIssue.fields.customfield_10059,
-                "ac": singleIssue.fields.customfield_10060,
+                for x, issue_key in enumerate(user_story_list)
             }
-            for key in ["summary", "description", "workflow", "ac"]:
-                if story_data.get(key) is None:
-                    continue
-                base_prompt = base_prompt.replace("{{" + key + "}}", story_data[key])
-
-            base_prompt = base_prompt.replace("{{additional_user_input}}", additional_user_input)
+            for issue_key, future in futures.items():
+                try:
+                    results[issue_key] = {"status": "success", "result": future.result()}
+                except AdmissionRejected as e:
+                    logger.warning(f"Generation for story {issue_key} was not admitted: {e}")
+                    results[issue_key] = {"status": "error", "error": str(e), "retry_after": e.retry_after}
+                except Exception as e:
+                    logger.error(f"Failed to generate for story {issue_key}: {e}")
+                    results[issue_key] = {"status": "error", "error": str(e)}
+
+        return results
+
+    def generate_for_issue(
+        self, jira, x, i, additional_user_input, select_prompt="testcases",
+        drsAccessToken=None, use_cache=True, story_data=None
+    ):
+        """
+        Returns the completion for one issue. Test cases are returned parsed instead, with a
+        "change" mark each, when STORY_INCREMENTAL reuses and updates the story's stored ones.
+        """
+        regeneration = None
+        if select_prompt == "testcases" and STORY_INCREMENTAL:
+            if story_data is None:
+                with track_stage("jira_fetch"):
+                    story_data = load_issue(jira, i)
+            regeneration = Regeneration(
+                self.server, story_data, generation_context(additional_user_input), force=not use_cache
+            )
+            if regeneration.story_data_to_generate is None:
+                return regeneration.finish()
+            story_data = regeneration.story_data_to_generate
+
+        system_prompt, base_prompt = self.build_prompts(
+            jira, x, i, additional_user_input, select_prompt, drsAccessToken, story_data
+        )
+
+        result, complete = OpenAIService(self.openai_api_key, user=self.email).get_completion_with_status(
+            system_prompt, base_prompt, use_cache=use_cache
+        )
+        if not result:
+            raise RuntimeError(f"No completion returned from AI API for story {i}")
+
+        if regeneration is not None:
+            with track_stage("extract_and_repair_json"):
+                test_cases = extract_and_repair_json(result)
+            # A cut-off or unparsable completion is returned, but not kept as the story's test cases
+            return regeneration.finish(test_cases, store=complete and bool(test_cases))
+        return result
+
+    def stream_generating(
+        self, issue_key, additional_user_input, select_prompt="testcases",
+        drsAccessToken=None
+    ):
+        """
+        Yields the completion for a single issue as content deltas while it is generated.
+        """
+        jira = get_jira_client(self.server, self.email, self.token)
+        system_prompt, base_prompt = self.build_prompts(
+            jira, 0, issue_key, additional_user_input, select_prompt, drsAccessToken
+        )
+        yield from OpenAIService(self.openai_api_key, user=self.email).stream_completion(
+            system_prompt, base_prompt
+        )
+
+    def build_prompts(
+        self, jira, x, i, additional_user_input, select_prompt="testcases",
+        drsAccessToken=None, story_data=None
+    ):
+        if story_data is None:
+            with track_stage("jira_fetch"):
+                story_data = load_issue(jira, i)
+        logger.info(f"issue id {story_data['key']}")
 
-            print(f"System Prompt: {system_prompt}\nUser Prompt: {base_prompt}")
+        relevant_documentation = None
+        if select_prompt == "testcases":
+            logger.info("Gathering relevant documentation from Azure AI Search for story.")
+            relevant_documentation = get_documentation(drsAccessToken, story_search_query(story_data))
+            logger.info(f"{x+1} Generating test cases for story..{i}")
 
-            result = OpenAIService(self.openai_api_key).get_completion(
-                system_prompt, base_prompt
-            )
+        if select_prompt == "workflow":
+            logger.info(f"{x+1} Generating workflow for story..{i}")
 
-            return result
+        return compose_prompts(story_data, additional_user_input, select_prompt, relevant_documentation)
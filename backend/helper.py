@@ -1,44 +1,172 @@
 import json, re
+import logging
+
+from logging_config import log_payload
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+# Characters that change the scanner state outside string literals
+_structural = re.compile(r'[{}"]')
+# A complete string literal, honouring backslash escapes
+_string_literal = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+def _skip_object(text, pos, end):
+    """
+    Returns the index just past the object opening at text[pos], or `end` if it never closes.
+
+    Only braces outside string literals are counted, so text such as "enter {id}"
+    inside a value does not move the object boundary.
+    """
+    depth = 0
+    while True:
+        match = _structural.search(text, pos, end)
+        if match is None:
+            return end
+        char = match.group()
+        if char == '"':
+            literal = _string_literal.match(text, match.start(), end)
+            if literal is None:
+                return end
+            pos = literal.end()
+            continue
+        pos = match.end()
+        if char == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
 
 def extract_and_repair_json(input_string):
-    print("Extracting and repairing JSON data..." + input_string)
-    # Try to find the start of the JSON array
+    """
+    Extracts the objects of the JSON array embedded in a model response.
+
+    Args:
+        input_string: Raw completion text that contains a JSON array of objects (string).
+
+    Returns:
+        A list of the objects (dicts) that parsed successfully, in order. Objects that are
+        malformed or cut off are skipped.
+
+    Raises:
+        ValueError: If the input contains no JSON array.
+
+    Notes:
+        - The input is scanned once. Each top-level object is decoded in place with
+          `JSONDecoder.raw_decode`; only an object that fails to decode is walked by
+          `_skip_object` to find where the next one starts.
+        - Braces and brackets inside string literals are ignored.
+        - If the closing bracket is missing (a truncated completion) the complete objects
+          before the cut are still returned.
+    """
+    logger.info(f"Extracting and repairing JSON data ({len(input_string)} characters)...")
+    log_payload(logger, "Model output", input_string)
+    # Try to find the start and end of the JSON array
     start_index = input_string.find('[')
     if start_index == -1:
-        return 'No JSON array found in the input.'
-
-    # Attempt to isolate the JSON array part from the string
-    end_index = input_string.rfind(']') + 1
-    if end_index == 0:
-        return 'No JSON array found in the input.'
+        raise ValueError('No JSON array found in the input.')
 
-    json_part = input_string[start_index:end_index]
+    # A truncated completion has no closing bracket, keep the objects that did complete
+    end_index = input_string.rfind(']')
+    if end_index < start_index:
+        end_index = len(input_string)
 
-    # Attempt to fix common JSON array errors by parsing and reconstructing the array
     fixed_json_array = []
-    in_brackets = 0
-    current_object = ''
-    for char in json_part:
-        if char == '{':
-            if in_brackets == 0:
-                current_object = char
-            else:
-                current_object += char
-            in_brackets += 1
-        elif char == '}':
-            in_brackets -= 1
-            current_object += char
-            if in_brackets == 0:
-                try:
-                    # Attempt to parse the current object as JSON
-                    obj = json.loads(current_object)
-                    fixed_json_array.append(obj)
-                except json.JSONDecodeError:
-                    # If an error occurs, skip this object
-                    pass
+    pos = start_index + 1
+    while True:
+        match = _structural.search(input_string, pos, end_index)
+        if match is None:
+            break
+        char = match.group()
+        if char == '"':
+            # Stray string at array level, step over it
+            literal = _string_literal.match(input_string, match.start(), end_index)
+            if literal is None:
+                break
+            pos = literal.end()
+        elif char == '{':
+            try:
+                obj, pos = _decoder.raw_decode(input_string, match.start())
+                fixed_json_array.append(obj)
+            except json.JSONDecodeError:
+                # If an error occurs, skip this object
+                pos = _skip_object(input_string, match.start(), end_index)
         else:
-            if in_brackets > 0:
-                current_object += char
+            pos = match.end()
+
+    return fixed_json_array
+
+
+_leading_fence = re.compile(r'^\s*```[a-zA-Z]*[ \t]*\n?')
+
+
+def stitch_completions(parts):
+    """
+    Joins a completion that was produced by several continuation requests.
+
+    Continuations pick up mid-text, so parts are concatenated as-is, except for a markdown
+    code fence a continuation sometimes opens with.
+    """
+    if not parts:
+        return ""
+    return parts[0] + "".join(_leading_fence.sub("", part, count=1) for part in parts[1:])
+
+
+class TestCaseStreamParser:
+    """
+    Incrementally extracts complete objects from a JSON array that arrives in chunks.
+
+    `feed` returns every top-level object whose closing brace arrived in the chunk,
+    so a caller streaming an LLM completion can hand each test case on as soon as it
+    is complete. Braces inside string literals are ignored and objects that fail to
+    parse are skipped, mirroring `extract_and_repair_json`.
+    """
+
+    def __init__(self):
+        self._array_started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._pending = []
+
+    def feed(self, chunk):
+        objects = []
+        start = 0 if self._depth > 0 else None
+        for index, char in enumerate(chunk):
+            if not self._array_started:
+                if char == '[':
+                    self._array_started = True
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._depth > 0:
+                    self._in_string = True
+            elif char == '{':
+                if self._depth == 0:
+                    start = index
+                self._depth += 1
+            elif char == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._pending.append(chunk[start:index + 1])
+                    text = ''.join(self._pending)
+                    self._pending = []
+                    start = None
+                    try:
+                        objects.append(json.loads(text))
+                    except json.JSONDecodeError:
+                        pass
 
-    # Return the cleaned and reconstructed JSON array
-    return json.dumps(fixed_json_array)
+        if self._depth > 0 and start is not None:
+            self._pending.append(chunk[start:])
+        return objects
@@ -2,13 +2,24 @@ import requests
 import json
 import time
 import os
+import hashlib
+import threading
+import contextvars
+import logging
+import jwt
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from jira import JIRA
 
+from metrics import timed
+from logging_config import log_payload
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Constants
-BASE_URL = "https://xray.cloud.getxray.app/api/v1"
+BASE_URL = os.getenv("XRAY_BASE_URL", "https://xray.cloud.getxray.app/api/v1")
 JSON_FILE_PATH = "result.json"
 CLIENT_ID = os.getenv('xray_client_id')
 CLIENT_SECRET = os.getenv('xray_client_secret')
@@ -16,10 +27,292 @@ COMPONENT_NAME = 'General'
 LABEL_NAME = 'GenAi_testcase'
 AUTH_TOKEN_FILE = "auth_token.json"
 
+# Import job polling: first delay, growth factor, cap, and overall deadline (seconds)
+XRAY_POLL_INITIAL_DELAY = float(os.getenv("XRAY_POLL_INITIAL_DELAY", "0.5"))
+XRAY_POLL_BACKOFF = float(os.getenv("XRAY_POLL_BACKOFF", "2"))
+XRAY_POLL_MAX_DELAY = float(os.getenv("XRAY_POLL_MAX_DELAY", "10"))
+XRAY_POLL_DEADLINE = float(os.getenv("XRAY_POLL_DEADLINE", "300"))
+
+# Bulk imports are split into chunks bounded by test count and serialized size
+XRAY_IMPORT_CHUNK_SIZE = int(os.getenv("XRAY_IMPORT_CHUNK_SIZE", "50"))
+XRAY_IMPORT_CHUNK_MAX_BYTES = int(os.getenv("XRAY_IMPORT_CHUNK_MAX_BYTES", str(512 * 1024)))
+# Chunks submitted and polled at the same time
+XRAY_IMPORT_CONCURRENCY = int(os.getenv("XRAY_IMPORT_CONCURRENCY", "4"))
+# Extra attempts for the tests of a chunk that failed to import
+XRAY_IMPORT_CHUNK_RETRIES = int(os.getenv("XRAY_IMPORT_CHUNK_RETRIES", "2"))
+
+# Cached Xray tokens are no longer handed out this many seconds before they expire
+XRAY_TOKEN_EXPIRY_MARGIN = int(os.getenv("XRAY_TOKEN_EXPIRY_MARGIN", "300"))
+# A background refresh starts when a token is used this many seconds before expiry
+XRAY_TOKEN_REFRESH_AHEAD = int(os.getenv("XRAY_TOKEN_REFRESH_AHEAD", "1800"))
+# Lifetime assumed for a token whose expiry cannot be decoded
+XRAY_TOKEN_DEFAULT_LIFETIME = int(os.getenv("XRAY_TOKEN_DEFAULT_LIFETIME", "3600"))
+
+XRAY_JOB_SUCCESS_STATUSES = ("successful", "partially_successful")
+XRAY_JOB_FAILURE_STATUSES = ("failed", "unsuccessful")
+
+
+class XrayImportError(Exception):
+    """Raised when an Xray bulk import job fails or does not finish before its deadline."""
+
+    def __init__(self, message, status=None, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors or []
+
+
+class XrayImportTimeout(XrayImportError, TimeoutError):
+    """Raised when an Xray bulk import job is still running at its polling deadline."""
+
+def token_expiry(token):
+    """Returns the `exp` claim of a JWT as a Unix timestamp, or None if it cannot be read."""
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+
+def chunk_test_cases(test_cases, max_count=XRAY_IMPORT_CHUNK_SIZE, max_bytes=XRAY_IMPORT_CHUNK_MAX_BYTES):
+    """
+    Splits formatted tests into consecutive chunks of at most `max_count` tests and
+    roughly `max_bytes` of JSON each. A single test larger than `max_bytes` gets a chunk
+    of its own.
+    """
+    chunks = []
+    current = []
+    current_bytes = 2  # the enclosing brackets
+    for test_case in test_cases:
+        size = len(json.dumps(test_case)) + 1
+        if current and (len(current) >= max_count or current_bytes + size > max_bytes):
+            chunks.append(current)
+            current = []
+            current_bytes = 2
+        current.append(test_case)
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def apply_job_result(keys, pending, result):
+    """
+    Records the keys an import job created for the tests at indexes `pending` of `keys`.
+
+    Returns False when the created keys cannot be matched to individual tests.
+    """
+    issues = result.get("issues")
+    if issues is not None and all("elementNumber" in issue for issue in issues):
+        for issue in issues:
+            keys[pending[issue["elementNumber"]]] = issue["key"]
+        return True
+    if len(result["keys"]) == len(pending):
+        for n, key in zip(pending, result["keys"]):
+            keys[n] = key
+        return True
+    return False
+
+
+def merge_chunk_outcomes(outcomes):
+    """Combines per-chunk (keys, errors) outcomes into one import result, keys in input order."""
+    keys = [key for chunk_keys, _ in outcomes for key in chunk_keys if key is not None]
+    errors = [error for _, chunk_errors in outcomes for error in chunk_errors]
+    if not errors:
+        status = "successful"
+    elif keys:
+        status = "partially_successful"
+    else:
+        status = "failed"
+    return {"status": status, "keys": keys, "errors": errors}
+
+
+def job_status_outcome(job_id, data):
+    """
+    Interprets a 200 answer of the import job status endpoint: the job's outcome once it
+    succeeded, None while it is still running.
+
+    Raises:
+        XrayImportError: If the job failed.
+    """
+    status = data.get('status')
+    result = data.get('result') or {}
+    errors = result.get('errors', [])
+    if status in XRAY_JOB_SUCCESS_STATUSES:
+        logger.info(f"Job completed with status '{status}'.")
+        return {
+            "status": status,
+            "keys": [issue['key'] for issue in result.get('issues', [])],
+            "issues": result.get('issues', []),
+            "errors": errors,
+        }
+    if status in XRAY_JOB_FAILURE_STATUSES:
+        logger.error(f"Job {job_id} failed: {errors}")
+        raise XrayImportError(f"Xray import job {job_id} failed", status, errors)
+    return None
+
+
+class JobPolling:
+    """Backoff and deadline of polling one import job, shared by the blocking and async clients."""
+
+    def __init__(self, job_id, deadline=XRAY_POLL_DEADLINE):
+        self.job_id = job_id
+        self.deadline = deadline
+        self.status = None
+        self._started = time.monotonic()
+        self._delay = XRAY_POLL_INITIAL_DELAY
+
+    def next_delay(self):
+        """
+        Seconds to wait before the next poll.
+
+        Raises:
+            XrayImportTimeout: If the job would still be running past the deadline.
+        """
+        delay = self._delay
+        if time.monotonic() - self._started + delay > self.deadline:
+            raise XrayImportTimeout(
+                f"Xray import job {self.job_id} did not finish within {self.deadline} seconds", self.status
+            )
+        self._delay = min(delay * XRAY_POLL_BACKOFF, XRAY_POLL_MAX_DELAY)
+        return delay
+
+
+class ChunkImport:
+    """
+    The attempts at importing one chunk, without the I/O, so the blocking and async
+    clients retry chunks the same way.
+
+    While `next_attempt()` returns True, wait `delay` seconds, import `tests()` and report
+    the outcome with `imported` or `failed`; `outcome()` is the chunk's (keys, errors).
+
+    Tests are only posted again when their job definitely failed. When the job outcome is
+    unknown (it was still running at the polling deadline, or polling it failed), the job
+    may still create them, so they are reported with status "unknown" and the job id.
+    """
+
+    def __init__(self, chunk, retries=XRAY_IMPORT_CHUNK_RETRIES):
+        self.chunk = chunk
+        self.retries = retries
+        # keys[n] is the created key for chunk[n], None until it has been imported
+        self.keys = [None] * len(chunk)
+        self.errors = []
+        self.attempt = -1
+        self.delay = 0
+        self.pending = []
+        self._unmatched = None
+        self._unknown = False
+
+    def next_attempt(self):
+        if self._unmatched is not None or self._unknown or self.attempt >= self.retries:
+            return False
+        self.pending = [n for n, key in enumerate(self.keys) if key is None]
+        if not self.pending:
+            return False
+        self.attempt += 1
+        self.delay = 0
+        if self.attempt:
+            logger.info(f"Retrying {len(self.pending)} test cases (attempt {self.attempt + 1})...")
+            self.delay = min(XRAY_POLL_INITIAL_DELAY * XRAY_POLL_BACKOFF ** self.attempt, XRAY_POLL_MAX_DELAY)
+        return True
+
+    def tests(self):
+        return [self.chunk[n] for n in self.pending]
+
+    def imported(self, result):
+        self.errors = result["errors"]
+        if not apply_job_result(self.keys, self.pending, result):
+            # Created keys cannot be matched to tests, so retrying could duplicate them
+            logger.warning("Unable to match created keys to test cases, not retrying chunk.")
+            self._unmatched = result["keys"]
+
+    def failed(self, error, job_id=None):
+        """Records a failed attempt; `job_id` is the id of its job if the tests were posted."""
+        tests = [self.chunk[n]["fields"]["summary"] for n in self.pending]
+        definitely_failed = isinstance(error, XrayImportError) and not isinstance(error, XrayImportTimeout)
+        if job_id is not None and not definitely_failed:
+            logger.warning(f"Outcome of Xray import job {job_id} is unknown, not posting its tests again: {error}")
+            self._unknown = True
+            self.errors = [{"error": str(error), "status": "unknown", "job_id": job_id, "tests": tests}]
+            return
+        self.errors = [{"error": str(error), "errors": getattr(error, "errors", []), "tests": tests}]
+
+    def outcome(self):
+        if self._unmatched is not None:
+            return self._unmatched, self.errors
+        return self.keys, ([] if None not in self.keys else self.errors)
+
+
+class XrayTokenManager:
+    """
+    Reuses Xray API tokens per client id until shortly before they expire.
+
+    Expiry is read from the token's `exp` claim. A token used within
+    XRAY_TOKEN_REFRESH_AHEAD seconds of expiry is still returned, and a replacement is
+    fetched in the background. Concurrent callers that need a new token share a single
+    /authenticate call. A cached token is only reused with the secret that obtained it.
+    """
+
+    def __init__(self, authenticate):
+        self._authenticate = authenticate
+        self._tokens = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, client_id, secret):
+        """Returns the same {"status": ..., "data" | "error": ...} dict as `XrayImport.authenticate`."""
+        secret_hash = hashlib.sha256(secret.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._tokens.get(client_id)
+            if entry is not None and entry["secret_hash"] == secret_hash \
+                    and now < entry["expires_at"] - XRAY_TOKEN_EXPIRY_MARGIN:
+                if now >= entry["expires_at"] - XRAY_TOKEN_REFRESH_AHEAD and client_id not in self._inflight:
+                    threading.Thread(
+                        target=self._refresh, args=(client_id, secret, secret_hash), daemon=True
+                    ).start()
+                return {"status": 200, "data": entry["token"]}
+
+        return self._refresh(client_id, secret, secret_hash)
+
+    def invalidate(self, client_id):
+        with self._lock:
+            self._tokens.pop(client_id, None)
+
+    def _refresh(self, client_id, secret, secret_hash):
+        with self._lock:
+            inflight = self._inflight.get(client_id)
+            owner = inflight is None or inflight["secret_hash"] != secret_hash
+            if owner:
+                inflight = {"event": threading.Event(), "secret_hash": secret_hash, "result": None}
+                self._inflight[client_id] = inflight
+
+        if not owner:
+            inflight["event"].wait()
+            return inflight["result"]
+
+        result = {"status": 500, "error": "Authentication did not complete."}
+        try:
+            result = self._authenticate(client_id, secret)
+            token = result.get("data")
+            if result.get("status") == 200 and isinstance(token, str):
+                expires_at = token_expiry(token) or time.time() + XRAY_TOKEN_DEFAULT_LIFETIME
+                with self._lock:
+                    self._tokens[client_id] = {
+                        "token": token, "expires_at": expires_at, "secret_hash": secret_hash,
+                    }
+            return result
+        finally:
+            inflight["result"] = result
+            with self._lock:
+                if self._inflight.get(client_id) is inflight:
+                    del self._inflight[client_id]
+            inflight["event"].set()
+
+
 class XrayImport:
 
     def format_test_cases(self, json_data, jira_issue_id, xray_test_sets):
-        print("Formatting test cases...")
+        logger.info("Formatting test cases...")
         template = {
             "testtype": "Manual",
             "fields": {
@@ -49,7 +342,11 @@ class XrayImport:
     # xray
         
     def authenticate(self, client_id, secret):
-        print("Authenticating with Xray...")
+        """Returns a cached Xray token for the client when it is still valid, else authenticates."""
+        return xray_token_manager.get_token(client_id, secret)
+
+    def request_token(self, client_id, secret):
+        logger.info("Authenticating with Xray...")
         payload = {"client_id": client_id, "client_secret": secret}
         headers = {"Content-Type": "application/json"}
         response = requests.post(f"{BASE_URL}/authenticate", json=payload, headers=headers)
@@ -57,19 +354,20 @@ class XrayImport:
         if response.status_code == 200:
             auth_token = response.json()  # Assuming the token is in the 'auth_token' field
             if auth_token:
-                print("Auth token generated and saved.")
+                logger.info("Auth token generated.")
                 return {"status": 200, "data": auth_token}
             else:
-                print("Authentication succeeded but no token was returned.")
+                logger.warning("Authentication succeeded but no token was returned.")
                 return {"status": 200, "error": "Authentication succeeded but no token was returned."}
         else:
-            print("Authentication failed with status:", response.status_code)
+            logger.warning(f"Authentication failed with status: {response.status_code}")
             return {"status": response.status_code, "error": "Authentication failed."}
 
 
+    @timed("post_test_cases")
     def post_test_cases(self, auth_token, test_cases):
-        print("Posting test cases to Xray...")
-        print(test_cases)
+        logger.info(f"Posting {len(test_cases)} test cases to Xray...")
+        log_payload(logger, "Xray import payload", test_cases)
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {auth_token}"
@@ -77,17 +375,92 @@ class XrayImport:
         response = requests.post(BASE_URL + "/import/test/bulk", json=test_cases, headers=headers)
         response.raise_for_status()
         
-        print("Test cases posted successfully.")
+        logger.info("Test cases posted successfully.")
         return response.json()["jobId"]
 
-    def get_job_keys(self, auth_token, job_id):
-        print("Polling for job completion...")
+    def get_job_keys(self, auth_token, job_id, deadline=XRAY_POLL_DEADLINE):
+        return self.get_job_result(auth_token, job_id, deadline)["keys"]
+
+    def import_test_cases(self, auth_token, test_cases, chunk_size=XRAY_IMPORT_CHUNK_SIZE,
+                          max_bytes=XRAY_IMPORT_CHUNK_MAX_BYTES, concurrency=XRAY_IMPORT_CONCURRENCY,
+                          retries=XRAY_IMPORT_CHUNK_RETRIES):
+        """
+        Imports formatted tests as several bulk import jobs instead of one large payload.
+
+        The tests are split with `chunk_test_cases`, up to `concurrency` chunks are submitted
+        and polled at a time, and the tests of a chunk whose job failed are retried on their
+        own up to `retries` times. Tests of a job that was still running at the polling
+        deadline are not posted again; their error entry has "status": "unknown" and the
+        "job_id" to check in Xray.
+
+        Returns:
+            {"status": "successful" | "partially_successful" | "failed",
+             "keys": [...created keys in input order...], "errors": [...]}
+
+        Raises:
+            requests.HTTPError: If Xray rejects the token (401/403); nothing is retried then.
+        """
+        chunks = chunk_test_cases(test_cases, chunk_size, max_bytes)
+        logger.info(f"Importing {len(test_cases)} test cases in {len(chunks)} chunks...")
+        if not chunks:
+            return {"status": "successful", "keys": [], "errors": []}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._import_chunk, auth_token, chunk, retries)
+                for chunk in chunks
+            ]
+            outcomes = [future.result() for future in futures]
+
+        return merge_chunk_outcomes(outcomes)
+
+    def _import_chunk(self, auth_token, chunk, retries):
+        attempts = ChunkImport(chunk, retries)
+        while attempts.next_attempt():
+            time.sleep(attempts.delay)
+            job_id = None
+            try:
+                job_id = self.post_test_cases(auth_token, attempts.tests())
+                result = self.get_job_result(auth_token, job_id)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in (401, 403):
+                    raise
+                attempts.failed(e, job_id)
+            except (XrayImportError, requests.RequestException) as e:
+                attempts.failed(e, job_id)
+            else:
+                attempts.imported(result)
+        return attempts.outcome()
+
+    @timed("get_job_keys")
+    def get_job_result(self, auth_token, job_id, deadline=XRAY_POLL_DEADLINE):
+        """
+        Polls an import job until it finishes and returns its outcome.
+
+        Polling starts after XRAY_POLL_INITIAL_DELAY seconds and backs off exponentially up
+        to XRAY_POLL_MAX_DELAY, so small imports return quickly without hammering Xray.
+
+        Returns:
+            {"status": "successful" | "partially_successful", "keys": [...], "issues": [...],
+             "errors": [...]}
+
+        Raises:
+            XrayImportError: If the job fails, or is still running after `deadline` seconds.
+        """
+        logger.info("Polling for job completion...")
         headers = {"Authorization": f"Bearer {auth_token}"}
+        polling = JobPolling(job_id, deadline)
         while True:
-            response = requests.get(BASE_URL + f"/import/test/bulk/{job_id}/status", headers=headers)
+            response = requests.get(BASE_URL + f"/import/test/bulk/{job_id}/status", headers=headers, timeout=30)
             if response.status_code == 200:
                 data = response.json()
-                if data.get('status') == 'successful':
-                    print("Job completed successfully.")
-                    return [issue['key'] for issue in data['result']['issues']]
-            time.sleep(5)
\ No newline at end of file
+                polling.status = data.get('status')
+                result = job_status_outcome(job_id, data)
+                if result is not None:
+                    return result
+            elif response.status_code in (401, 403):
+                response.raise_for_status()
+            time.sleep(polling.next_delay())
+
+
+xray_token_manager = XrayTokenManager(XrayImport().request_token)
@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from testcase_dedup import shingles, test_case_text, jaccard, TESTCASE_DEDUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Reuse and incrementally update the stored test cases of a story instead of regenerating them
+STORY_INCREMENTAL = os.getenv("STORY_INCREMENTAL", "true").lower() in ("true", "1", "yes")
+# Directory of the per-story records (section fingerprints and the test cases built from them)
+STORY_STORE_DIR = os.getenv("STORY_STORE_DIR", ".story_store")
+# Story records not updated for this many days are deleted
+STORY_STORE_MAX_AGE_DAYS = float(os.getenv("STORY_STORE_MAX_AGE_DAYS", "90"))
+# Most story records kept; the least recently updated ones beyond this are deleted
+STORY_STORE_MAX_RECORDS = int(os.getenv("STORY_STORE_MAX_RECORDS", "50000"))
+# Retention runs after this many writes
+STORY_STORE_PRUNE_EVERY = int(os.getenv("STORY_STORE_PRUNE_EVERY", "100"))
+# Shingle similarity from which a regenerated test case counts as a changed version of an old one
+STORY_CHANGED_SIMILARITY = float(os.getenv("STORY_CHANGED_SIMILARITY", "0.3"))
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+
+# Sections that, when edited, change every test case; AC items are tracked one by one
+STORY_SECTIONS = ("summary", "description", "workflow")
+
+# Bullets and numbering in front of an AC item
+_item_marker = re.compile(r"^\s*(?:[*#\-•]+|\d+[.)]|[a-z][.)])\s*", re.IGNORECASE)
+_word = re.compile(r"[a-z0-9]{3,}")
+
+
+def fingerprint(text):
+    """Hash of a section's text, ignoring case and whitespace differences."""
+    normalized = " ".join((text or "").lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def ac_items(ac):
+    """Splits acceptance criteria into items: one per non-empty line, without bullets or numbering."""
+    items = []
+    for line in (ac or "").splitlines():
+        item = _item_marker.sub("", line).strip()
+        if item:
+            items.append(item)
+    return items
+
+
+def attribute(test_case, items):
+    """
+    Returns the fingerprint of the AC item a test case covers, or None for none in particular.
+
+    The item whose words the test case text covers best wins.
+    """
+    words = set(_word.findall(test_case_text(test_case).lower()))
+    best, best_score = None, 0.0
+    for item in items:
+        item_words = set(_word.findall(item.lower()))
+        if not item_words:
+            continue
+        score = len(words & item_words) / len(item_words)
+        if score > best_score:
+            best, best_score = fingerprint(item), score
+    return best
+
+
+def classify(new_cases, old_cases):
+    """
+    Marks each new test case as unchanged, changed or new against a pool of old test cases.
+
+    An identical old test case makes it unchanged, one with at least STORY_CHANGED_SIMILARITY
+    shingle similarity makes it changed. Each old test case matches one new test case at most.
+    """
+    pool = [(json.dumps(case, sort_keys=True), shingles(test_case_text(case))) for case in old_cases]
+    used = set()
+    changes = []
+    for case in new_cases:
+        text = json.dumps(case, sort_keys=True)
+        identical = next((n for n, (old_text, _) in enumerate(pool) if n not in used and old_text == text), None)
+        if identical is not None:
+            used.add(identical)
+            changes.append(UNCHANGED)
+            continue
+        hashed = shingles(test_case_text(case))
+        best, best_similarity = None, 0.0
+        for n, (_, old_hashed) in enumerate(pool):
+            if n not in used:
+                similarity = jaccard(hashed, old_hashed)
+                if similarity > best_similarity:
+                    best, best_similarity = n, similarity
+        if best is not None and best_similarity >= STORY_CHANGED_SIMILARITY:
+            used.add(best)
+            changes.append(CHANGED)
+        else:
+            changes.append(NEW)
+    return changes
+
+
+class StoryStore:
+    """
+    Per-story records of section fingerprints and the test cases generated from them.
+
+    One JSON file per (Jira site, issue key), written atomically, so every worker process
+    on the host shares the records. Every `prune_every` writes, records older than
+    `max_age` seconds, and the least recently updated ones beyond `max_records`, are deleted.
+    """
+
+    def __init__(self, store_dir=STORY_STORE_DIR, max_age=STORY_STORE_MAX_AGE_DAYS * 86400,
+                 max_records=STORY_STORE_MAX_RECORDS, prune_every=STORY_STORE_PRUNE_EVERY):
+        self.store_dir = store_dir
+        self.max_age = max_age
+        self.max_records = max_records
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, server, issue_key):
+        try:
+            with open(self._path(server, issue_key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, server, issue_key, record):
+        path = self._path(server, issue_key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to store test cases of story {issue_key}: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self.prune_every > 0 and self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Applies the age and count retention; returns the number of deleted records."""
+        records = []
+        for root, _, files in os.walk(self.store_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    records.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        records.sort()
+        expired = []
+        if self.max_age > 0:
+            cutoff = time.time() - self.max_age
+            expired = [path for mtime, path in records if mtime < cutoff]
+        if self.max_records > 0 and len(records) - len(expired) > self.max_records:
+            expired = [path for _, path in records[:len(records) - self.max_records]]
+        deleted = 0
+        for path in expired:
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError:
+                continue
+        if deleted:
+            logger.info(f"Deleted {deleted} stored story records")
+        return deleted
+
+    def _path(self, server, issue_key):
+        key = hashlib.sha256(f"{server}|{issue_key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.store_dir, key[:2], key + ".json")
+
+
+story_store = StoryStore()
+
+
+class Regeneration:
+    """
+    Decides how much of a story has to be generated again, and merges the result.
+
+    Compares the story's section and AC item fingerprints, and the generation context (the
+    additional user input and prompt), with the stored record:
+      - nothing changed: `story_data_to_generate` is None and `finish()` returns the stored
+        test cases, all unchanged;
+      - only AC items were added, edited or removed: `story_data_to_generate` is the story with
+        just the added and edited items as its AC, and `finish(generated)` replaces the test
+        cases of those items (and drops those of removed items) while keeping the rest;
+      - anything else, no record, or `force`: the whole story is generated.
+    Every test case returned by `finish` carries "change": "new", "changed" or "unchanged".
+    """
+
+    def __init__(self, server, story_data, context, force=False, store=story_store):
+        self.server = server
+        self.story_data = story_data
+        self.store = store
+        self.context = fingerprint(context)
+        self.sections = {name: fingerprint(story_data.get(name)) for name in STORY_SECTIONS}
+        self.items = ac_items(story_data.get("ac"))
+        self.record = store.get(server, story_data["key"])
+
+        self.changed_items = self.items
+        self.story_data_to_generate = story_data
+        if (force or self.record is None or self.record["context"] != self.context
+                or self.record["sections"] != self.sections):
+            self.mode = "full"
+            return
+
+        stored_items = set(self.record["ac_items"])
+        self.changed_items = [item for item in self.items if fingerprint(item) not in stored_items]
+        removed = stored_items - {fingerprint(item) for item in self.items}
+        if not self.changed_items and not removed:
+            self.mode = UNCHANGED
+            self.story_data_to_generate = None
+        elif not self.changed_items:
+            # Only removals: nothing to generate
+            self.mode = "partial"
+            self.story_data_to_generate = None
+        else:
+            self.mode = "partial"
+            self.story_data_to_generate = dict(story_data, ac="\n".join(self.changed_items))
+        logger.info(
+            f"Story {story_data['key']}: {self.mode} regeneration, "
+            f"{len(self.changed_items)} new or edited and {len(removed)} removed AC items"
+        )
+
+    def finish(self, generated=None, store=True):
+        """
+        Merges freshly generated test cases (a list of dicts) into the stored ones and stores
+        the result. Pass `store=False` for test cases of an incomplete completion (cut off, or
+        nothing parsed): they are merged and returned, but the record is left as it was, so
+        the next request generates them again.
+        """
+        generated = generated or []
+        if self.mode == UNCHANGED:
+            return [dict(entry["test_case"], change=UNCHANGED) for entry in self.record["test_cases"]]
+
+        current = {fingerprint(item) for item in self.items}
+        changed = {fingerprint(item) for item in self.changed_items}
+        if self.mode == "full":
+            kept, replaced = [], [entry["test_case"] for entry in (self.record or {}).get("test_cases", [])]
+        else:
+            kept = [
+                entry for entry in self.record["test_cases"]
+                if entry["ac"] is None or (entry["ac"] in current and entry["ac"] not in changed)
+            ]
+            replaced = [entry["test_case"] for entry in self.record["test_cases"] if entry not in kept]
+
+        if self.mode == "partial":
+            # The prompt still carries the unchanged sections, so some test cases come back again
+            kept_shingles = [shingles(test_case_text(entry["test_case"])) for entry in kept]
+            generated = [
+                case for case in generated
+                if not any(jaccard(shingles(test_case_text(case)), other) >= TESTCASE_DEDUP_THRESHOLD
+                           for other in kept_shingles)
+            ]
+        fresh = [{"ac": attribute(case, self.changed_items), "test_case": case} for case in generated]
+        changes = classify(generated, replaced)
+
+        if store:
+            self.store.put(self.server, self.story_data["key"], {
+                "context": self.context,
+                "sections": self.sections,
+                "ac_items": [fingerprint(item) for item in self.items],
+                "test_cases": kept + fresh,
+                "updated_at": time.time(),
+            })
+        return (
+            [dict(entry["test_case"], change=UNCHANGED) for entry in kept]
+            + [dict(entry["test_case"], change=change) for entry, change in zip(fresh, changes)]
+        )
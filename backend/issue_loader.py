@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import logging
+from jira import JIRAError
+
+logger = logging.getLogger(__name__)
+
+# Custom field ids differ between Jira sites; these are the ones of our site
+JIRA_WORKFLOW_FIELD = os.getenv("JIRA_WORKFLOW_FIELD", "customfield_10059")
+JIRA_AC_FIELD = os.getenv("JIRA_AC_FIELD", "customfield_10060")
+# Issues per search page, and keys per `key in (...)` query so the JQL stays short
+JIRA_SEARCH_PAGE_SIZE = int(os.getenv("JIRA_SEARCH_PAGE_SIZE", "100"))
+JIRA_SEARCH_MAX_KEYS = int(os.getenv("JIRA_SEARCH_MAX_KEYS", "100"))
+
+# Jira Cloud's token paginated search, and the offset paginated one of Server / Data Center.
+# Both are v2: v3 returns the description and rich-text custom fields as ADF documents
+# instead of the strings `jira.issue` gives
+SEARCH_JQL_PATH = "/rest/api/2/search/jql"
+SEARCH_PATH = "/rest/api/2/search"
+
+# Sites that answered SEARCH_JQL_PATH with 404; they are searched with SEARCH_PATH
+_sites_without_search_jql = set()
+
+# Only keys of this shape are put into JQL; anything else is loaded on its own
+_issue_key = re.compile(r"^[A-Za-z][A-Za-z0-9_]*-[0-9]+$")
+
+
+def story_fields():
+    """The only issue fields the prompts use."""
+    return ["summary", "description", JIRA_WORKFLOW_FIELD, JIRA_AC_FIELD]
+
+
+# ADF nodes that end a line of text
+_adf_blocks = {"paragraph", "heading", "listItem", "codeBlock", "blockquote", "rule", "tableRow"}
+
+
+def adf_to_text(value):
+    """
+    Plain text of an Atlassian Document Format value, one line per block; strings are
+    returned unchanged.
+    """
+    if not isinstance(value, (dict, list)):
+        return value
+    parts = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for child in node:
+                walk(child)
+            return
+        if not isinstance(node, dict):
+            return
+        if node.get("type") == "text":
+            parts.append(node.get("text") or "")
+        elif node.get("type") == "hardBreak":
+            parts.append("\n")
+        walk(node.get("content") or [])
+        if node.get("type") in _adf_blocks:
+            parts.append("\n")
+
+    walk(value)
+    return "\n".join(line.rstrip() for line in "".join(parts).splitlines() if line.strip())
+
+
+def story_data_from_raw(raw):
+    """Builds the story data the prompts use from an issue's REST representation."""
+    fields = raw.get("fields") or {}
+    return {
+        "id": raw["id"],
+        "key": raw["key"],
+        "summary": fields.get("summary"),
+        "description": adf_to_text(fields.get("description")),
+        "workflow": adf_to_text(fields.get(JIRA_WORKFLOW_FIELD)),
+        "ac": adf_to_text(fields.get(JIRA_AC_FIELD)),
+    }
+
+
+def key_batches(issue_keys):
+    """
+    Splits issue keys into `key in (...)` JQL queries of at most JIRA_SEARCH_MAX_KEYS keys.
+
+    Returns the queries and a map from the upper-cased key Jira returns to the requested key.
+    Keys that do not look like issue keys are left out rather than put into JQL.
+    """
+    wanted = {key.upper(): key for key in issue_keys if _issue_key.match(key)}
+    keys = list(wanted)
+    queries = [
+        "key in ({})".format(", ".join(keys[start:start + JIRA_SEARCH_MAX_KEYS]))
+        for start in range(0, len(keys), JIRA_SEARCH_MAX_KEYS)
+    ]
+    return queries, wanted
+
+
+def load_issue(jira, issue_key):
+    """Fetches one story with only the fields in `story_fields`."""
+    issue = jira.issue(issue_key, fields=",".join(story_fields()))
+    return story_data_from_raw(issue.raw)
+
+
+def search_path(server):
+    return SEARCH_PATH if server in _sites_without_search_jql else SEARCH_JQL_PATH
+
+
+def search_unavailable(server, path):
+    """Switches the site to SEARCH_PATH after SEARCH_JQL_PATH returned 404; True if it did."""
+    if path != SEARCH_JQL_PATH:
+        return False
+    _sites_without_search_jql.add(server)
+    return True
+
+
+def search_body(path, jql, fields, cursor):
+    body = {"jql": jql, "fields": fields, "maxResults": JIRA_SEARCH_PAGE_SIZE}
+    if path == SEARCH_JQL_PATH:
+        if cursor:
+            body["nextPageToken"] = cursor
+    else:
+        body["startAt"] = cursor or 0
+        body["validateQuery"] = "warn"
+    return body
+
+
+def next_cursor(path, page, cursor):
+    """The cursor of the page after `page`, or None when it was the last one."""
+    issues = page.get("issues", [])
+    if not issues:
+        return None
+    if path == SEARCH_JQL_PATH:
+        return page.get("nextPageToken")
+    start_at = (cursor or 0) + len(issues)
+    return start_at if start_at < page.get("total", 0) else None
+
+
+def collect_issues(page, wanted, found):
+    for raw in page.get("issues", []):
+        requested = wanted.get(raw["key"].upper())
+        if requested is not None:
+            found[requested] = raw
+
+
+class IssueSearch:
+    """
+    The requests of paginated `key in (...)` searches for `issue_keys`, without the I/O, so
+    the blocking and async clients page, fall back and collect issues the same way.
+
+    Send the (url, body) POST that `next_request` returns and report its outcome with
+    `page_received` or `request_failed`, until `next_request` returns None. `found` holds the
+    raw issues keyed by the requested issue key.
+    """
+
+    def __init__(self, server, issue_keys, fields):
+        self.server = server
+        self.fields = fields
+        self.queries, self.wanted = key_batches(issue_keys)
+        self.found = {}
+        self._query = 0
+        self._path = None
+        self._cursor = None
+
+    def next_request(self):
+        if self._query >= len(self.queries):
+            return None
+        self._path = search_path(self.server)
+        body = search_body(self._path, self.queries[self._query], self.fields, self._cursor)
+        return self.server + self._path, body
+
+    def page_received(self, page):
+        collect_issues(page, self.wanted, self.found)
+        self._cursor = next_cursor(self._path, page, self._cursor)
+        if self._cursor is None:
+            self._query += 1
+
+    def request_failed(self, status=None):
+        """
+        Records a failed request (`status` None: no response). Returns True if the search
+        is retried on SEARCH_PATH, False if the rest of the current query is given up.
+        """
+        self._cursor = None
+        if status == 404 and search_unavailable(self.server, self._path):
+            return True
+        self._query += 1
+        return False
+
+
+def search_issues(jira, issue_keys, fields):
+    """
+    Runs paginated `key in (...)` searches for `issue_keys`, returning only `fields`.
+
+    Returns a dict of raw issues keyed by the requested issue key. Keys that the search
+    did not return (unknown, moved or malformed keys, or a failed search) are left out.
+    """
+    search = IssueSearch(jira._options["server"], issue_keys, fields)
+    request = search.next_request()
+    while request is not None:
+        url, body = request
+        try:
+            response = jira._session.post(url, data=json.dumps(body))
+        except Exception as e:
+            if not search.request_failed(e.status_code if isinstance(e, JIRAError) else None):
+                logger.warning(f"Issue search failed: {e}")
+        else:
+            search.page_received(response.json())
+        request = search.next_request()
+    return search.found
+
+
+def load_issues(jira, issue_keys):
+    """
+    Fetches many stories with paginated `key in (...)` searches instead of one request each.
+
+    Returns a dict of story data keyed by the requested issue key. Keys that the search
+    did not return are left out, so callers can load them with `load_issue` and get the
+    usual error for each.
+    """
+    stories = {
+        key: story_data_from_raw(raw) for key, raw in search_issues(jira, issue_keys, story_fields()).items()
+    }
+    logger.info(f"Loaded {len(stories)} of {len(issue_keys)} issues with JQL search")
+    return stories
@@ -0,0 +1,113 @@
+import os
+import time
+import hashlib
+import threading
+import logging
+from jira import JIRA
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Clients unused for this many seconds are closed and dropped from the pool
+JIRA_CLIENT_IDLE_TTL = int(os.getenv("JIRA_CLIENT_IDLE_TTL", "900"))
+# Keep-alive connections held open per client, sized for the batch generation pool
+JIRA_CLIENT_POOL_SIZE = int(os.getenv("JIRA_CLIENT_POOL_SIZE", "16"))
+
+
+class JiraClientPool:
+    """
+    Process-wide cache of authenticated JIRA clients, keyed by (server, email, token hash).
+
+    Building a `JIRA` client opens a new TCP/TLS session and runs the library's
+    server-info handshake, so clients are created once per credential and shared
+    between requests and threads. Each client's HTTP session keeps a pool of
+    keep-alive connections, and clients left idle longer than `idle_ttl` seconds are
+    dropped from the pool on the next access to it. A caller may still be using a dropped
+    client, so its session is left to `JIRA.__del__` to close once nobody holds it.
+    """
+
+    def __init__(self, idle_ttl=JIRA_CLIENT_IDLE_TTL, pool_size=JIRA_CLIENT_POOL_SIZE):
+        self.idle_ttl = idle_ttl
+        self.pool_size = pool_size
+        self._clients = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cache_key(server, email, token):
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        return (server, email, token_hash)
+
+    def get(self, server, email, token):
+        """
+        Returns the shared client for the given credential, creating it on first use.
+
+        Concurrent callers with the same credential wait for a single client to be
+        built instead of each running the handshake.
+        """
+        key = self._cache_key(server, email, token)
+        with self._lock:
+            self._evict_idle()
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry["last_used"] = time.monotonic()
+                return entry["client"]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._clients.get(key)
+                if entry is not None:
+                    entry["last_used"] = time.monotonic()
+                    return entry["client"]
+
+            try:
+                client = self._create_client(server, email, token)
+                with self._lock:
+                    self._clients[key] = {"client": client, "last_used": time.monotonic()}
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            return client
+
+    def invalidate(self, server, email, token):
+        """
+        Drops the client for a credential, e.g. after an authentication failure. Other
+        threads may still be using it, so it is not closed here either.
+        """
+        key = self._cache_key(server, email, token)
+        with self._lock:
+            self._clients.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for entry in entries:
+            entry["client"].close()
+
+    def _evict_idle(self):
+        # Called with self._lock held
+        now = time.monotonic()
+        expired = [
+            key for key, entry in self._clients.items()
+            if now - entry["last_used"] > self.idle_ttl
+        ]
+        for key in expired:
+            # Not closed here: a request may have taken the client just before it expired
+            del self._clients[key]
+
+    def _create_client(self, server, email, token):
+        logger.info(f"Creating JIRA client for {email} on {server}")
+        client = JIRA(options={"server": server}, basic_auth=(email, token))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        client._session.mount("https://", adapter)
+        client._session.mount("http://", adapter)
+        return client
+
+
+jira_client_pool = JiraClientPool()
+
+
+def get_jira_client(server, email, token):
+    return jira_client_pool.get(server, email, token)
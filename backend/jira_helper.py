@@ -1,7 +1,150 @@
 import os
-from jira import JIRA, JIRAError
-import requests
-from requests.auth import HTTPBasicAuth
+import json
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from jira import JIRAError
+from jira_client import get_jira_client
+from issue_loader import JIRA_WORKFLOW_FIELD, search_issues
+from ttl_cache import TTLCache
+from logging_config import log_payload
+
+logger = logging.getLogger(__name__)
+
+# Labels and components change rarely, keep them for this many seconds
+JIRA_METADATA_CACHE_TTL = int(os.getenv("JIRA_METADATA_CACHE_TTL", "1800"))
+# Label pages fetched in parallel once the first page reveals the total
+JIRA_LABEL_PAGE_WORKERS = int(os.getenv("JIRA_LABEL_PAGE_WORKERS", "8"))
+
+metadata_cache = TTLCache(ttl=JIRA_METADATA_CACHE_TTL)
+
+# Transition that moves a story to "In Progress"
+JIRA_IN_PROGRESS_TRANSITION = os.getenv("JIRA_IN_PROGRESS_TRANSITION", "51")
+GENAI_TEST_STRATEGY_LABEL = "GenAI_TestStrategy"
+
+# (server, transition) pairs whose screen rejected field changes; those are sent separately
+_transitions_without_fields = set()
+
+# Issues written concurrently by the bulk endpoints
+JIRA_BULK_WRITE_WORKERS = int(os.getenv("JIRA_BULK_WRITE_WORKERS", "8"))
+# "auto" uses the Jira Cloud bulk edit API when the site has it, "true"/"false" force it on or off
+JIRA_BULK_EDIT = os.getenv("JIRA_BULK_EDIT", "auto").lower()
+# Issues per bulk edit or bulk transition task; Jira accepts up to 1000
+JIRA_BULK_EDIT_MAX_ISSUES = int(os.getenv("JIRA_BULK_EDIT_MAX_ISSUES", "1000"))
+# Seconds to wait for a bulk task before writing its issues one by one
+JIRA_BULK_EDIT_TIMEOUT = float(os.getenv("JIRA_BULK_EDIT_TIMEOUT", "120"))
+JIRA_BULK_EDIT_POLL_INTERVAL = float(os.getenv("JIRA_BULK_EDIT_POLL_INTERVAL", "1"))
+
+BULK_TASK_FINAL_STATUSES = {"COMPLETE", "FAILED", "CANCELLED", "DEAD"}
+
+# Sites that answered the bulk edit API with 404
+_sites_without_bulk_edit = set()
+
+
+class IssueWrite:
+    """
+    Collects changes to one issue and sends them in as few requests as Jira allows.
+
+    Field values and label add-operations go into a single update. With a transition,
+    they are sent as part of the transition request; if the transition screen does not
+    accept them, the update and the transition are sent one after the other, and later
+    writes to that site skip the combined attempt.
+    """
+
+    def __init__(self, issue_key):
+        self.issue_key = issue_key
+        self.fields = {}
+        self.update = {}
+        self.transition = None
+
+    def set_field(self, name, value):
+        self.fields[name] = value
+        return self
+
+    def add_labels(self, labels):
+        operations = self.update.setdefault("labels", [])
+        for label in labels:
+            if {"add": label} not in operations:
+                operations.append({"add": label})
+        return self
+
+    def transition_to(self, transition_id):
+        self.transition = transition_id
+        return self
+
+    def has_changes(self):
+        return bool(self.fields or self.update)
+
+    def payload(self):
+        payload = {}
+        if self.fields:
+            payload["fields"] = self.fields
+        if self.update:
+            payload["update"] = self.update
+        return payload
+
+    def send(self, jira):
+        """Sends the collected changes; returns the number of requests made."""
+        if self.transition is None:
+            if not self.has_changes():
+                return 0
+            self._put(jira)
+            return 1
+
+        requests_made = 0
+        site_transition = (jira._options["server"], str(self.transition))
+        rejected_fields = False
+        if self.has_changes() and site_transition not in _transitions_without_fields:
+            requests_made += 1
+            try:
+                self._post_transition(jira, self.payload())
+                return requests_made
+            except JIRAError as e:
+                if e.status_code != 400:
+                    raise
+                logger.info(f"Transition {self.transition} rejected the field changes, sending them separately: {e.text}")
+                rejected_fields = True
+
+        if self.has_changes():
+            self._put(jira)
+            requests_made += 1
+            if rejected_fields:
+                # The same changes were accepted on their own, so the transition screen rejected them
+                _transitions_without_fields.add(site_transition)
+        self._post_transition(jira, {})
+        return requests_made + 1
+
+    def _put(self, jira):
+        jira._session.put(jira._get_url(f"issue/{self.issue_key}"), data=json.dumps(self.payload()))
+
+    def _post_transition(self, jira, payload):
+        body = dict(payload, transition={"id": str(self.transition)})
+        jira._session.post(jira._get_url(f"issue/{self.issue_key}/transitions"), data=json.dumps(body))
+
+
+def field_errors(error):
+    """Returns Jira's per-field error messages from a failed write, if it has any."""
+    try:
+        return error.response.json().get("errors", {}) or {}
+    except (AttributeError, ValueError):
+        return {}
+
+
+def write_outcome(operation, issue_key, *args):
+    """Runs one issue write, turning its failure into a per-issue result instead of raising."""
+    try:
+        operation(issue_key, *args)
+        return {"status": "success"}
+    except PermissionError as e:
+        return {"status": "permission_denied", "error": str(e)}
+    except JIRAError as e:
+        if e.status_code in (401, 403):
+            return {"status": "permission_denied", "error": e.text or str(e)}
+        return {"status": "error", "error": e.text or str(e)}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
 
 class JiraHelper:
     def __init__(self, jira_email, jira_token):
@@ -10,106 +153,278 @@ class JiraHelper:
         self.token = jira_token
 
     def add_fields(self, issue_key, component, labels):
-        print(f"Updating JIRA issue {issue_key}...")
+        """
+        Sets the component, adds the labels and moves the issue to In Progress.
 
-        jiraOptions = {'server': self.server}
-        jira = JIRA(options=jiraOptions, basic_auth=(self.email, self.token))
+        All changes go in one request when the transition screen accepts them, two otherwise.
+        Rejected components or labels are raised as PermissionError.
+        """
+        logger.info(f"Updating JIRA issue {issue_key}...")
 
-        try:
-            issue = jira.issue(issue_key)
+        jira = get_jira_client(self.server, self.email, self.token)
 
-            if component:
-                try:
-                    new_components = [{'name': component}]
-                    issue.update(fields={'components': new_components})
-                    print(f"Component '{component}' updated successfully.")
-                except JIRAError as e:
-                    if 'components' in e.response.json().get('errors', {}):
-                        print(f"Error updating component: {e.response.json()['errors']['components']}")
-                        raise PermissionError(e.response.json()['errors']['components'])
-                    else:
-                        print(f"Error updating component: {e}")
-                        raise
-
-            if len(labels) > 0:
-                try:
-                    issue.update(fields={"labels": labels})
-                    print(f"Labels '{labels}' updated successfully.")
-                except JIRAError as e:
-                    if 'labels' in e.response.json().get('errors', {}):
-                        print(f"Error updating labels: {e.response.json()['errors']['labels']}")
-                        raise PermissionError(e.response.json()['errors']['labels'])
-                    else:
-                        print(f"Error updating labels: {e}")
-                        raise
-
-            print(f"JIRA issue {issue_key} setting to In Progress...")
-            jira.transition_issue(issue, 51)  # Assumes '51' is the ID for "In Progress"
-            print(f"JIRA issue {issue_key} updated to In Progress.")
+        write = IssueWrite(issue_key).transition_to(JIRA_IN_PROGRESS_TRANSITION)
+        if component:
+            write.set_field("components", [{"name": component}])
+        if len(labels) > 0:
+            write.add_labels(labels)
 
+        try:
+            write.send(jira)
         except JIRAError as e:
-            print(f"Failed to update JIRA issue {issue_key}: {e}")
+            errors = field_errors(e)
+            for field in ("components", "labels"):
+                if field in errors:
+                    logger.error(f"Error updating {field}: {errors[field]}")
+                    raise PermissionError(errors[field])
+            logger.error(f"Failed to update JIRA issue {issue_key}: {e}")
             raise
 
+        if len(labels) > 0:
+            # A label can be new to the site, drop the cached list
+            metadata_cache.invalidate(("labels", self.server))
+        logger.info(f"JIRA issue {issue_key} updated to In Progress with component {component} and labels {labels}.")
 
-    def get_labels(self):
-        jira_url = self.server
-        jira_user = self.email
-        jira_token = self.token
-        
-        # Endpoint to get all labels
-        url = f"{jira_url}/rest/api/3/label"
-
-        labels = []
-        start_at = 0
-        total = None
-
-        while total is None or start_at < total:
-            # Make the request to the API
-            response = requests.get(
-                f"{url}?startAt={start_at}",
-                auth=HTTPBasicAuth(jira_user, jira_token)
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                labels.extend(data['values'])
-                total = data['total']  # Total number of labels across all pages
-                start_at += len(data['values'])  # Update startAt for the next page
-                print(f"Retrieved {len(data['values'])} labels, Total so far: {len(labels)}")
-            else:
-                print(f"Failed to retrieve labels. Status code: {response.status_code}, Response: {response.text}")
+    def bulk_add_fields(self, issue_keys, component, labels):
+        """
+        `add_fields` for many issues, returning a per-issue result instead of raising.
+
+        Args:
+            issue_keys: Jira issue keys to update (list of strings).
+            component: Component name to set, or None.
+            labels: Labels to add (list of strings).
+
+        Returns:
+            A dict keyed by issue key, in input order. Each value is {"status": "success"},
+            {"status": "permission_denied", "error": <message>} or {"status": "error", "error": <message>}.
+
+        Notes:
+            - On sites with the bulk edit API (see JIRA_BULK_EDIT) the fields and the transition
+              are applied with one bulk task each per project.
+            - Issues the bulk tasks did not process, or all issues without the bulk edit API,
+              are updated with `add_fields` on up to JIRA_BULK_WRITE_WORKERS threads.
+        """
+        issue_keys = list(dict.fromkeys(issue_keys))
+        jira = get_jira_client(self.server, self.email, self.token)
+
+        results = {}
+        if self._use_bulk_edit(jira):
+            try:
+                results = self._bulk_edit_fields(jira, issue_keys, component, labels)
+            except Exception as e:
+                if isinstance(e, JIRAError) and e.status_code == 404:
+                    _sites_without_bulk_edit.add(self.server)
+                logger.warning(f"Bulk edit failed, updating issues one by one: {e}")
+            if labels and results:
+                metadata_cache.invalidate(("labels", self.server))
+
+        remaining = [key for key in issue_keys if key not in results]
+        results.update(self._fan_out(self.add_fields, {key: (component, labels) for key in remaining}))
+        return {key: results[key] for key in issue_keys}
+
+    def bulk_set_workflow(self, workflows):
+        """
+        `set_workflow` for many issues, given as a dict of issue key to workflow text.
+
+        Every issue gets its own text appended to its own current workflow, which the bulk
+        edit API cannot express, so the issues are written concurrently on up to
+        JIRA_BULK_WRITE_WORKERS threads. Returns per-issue results like `bulk_add_fields`.
+        """
+        return self._fan_out(self.set_workflow, {key: (workflow,) for key, workflow in workflows.items()})
+
+    def _fan_out(self, operation, issue_args):
+        results = {}
+        if not issue_args:
+            return results
+        max_workers = max(1, min(JIRA_BULK_WRITE_WORKERS, len(issue_args)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                key: executor.submit(contextvars.copy_context().run, write_outcome, operation, key, *args)
+                for key, args in issue_args.items()
+            }
+            for key, future in futures.items():
+                results[key] = future.result()
+        return results
+
+    def _use_bulk_edit(self, jira):
+        if JIRA_BULK_EDIT in ("false", "0", "no") or self.server in _sites_without_bulk_edit:
+            return False
+        if JIRA_BULK_EDIT in ("true", "1", "yes"):
+            return True
+        # The bulk edit API only exists on Jira Cloud
+        return getattr(jira, "_is_cloud", False)
+
+    def _bulk_edit_fields(self, jira, issue_keys, component, labels):
+        """
+        Sets the component and adds the labels with bulk edit tasks, one per project, then
+        moves the edited issues to In Progress with bulk transition tasks.
+
+        Returns {"status": "success"} for the issues both tasks processed; every other issue
+        is left out of the result.
+        """
+        # Bulk task results name issues by id, and components are looked up per project
+        raw_issues = search_issues(jira, issue_keys, ["project"])
+        keys_by_id = {raw["id"]: key for key, raw in raw_issues.items()}
+        projects = {}
+        for key, raw in raw_issues.items():
+            projects.setdefault(raw["fields"]["project"]["key"], []).append(key)
+
+        edited_ids = []
+        for project_key, keys in projects.items():
+            edited = {"labelsFields": [], "multiselectComponents": None}
+            actions = []
+            if labels:
+                actions.append("labels")
+                edited["labelsFields"].append({
+                    "fieldId": "labels", "bulkEditMultiSelectFieldOption": "ADD",
+                    "labels": [{"name": label} for label in labels],
+                })
+            if component:
+                component_id = self._component_ids(project_key).get(component)
+                if component_id is None:
+                    # Left to `add_fields`, which reports Jira's error for the component
+                    continue
+                actions.append("components")
+                edited["multiselectComponents"] = {
+                    "fieldId": "components", "bulkEditMultiSelectFieldOption": "REPLACE",
+                    "components": [{"componentId": int(component_id)}],
+                }
+            edited = {name: value for name, value in edited.items() if value}
+            for start in range(0, len(keys), JIRA_BULK_EDIT_MAX_ISSUES):
+                chunk = [raw_issues[key]["id"] for key in keys[start:start + JIRA_BULK_EDIT_MAX_ISSUES]]
+                if not actions:
+                    edited_ids.extend(chunk)
+                    continue
+                edited_ids.extend(self._run_bulk_task(jira, "fields", {
+                    "editedFieldsInput": edited, "selectedActions": actions,
+                    "selectedIssueIdsOrKeys": chunk, "sendBulkNotification": False,
+                }))
+
+        transitioned_ids = []
+        for start in range(0, len(edited_ids), JIRA_BULK_EDIT_MAX_ISSUES):
+            transitioned_ids.extend(self._run_bulk_task(jira, "transition", {
+                "bulkTransitionInputs": [{
+                    "selectedIssueIdsOrKeys": edited_ids[start:start + JIRA_BULK_EDIT_MAX_ISSUES],
+                    "transitionId": str(JIRA_IN_PROGRESS_TRANSITION),
+                }],
+                "sendBulkNotification": False,
+            }))
+
+        logger.info(f"Bulk edit updated {len(transitioned_ids)} of {len(issue_keys)} issues")
+        return {keys_by_id[issue_id]: {"status": "success"} for issue_id in transitioned_ids if issue_id in keys_by_id}
+
+    def _run_bulk_task(self, jira, operation, payload):
+        """Submits a bulk edit or transition task and returns the ids of the issues it processed."""
+        session = jira._session
+        response = session.post(f"{self.server}/rest/api/3/bulk/issues/{operation}", data=json.dumps(payload))
+        task_id = response.json()["taskId"]
+
+        deadline = time.monotonic() + JIRA_BULK_EDIT_TIMEOUT
+        while True:
+            task = session.get(f"{self.server}/rest/api/3/bulk/queue/{task_id}").json()
+            if task.get("status") in BULK_TASK_FINAL_STATUSES:
                 break
+            if time.monotonic() >= deadline:
+                logger.warning(f"Bulk {operation} task {task_id} did not finish in {JIRA_BULK_EDIT_TIMEOUT}s")
+                return []
+            time.sleep(JIRA_BULK_EDIT_POLL_INTERVAL)
+
+        failed = task.get("failedAccessibleIssues") or {}
+        if task["status"] != "COMPLETE" or failed:
+            logger.warning(f"Bulk {operation} task {task_id} ended {task['status']} with {len(failed)} failed issues")
+        return [str(issue_id) for issue_id in task.get("processedAccessibleIssues") or [] if str(issue_id) not in failed]
+
+    def get_labels(self, refresh=False):
+        """
+        Returns every label on the Jira site, served from `metadata_cache` when possible.
+
+        Labels are cached per site for JIRA_METADATA_CACHE_TTL seconds; `refresh=True`
+        reloads them. Concurrent misses share a single load.
+        """
+        return metadata_cache.get_or_load(
+            ("labels", self.server), self._fetch_labels, refresh=refresh
+        )
+
+    def _fetch_labels(self):
+        # Endpoint to get all labels
+        url = f"{self.server}/rest/api/3/label"
+        session = get_jira_client(self.server, self.email, self.token)._session
+
+        def fetch_page(start_at):
+            response = session.get(url, params={"startAt": start_at})
+            if response.status_code != 200:
+                logger.error(f"Failed to retrieve labels. Status code: {response.status_code}, Response: {response.text}")
+                response.raise_for_status()
+            return response.json()
 
-        print(f"Total labels retrieved: {len(labels)}")
+        # The first page reveals the total and page size, the rest are fetched concurrently
+        first_page = fetch_page(0)
+        labels = list(first_page['values'])
+        total = first_page['total']  # Total number of labels across all pages
+        page_size = first_page.get('maxResults') or len(first_page['values'])
+        logger.info(f"Retrieved {len(labels)} labels, Total: {total}")
+
+        if page_size and len(labels) < total:
+            starts = range(len(labels), total, page_size)
+            with ThreadPoolExecutor(max_workers=JIRA_LABEL_PAGE_WORKERS) as executor:
+                for page in executor.map(fetch_page, starts):
+                    labels.extend(page['values'])
+
+        logger.info(f"Total labels retrieved: {len(labels)}")
         return labels
     
     def set_workflow(self, issue_key, workflow):
-        print(f"Updating JIRA issue {issue_key} with workflow")
-        jiraOptions = {'server': self.server}
-        user_email = self.email
-        jira_token = self.token
-        jira = JIRA(options=jiraOptions, basic_auth=(user_email, jira_token)) 
+        """Appends the workflow to the story's workflow field and adds the GenAI_TestStrategy label."""
+        logger.info(f"Updating JIRA issue {issue_key} with workflow")
+        jira = get_jira_client(self.server, self.email, self.token)
         try:
-            issue = jira.issue(issue_key)
-            old_workflow = issue.fields.customfield_10059
-            issue.update(fields={'customfield_10059': old_workflow+'\n'+workflow})
+            # Only the current workflow and labels are needed to build the write
+            fields = jira.issue(issue_key, fields=f"{JIRA_WORKFLOW_FIELD},labels").raw.get("fields", {})
+            old_workflow = fields.get(JIRA_WORKFLOW_FIELD)
+            new_workflow = old_workflow + '\n' + workflow if old_workflow else workflow
 
+            write = IssueWrite(issue_key).set_field(JIRA_WORKFLOW_FIELD, new_workflow)
             # set genai label
-            if "GenAI_TestStrategy" not in issue.fields.labels:
-                issue.update(fields={"labels": issue.fields.labels + ["GenAI_TestStrategy"]})
-                
-            print(f"JIRA issue {issue_key} updated with workflow '{workflow}'")
+            new_label = GENAI_TEST_STRATEGY_LABEL not in (fields.get("labels") or [])
+            if new_label:
+                write.add_labels([GENAI_TEST_STRATEGY_LABEL])
+            write.send(jira)
+            if new_label:
+                metadata_cache.invalidate(("labels", self.server))
+
+            logger.info(f"JIRA issue {issue_key} updated with workflow")
+            log_payload(logger, "Workflow added", workflow, issue=issue_key)
         except JIRAError as e:
-            print(f"Failed to update JIRA issue {issue_key}: {e}")
+            logger.error(f"Failed to update JIRA issue {issue_key}: {e}")
             raise
-        
-    def get_components(self, project_key):
-        print(f"Getting components for project {project_key}")
-        jiraOptions = {'server': self.server}
-        user_email = self.email
-        jira_token = self.token
-        jira = JIRA(options=jiraOptions, basic_auth=(user_email, jira_token))
+
+    def get_components(self, project_key, refresh=False):
+        """
+        Returns the component names of a project, cached per user and project.
+        """
+        return metadata_cache.get_or_load(
+            ("components", self.server, self.email, project_key),
+            lambda: self._fetch_components(project_key),
+            refresh=refresh,
+        )
+
+    def _component_ids(self, project_key):
+        """Component ids by name for a project, cached like `get_components`."""
+        def fetch():
+            jira = get_jira_client(self.server, self.email, self.token)
+            return {component.name: component.id for component in jira.project_components(project_key)}
+        return metadata_cache.get_or_load(("component_ids", self.server, self.email, project_key), fetch)
+
+    def _fetch_components(self, project_key):
+        logger.info(f"Getting components for project {project_key}")
+        jira = get_jira_client(self.server, self.email, self.token)
         components = jira.project_components(project_key)
         components_names = [component.name for component in components] 
         return components_names
+
+    def invalidate_metadata(self, project_key=None):
+        """Drops cached labels, and the project's components when a project key is given."""
+        metadata_cache.invalidate(("labels", self.server))
+        if project_key:
+            metadata_cache.invalidate(("components", self.server, self.email, project_key))
+            metadata_cache.invalidate(("component_ids", self.server, self.email, project_key))
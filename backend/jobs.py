@@ -0,0 +1,125 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs allowed to run at the same time, the rest wait in the executor queue
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "4"))
+# Seconds a finished job (and its result) stays available for re-fetching
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+# Xray import jobs mostly wait on polling, so they get their own, larger pool
+IMPORT_JOB_MAX_CONCURRENCY = int(os.getenv("IMPORT_JOB_MAX_CONCURRENCY", "8"))
+# Upper bound for a single long-poll request, in seconds
+JOB_MAX_WAIT = int(os.getenv("JOB_MAX_WAIT", "30"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobManager:
+    """
+    Runs long generation pipelines on a bounded background executor.
+
+    `submit` returns a job id immediately; callers then poll `get` or long-poll
+    `wait` for the outcome. Finished jobs are kept for `result_ttl` seconds so a
+    result can be fetched again without re-running the pipeline. A job that failed
+    because of AI API rate limits has "status_code" 429 and the "retry_after" hint.
+    """
+
+    def __init__(self, max_concurrency=JOB_MAX_CONCURRENCY, result_ttl=JOB_RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="job")
+        self._jobs = {}
+        self._condition = threading.Condition()
+
+    def submit(self, owner, kind, fn, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "owner": owner,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "status_code": None,
+            "retry_after": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self._condition:
+            self._evict_expired()
+            self._jobs[job_id] = job
+        # Metrics recorded by the job keep the route that submitted it
+        self._executor.submit(contextvars.copy_context().run, self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id, owner=None):
+        """Returns a snapshot of the job, or None if it is unknown, expired or owned by someone else."""
+        with self._condition:
+            self._evict_expired()
+            return self._snapshot(job_id, owner)
+
+    def wait(self, job_id, owner=None, timeout=0):
+        """Like `get`, but blocks up to `timeout` seconds for the job to finish."""
+        deadline = time.monotonic() + min(max(timeout, 0), JOB_MAX_WAIT)
+        with self._condition:
+            self._evict_expired()
+            while True:
+                job = self._snapshot(job_id, owner)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in (SUCCEEDED, FAILED) or remaining <= 0:
+                    return job
+                self._condition.wait(remaining)
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING)
+        try:
+            result = fn(*args, **kwargs)
+        except AdmissionRejected as e:
+            logger.warning(f"Job {job_id} was rate limited: {e}")
+            self._update(
+                job_id, status=FAILED, error=str(e), status_code=429, retry_after=e.retry_after,
+                finished_at=time.time(),
+            )
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=SUCCEEDED, result=result, finished_at=time.time())
+
+    def _update(self, job_id, **changes):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(changes)
+            self._condition.notify_all()
+
+    def _snapshot(self, job_id, owner):
+        # Called with the condition held
+        job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job["owner"] != owner):
+            return None
+        return {key: value for key, value in job.items() if key != "owner"}
+
+    def _evict_expired(self):
+        # Called with the condition held
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
+import_job_manager = JobManager(max_concurrency=IMPORT_JOB_MAX_CONCURRENCY)
@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Completions kept in process memory
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+# Directory of the on-disk tier, shared by every worker process on the host
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+# Total size of the on-disk tier before the least recently used entries are evicted
+LLM_CACHE_DISK_MAX_BYTES = int(os.getenv("LLM_CACHE_DISK_MAX_BYTES", str(100 * 1024 * 1024)))
+
+
+def completion_cache_key(model, system_prompt, user_prompt, params):
+    """Content address of a completion: a hash of the model, both prompts and the generation params."""
+    material = json.dumps(
+        {"model": model, "system": system_prompt, "user": user_prompt, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Two-tier cache of deterministic LLM completions.
+
+    Lookups check an in-memory LRU first and then a directory of JSON files, promoting
+    disk hits into memory. The disk tier is bounded by total size; when it grows past
+    `disk_max_bytes` the files read or written least recently are removed.
+    """
+
+    def __init__(self, memory_entries=LLM_CACHE_MEMORY_ENTRIES, cache_dir=LLM_CACHE_DIR,
+                 disk_max_bytes=LLM_CACHE_DISK_MAX_BYTES):
+        self.memory_entries = memory_entries
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._remember(key, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            self._counters["stores"] += 1
+        self._write_disk(key, value)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes or 0
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, value):
+        # Called with self._lock held
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["completion"]
+            # Refresh the access time used for eviction
+            os.utime(path)
+            return value
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, value):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"completion": value}, f)
+            size = os.path.getsize(tmp_path)
+            try:
+                # Overwriting an entry only adds the difference
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write LLM cache entry: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += size
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _evict_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the limit so eviction doesn't run on every write
+        target = self.disk_max_bytes * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["evictions"] += evicted
+
+
+completion_cache = CompletionCache()
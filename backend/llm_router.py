@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import record_llm_deployment, record_llm_hedge, outcome_of, SUCCESS
+
+logger = logging.getLogger(__name__)
+
+# JSON list of AI API deployments to spread completions over, e.g.
+# [{"name": "east", "api_base": "https://east.openai.azure.com/", "api_key": "...", "engine": "gpt-4"}, ...];
+# "api_type", "api_version", "api_base", "api_key" and "engine" default to API_TYPE, API_VERSION, API_BASE,
+# API_KEY and API_MODEL. Unset: the single deployment those variables describe
+LLM_DEPLOYMENTS = os.getenv("LLM_DEPLOYMENTS", "")
+# A second request goes to another deployment once the first has taken longer than this
+# percentile of the deployment's recent latencies; 0 disables hedging
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Successful requests a deployment needs before its latencies are used for hedging
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Recent latencies kept per deployment
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Seconds a deployment is passed over after a 429, 5xx or connection failure without Retry-After
+LLM_DEPLOYMENT_COOLDOWN = float(os.getenv("LLM_DEPLOYMENT_COOLDOWN", "10"))
+# Threads that make blocking AI API requests, shared by all callers
+LLM_ROUTER_THREADS = int(os.getenv("LLM_ROUTER_THREADS", "64"))
+
+
+def failover_delay(status, headers=None):
+    """
+    Seconds to pass over a deployment that answered `status` (None: it did not answer),
+    or None for errors any other deployment would give as well.
+    """
+    if status is not None and status != 429 and status < 500:
+        return None
+    try:
+        return float((headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return LLM_DEPLOYMENT_COOLDOWN
+
+
+class Deployment:
+    """One AI API deployment and the load and latency the router tracks for it."""
+
+    def __init__(self, name, api_base, api_key, api_type, api_version, engine):
+        self.name = name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.api_type = api_type
+        self.api_version = api_version
+        self.engine = engine
+        # Guarded by the router's lock
+        self.outstanding = 0
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.cooldown_until = 0.0
+
+    def request_options(self, api_key=None):
+        """Per-request `openai` arguments, so no module-level configuration is shared between threads."""
+        return {
+            "api_key": self.api_key or api_key,
+            "api_base": self.api_base,
+            "api_type": self.api_type,
+            "api_version": self.api_version,
+            "engine": self.engine,
+        }
+
+
+def load_deployments():
+    defaults = {
+        "api_base": os.getenv("API_BASE"),
+        "api_key": os.getenv("API_KEY"),
+        "api_type": os.getenv("API_TYPE"),
+        "api_version": os.getenv("API_VERSION"),
+        "engine": os.getenv("API_MODEL"),
+    }
+    try:
+        configs = json.loads(LLM_DEPLOYMENTS) if LLM_DEPLOYMENTS else [{}]
+    except ValueError as e:
+        raise ValueError(f"LLM_DEPLOYMENTS is not valid JSON: {e}") from e
+    if not isinstance(configs, list) or not configs or not all(isinstance(config, dict) for config in configs):
+        raise ValueError("LLM_DEPLOYMENTS must be a non-empty JSON list of deployment objects")
+    deployments = []
+    for config in configs:
+        settings = {name: config.get(name) or default for name, default in defaults.items()}
+        name = config.get("name") or f"{urlparse(settings['api_base'] or '').hostname}/{settings['engine']}"
+        deployments.append(Deployment(name, **settings))
+    return deployments
+
+
+class LLMRouter:
+    """
+    Sends AI API requests to the deployment with the fewest requests in flight.
+
+    A deployment that answers 429 or 5xx, or not at all, is passed over for its Retry-After
+    (or LLM_DEPLOYMENT_COOLDOWN) and the request fails over to the next one. When a request
+    takes longer than LLM_HEDGE_PERCENTILE of its deployment's recent latencies, one hedged
+    copy goes to another deployment and whichever answers first wins; callers pass
+    `admit_hedge` and `refund_hedge` so that copy is debited from the rate limits while it
+    runs and credited back once the call is over, as only one answer is used. Every request is
+    recorded in the deployment metrics; the winner is also logged.
+
+    All deployment state is guarded by one lock, so the router is shared by every thread
+    and, through `call_async`, the event loop.
+    """
+
+    def __init__(self, deployments, hedge_percentile=LLM_HEDGE_PERCENTILE, hedge_min_samples=LLM_HEDGE_MIN_SAMPLES):
+        self.deployments = deployments
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_THREADS, thread_name_prefix="llm")
+
+    def engines(self):
+        """The distinct models of the deployments, in configuration order."""
+        return list(dict.fromkeys(deployment.engine for deployment in self.deployments))
+
+    def _acquire(self, tried, primary=False):
+        """
+        Picks and reserves the least loaded deployment not in `tried`, or returns None.
+
+        Deployments cooling down are skipped, except that a primary request goes to the
+        one that recovers first when all of them are, so the caller sees the 429 and backs off.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [d for d in self.deployments if d not in tried]
+            ready = [d for d in candidates if d.cooldown_until <= now]
+            if ready:
+                deployment = min(ready, key=lambda d: (d.outstanding, self._median(d)))
+            elif primary and candidates:
+                deployment = min(candidates, key=lambda d: d.cooldown_until)
+            else:
+                return None
+            deployment.outstanding += 1
+            tried.append(deployment)
+            return deployment
+
+    def _release(self, deployment, started, error=None, failover=None):
+        seconds = time.monotonic() - started
+        with self._lock:
+            deployment.outstanding -= 1
+            if error is None:
+                deployment.latencies.append(seconds)
+            elif failover is not None:
+                deployment.cooldown_until = max(deployment.cooldown_until, time.monotonic() + failover)
+        record_llm_deployment(deployment.name, SUCCESS if error is None else outcome_of(error), seconds)
+        return seconds
+
+    @staticmethod
+    def _median(deployment):
+        latencies = sorted(deployment.latencies)
+        return latencies[len(latencies) // 2] if latencies else 0.0
+
+    def _hedge_delay(self, deployment):
+        """Seconds after which a request to `deployment` is hedged, or None."""
+        if self.hedge_percentile <= 0 or len(self.deployments) < 2:
+            return None
+        with self._lock:
+            latencies = sorted(deployment.latencies)
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(self.hedge_percentile * len(latencies)))]
+
+    def _hedge(self, tried, admit_hedge):
+        """Picks and reserves the deployment for a hedged copy, or returns None."""
+        deployment = self._acquire(tried)
+        if deployment is None:
+            return None
+        if admit_hedge is not None and not admit_hedge():
+            with self._lock:
+                deployment.outstanding -= 1
+            tried.remove(deployment)
+            logger.info(f"AI API request to {tried[0].name} is slow, but the rate limits leave no room to hedge it")
+            return None
+        logger.info(f"AI API request to {tried[0].name} is slow, hedging on {deployment.name}")
+        record_llm_hedge(deployment.name)
+        return deployment
+
+    def _log_winner(self, deployment, seconds, tried):
+        hedged = " (hedged)" if len(tried) > 1 else ""
+        logger.info(f"AI API answered by {deployment.name} in {seconds:.2f}s{hedged}")
+
+    def _run(self, send, deployment, failover):
+        started = time.monotonic()
+        try:
+            result = send(deployment)
+        except Exception as e:
+            self._release(deployment, started, e, failover(e))
+            raise
+        return result, self._release(deployment, started)
+
+    def call(self, send, failover, hedge=True, admit_hedge=None, refund_hedge=None):
+        """
+        Calls `send(deployment)` on worker threads and returns (result, deployment).
+
+        Args:
+            send: Makes the request to the given deployment; blocking.
+            failover: Maps an exception raised by `send` to the seconds its deployment is
+                passed over for, or None to raise it to the caller right away.
+            hedge (optional): False for requests that must not be sent twice, e.g. streams.
+            admit_hedge (optional): Debits a hedged copy from the rate limits; returns False
+                to skip hedging when they leave no room for it.
+            refund_hedge (optional): Credits an admitted hedged copy back once the call returns
+                or raises, so only one of the two copies stays debited.
+
+        Raises:
+            The error of the last deployment tried once none is left to fail over to.
+            A hedge that loses keeps running in the background, but its result is dropped.
+        """
+        tried = []
+        pending = {}
+
+        def submit(deployment):
+            # Metrics recorded on the worker thread keep the caller's route
+            future = self._executor.submit(contextvars.copy_context().run, self._run, send, deployment, failover)
+            pending[future] = deployment
+
+        submit(self._acquire(tried, primary=True))
+        hedge_delay = self._hedge_delay(tried[0]) if hedge else None
+        hedged = False
+        started = time.monotonic()
+        last_error = None
+        try:
+            while pending:
+                timeout = None
+                if hedge_delay is not None:
+                    timeout = max(0.0, started + hedge_delay - time.monotonic())
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedge_delay = None
+                    deployment = self._hedge(tried, admit_hedge)
+                    if deployment is not None:
+                        hedged = True
+                        submit(deployment)
+                    continue
+                for future in done:
+                    deployment = pending.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        if failover(e) is None:
+                            raise
+                        last_error = e
+                        hedge_delay = None
+                        following = self._acquire(tried)
+                        if following is not None:
+                            logger.warning(f"AI API deployment {deployment.name} failed ({e}), failing over to {following.name}")
+                            submit(following)
+                        continue
+                    self._log_winner(deployment, seconds, tried)
+                    return result, deployment
+            raise last_error
+        finally:
+            if hedged and refund_hedge is not None:
+                refund_hedge()
+
+    async def _run_async(self, send, deployment, failover):
+        started = time.monotonic()
+        try:
+            result = await send(deployment)
+        except asyncio.CancelledError:
+            with self._lock:
+                deployment.outstanding -= 1
+            raise
+        except Exception as e:
+            self._release(deployment, started, e, failover(e))
+            raise
+        return result, self._release(deployment, started)
+
+    async def call_async(self, send, failover, hedge=True, admit_hedge=None, refund_hedge=None):
+        """`call` for coroutines: `send(deployment)` is awaited, and a losing hedge is cancelled."""
+        tried = []
+        pending = {}
+
+        def submit(deployment):
+            pending[asyncio.ensure_future(self._run_async(send, deployment, failover))] = deployment
+
+        submit(self._acquire(tried, primary=True))
+        hedge_delay = self._hedge_delay(tried[0]) if hedge else None
+        hedged = False
+        started = time.monotonic()
+        last_error = None
+        try:
+            while pending:
+                timeout = None
+                if hedge_delay is not None:
+                    timeout = max(0.0, started + hedge_delay - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_delay = None
+                    deployment = self._hedge(tried, admit_hedge)
+                    if deployment is not None:
+                        hedged = True
+                        submit(deployment)
+                    continue
+                for task in done:
+                    deployment = pending.pop(task)
+                    try:
+                        result, seconds = task.result()
+                    except Exception as e:
+                        if failover(e) is None:
+                            raise
+                        last_error = e
+                        hedge_delay = None
+                        following = self._acquire(tried)
+                        if following is not None:
+                            logger.warning(f"AI API deployment {deployment.name} failed ({e}), failing over to {following.name}")
+                            submit(following)
+                        continue
+                    self._log_winner(deployment, seconds, tried)
+                    return result, deployment
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            if hedged and refund_hedge is not None:
+                refund_hedge()
+
+
+llm_router = LLMRouter(load_deployments())
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from metrics import current_route, log_records_dropped
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for a human readable line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Empty to log to stdout only
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Worker processes (as passed to uvicorn --workers); with more than one, logs only go to
+# stdout, since one file cannot be rotated safely from several processes
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Longest message or field written; the rest is replaced by a note with its length
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+# Share of requests whose payloads (prompts, model output, import bodies) are logged
+# when LOG_LEVEL is above DEBUG; at DEBUG every payload is logged
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+# Records waiting for the writer thread; beyond this new records are dropped, not waited for
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+request_id = contextvars.ContextVar("request_id", default=None)
+payload_sampled = contextvars.ContextVar("payload_sampled", default=None)
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def start_request(incoming_id=None):
+    """Sets the request id (a client's X-Request-ID, or a new one) and the payload sampling decision."""
+    rid = incoming_id or os.urandom(8).hex()
+    request_id.set(rid)
+    payload_sampled.set(random.random() < LOG_PAYLOAD_SAMPLE_RATE)
+    return rid
+
+
+def truncate(value, limit=LOG_MAX_FIELD_CHARS):
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more characters]"
+
+
+def log_payload(logger, message, payload, **fields):
+    """
+    Logs a large payload when DEBUG is enabled, or for the sampled share of requests.
+
+    The payload is only turned into text, and truncated, on the writer thread.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        level = logging.DEBUG
+    else:
+        sampled = payload_sampled.get()
+        if sampled is None:
+            sampled = random.random() < LOG_PAYLOAD_SAMPLE_RATE
+        if not sampled:
+            return
+        level = logging.INFO
+    logger.log(level, message, extra={"fields": dict(fields, payload=payload)})
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread, so the caller never waits on log I/O.
+
+    Only the request context is captured here; truncation, JSON encoding and writing
+    happen in the listener, as does merging %-style arguments into the message (f-string
+    messages are already built by the caller). A full queue drops the record instead of
+    blocking.
+    """
+
+    def prepare(self, record):
+        record.request_id = request_id.get()
+        record.route = current_route.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "route", None) not in (None, "none"):
+            entry["route"] = record.route
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value)
+        if record.exc_info:
+            entry["exception"] = truncate(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s")
+
+    def format(self, record):
+        record.request_id = getattr(record, "request_id", None) or "-"
+        line = truncate(super().format(record))
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={truncate(value)}" for key, value in fields.items())
+        return line
+
+
+def log_file_path(path=LOG_FILE, workers=WEB_CONCURRENCY):
+    """The file this process logs to, or None: with several workers, logs only go to stdout."""
+    if not path or workers > 1:
+        return None
+    return path
+
+
+def setup_logging():
+    """
+    Routes all logging through a bounded queue to a background writer thread.
+
+    The writer sends records to stdout and, for a single worker unless LOG_FILE is empty,
+    to a file rotated at LOG_MAX_BYTES with LOG_BACKUP_COUNT backups. Safe to call more
+    than once.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = JsonFormatter() if LOG_FORMAT == "json" else TextFormatter()
+        handlers = [logging.StreamHandler(sys.stdout)]
+        log_file = log_file_path()
+        if log_file:
+            handlers.append(RotatingFileHandler(
+                log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+            ))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(ContextQueueHandler(log_queue))
+        root.setLevel(LOG_LEVEL)
+        # httpx logs every request at INFO
+        logging.getLogger("httpx").setLevel(max(logging.WARNING, root.level))
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
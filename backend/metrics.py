@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+from rate_limiter import AdmissionRejected
+
+SUCCESS = "success"
+ERROR = "error"
+TIMEOUT = "timeout"
+REJECTED = "rejected"
+RATE_LIMITED = "rate_limited"
+
+# Route the current request was matched to; background work outside a request reports "none"
+current_route = contextvars.ContextVar("current_route", default="none")
+
+# Stages range from cache hits (milliseconds) to multi-minute Xray imports
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+stage_duration = Histogram(
+    "testcase_stage_duration_seconds", "Time spent in one stage of a request pipeline",
+    ["stage", "route", "outcome"], buckets=DURATION_BUCKETS,
+)
+request_duration = Histogram(
+    "testcase_http_request_duration_seconds", "Time until the response of an HTTP request was ready",
+    ["route", "method", "status"], buckets=DURATION_BUCKETS,
+)
+llm_requests = Counter(
+    "testcase_llm_requests_total", "Calls made to the AI API", ["route", "outcome"],
+)
+llm_tokens = Counter(
+    "testcase_llm_tokens_total", "Tokens used by AI API calls, as reported by the provider", ["route", "kind"],
+)
+llm_deployment_requests = Counter(
+    "testcase_llm_deployment_requests_total", "AI API requests per deployment, including hedges and failovers",
+    ["deployment", "outcome"],
+)
+llm_deployment_duration = Histogram(
+    "testcase_llm_deployment_duration_seconds", "Time until a deployment answered an AI API request",
+    ["deployment", "outcome"], buckets=DURATION_BUCKETS,
+)
+llm_hedges = Counter(
+    "testcase_llm_hedged_requests_total", "Second requests sent because the first one was slow, by the deployment hedged on",
+    ["deployment"],
+)
+log_records_dropped = Counter(
+    "testcase_log_records_dropped_total", "Log records dropped because the log queue was full",
+)
+
+
+def outcome_of(exc):
+    if isinstance(exc, AdmissionRejected):
+        return REJECTED
+    # requests, httpx and openai all name their timeout exceptions "...Timeout..."
+    if isinstance(exc, TimeoutError) or "Timeout" in type(exc).__name__:
+        return TIMEOUT
+    # openai errors carry http_status, httpx's HTTPStatusError its response
+    status = getattr(exc, "http_status", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return RATE_LIMITED
+    return ERROR
+
+
+class Stage:
+    """Outcome holder for `track_stage`; set `outcome` for failures that are not raised."""
+
+    def __init__(self):
+        self.outcome = SUCCESS
+
+
+@contextmanager
+def track_stage(name):
+    """Records the duration of the enclosed block in `stage_duration`, labeled by outcome."""
+    stage = Stage()
+    started = time.perf_counter()
+    try:
+        yield stage
+    except BaseException as e:
+        if stage.outcome == SUCCESS:
+            stage.outcome = outcome_of(e)
+        raise
+    finally:
+        stage_duration.labels(name, current_route.get(), stage.outcome).observe(time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator form of `track_stage` for plain and async functions."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with track_stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track_stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_request(outcome, usage=None):
+    route = current_route.get()
+    llm_requests.labels(route, outcome).inc()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(kind):
+            llm_tokens.labels(route, kind.split("_")[0]).inc(usage[kind])
+
+
+def record_llm_deployment(deployment, outcome, seconds):
+    llm_deployment_requests.labels(deployment, outcome).inc()
+    llm_deployment_duration.labels(deployment, outcome).observe(seconds)
+
+
+def record_llm_hedge(deployment):
+    llm_hedges.labels(deployment).inc()
+
+
+def observe_request(route, method, status, seconds):
+    request_duration.labels(route, method, str(status)).observe(seconds)
+
+
+def metrics_payload():
+    """Returns (body, content type) for /metrics, aggregated over all workers in multiprocess mode."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
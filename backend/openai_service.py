@@ -1,44 +1,286 @@
 import os
+import time
+import random
+import logging
 import openai
 from dotenv import load_dotenv
 load_dotenv()
 
+from llm_cache import completion_cache, completion_cache_key
+from helper import stitch_completions
+from prompt_builder import count_tokens
+from rate_limiter import admission_controller, AdmissionRejected
+from metrics import track_stage, record_llm_request, outcome_of, RATE_LIMITED, SUCCESS
+from llm_router import llm_router, failover_delay
+
+logger = logging.getLogger(__name__)
+
+# Tokens per completion request; longer answers are finished with continuation requests
+LLM_MAX_TOKENS = int(os.getenv('LLM_MAX_TOKENS', '1000'))
+# Continuation requests allowed after a completion is cut off at LLM_MAX_TOKENS
+LLM_MAX_CONTINUATIONS = int(os.getenv('LLM_MAX_CONTINUATIONS', '3'))
+
+# Retries of a call the provider answered with 429, with full-jitter exponential backoff
+LLM_RATE_LIMIT_RETRIES = int(os.getenv('LLM_RATE_LIMIT_RETRIES', '3'))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '1'))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '20'))
+
+
+def openai_failover_delay(e):
+    """`failover_delay` for the errors of `openai.ChatCompletion.create`."""
+    if isinstance(e, (openai.error.APIConnectionError, openai.error.Timeout)):
+        return failover_delay(None)
+    if isinstance(e, openai.error.OpenAIError) and e.http_status:
+        return failover_delay(e.http_status, e.headers)
+    return None
+
+
+continuation_prompt = "Your previous answer was cut off. Continue exactly where it stopped, without repeating anything already written and without any explanation."
+
+
+def estimated_tokens(params):
+    """Tokens a request is admitted with: its prompt plus the most it may generate."""
+    return sum(count_tokens(m["content"]) for m in params["messages"]) + params["max_tokens"]
+
+
+def rate_limit_delay(headers, attempt):
+    """
+    Seconds to wait before retrying a call that was answered 429 for the `attempt`-th time
+    (0-based): the provider's Retry-After when given, a jittered exponential backoff
+    otherwise. None once LLM_RATE_LIMIT_RETRIES are used up.
+    """
+    if attempt >= LLM_RATE_LIMIT_RETRIES:
+        return None
+    try:
+        delay = float((headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    logger.warning(f"AI API rate limited, retrying in {delay:.1f}s...")
+    return delay
+
+
+def rate_limit_exhausted(headers):
+    """The AdmissionRejected to raise for a call still answered 429 after LLM_RATE_LIMIT_RETRIES retries."""
+    try:
+        retry_after = float((headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = LLM_RETRY_MAX_DELAY
+    return AdmissionRejected("AI API rate limit reached, retry later", retry_after)
+
+
+class Completion:
+    """
+    The requests of one completion, without the I/O, so the blocking and async clients
+    cache, continue and stitch completions the same way.
+
+    While `pending`, send a request with `params` and pass the response to `add`. A part
+    cut off at LLM_MAX_TOKENS (finish_reason "length") is followed by a continuation
+    request, up to LLM_MAX_CONTINUATIONS times.
+    """
+
+    def __init__(self, service, system_prompt, user_prompt):
+        self.service = service
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.params = service._completion_params(system_prompt, user_prompt)
+        self._cache_params = {k: v for k, v in self.params.items() if k not in ("engine", "messages")}
+        self.parts = []
+        self.engine = None
+        self.pending = True
+        # The last part was cut off at LLM_MAX_TOKENS
+        self.truncated = False
+
+    def _cache_key(self, engine):
+        return completion_cache_key(engine, self.system_prompt, self.user_prompt, self._cache_params)
+
+    def cached(self):
+        """A cached completion from any model `llm_router` may send the request to, or None."""
+        for engine in llm_router.engines():
+            cached = completion_cache.get(self._cache_key(engine))
+            if cached is not None:
+                logger.info("Using cached completion.")
+                return cached
+        return None
+
+    def add(self, res, deployment):
+        """Records the response `deployment` gave to the request with `params`."""
+        choices = (res or {}).get("choices") or []
+        if not choices:
+            self.pending = False
+            return
+        # The completion is cached for the model that finished it
+        self.engine = deployment.engine
+        choice = choices[0]
+        self.parts.append((choice.get("message") or {}).get("content") or "")
+        self.truncated = choice.get("finish_reason") == "length"
+        if not self.truncated or len(self.parts) > LLM_MAX_CONTINUATIONS:
+            self.pending = False
+            if self.truncated:
+                logger.warning(f"Completion still cut off after {LLM_MAX_CONTINUATIONS} continuations, not caching it.")
+            return
+        logger.info(f"Completion cut off after {len(self.parts)} part(s), requesting continuation...")
+        history = [
+            {"role": "assistant", "content": self.result},
+            {"role": "user", "content": continuation_prompt},
+        ]
+        self.params = self.service._completion_params(self.system_prompt, self.user_prompt, history)
+
+    @property
+    def result(self):
+        return stitch_completions(self.parts)
+
+    @property
+    def complete(self):
+        """True once the model finished the completion: no request failed and the last part was not cut off."""
+        return bool(self.parts) and not self.pending and not self.truncated
+
+    def store(self):
+        """Caches the finished completion and returns it; a truncated one is returned but not cached."""
+        result = self.result
+        if result and not self.truncated:
+            completion_cache.set(self._cache_key(self.engine), result)
+        return result
+
 
 class OpenAIService:
 
-    def __init__(self, api_key):
-        self.API_TYPE = os.getenv('API_TYPE')
-        self.API_VERSION = os.getenv('API_VERSION')
-        self.API_BASE = os.getenv('API_BASE')
+    def __init__(self, api_key, user=None):
+        # Used for deployments that don't set their own key
         self.api_key = api_key
+        # Identity the per-user rate limits are applied to
+        self.user = user or "anonymous"
+
+    def _completion_params(self, system_prompt, user_prompt, history=()):
+        return dict(
+            engine=os.getenv('API_MODEL'),
+            messages = [{"role":"system","content":system_prompt},{"role":"user", "content": user_prompt}, *history],
+            temperature=0.0,
+            max_tokens= LLM_MAX_TOKENS,
+            n=1,
+            top_p=0.0,
+            frequency_penalty = 0,
+            presence_penalty = 0,
+            stop=None,
+        )
+
+    def get_completion(self, system_prompt, user_prompt, use_cache=True):
+        """
+        Returns the completion for the prompts, or an empty list if the AI API call fails.
+
+        See `get_completion_with_status`.
+        """
+        return self.get_completion_with_status(system_prompt, user_prompt, use_cache)[0]
+
+    def get_completion_with_status(self, system_prompt, user_prompt, use_cache=True):
+        """
+        Returns (completion, complete) for the prompts; the completion is an empty list if the
+        AI API call fails. `complete` is False for a completion that is still cut off, or
+        whose continuation request failed, so callers can avoid storing it.
+
+        Generation is deterministic (temperature and top_p are 0), so successful completions
+        are stored in `completion_cache` and reused for identical requests. Pass
+        `use_cache=False` to force a fresh completion; it still refreshes the cache.
+
+        A completion cut off at LLM_MAX_TOKENS (finish_reason "length") is continued with up
+        to LLM_MAX_CONTINUATIONS follow-up requests, and the parts are stitched together. One
+        that is still cut off after those is returned, but not cached.
+
+        Raises:
+            AdmissionRejected: If the global or per-user rate limit leaves no capacity within
+                the queue timeout, or the provider still answers 429 after LLM_RATE_LIMIT_RETRIES
+                retries. Other AI API errors are logged and give an empty result.
+        """
+        with track_stage("get_completion") as stage:
+            completion = Completion(self, system_prompt, user_prompt)
+            if use_cache:
+                cached = completion.cached()
+                if cached is not None:
+                    return cached, True
+
+            result = []
+            try:
+                while completion.pending:
+                    completion.add(*self._create(completion.params))
+                result = completion.store()
+            except openai.error.AuthenticationError as e:
+                logger.error("Invalid API Key!")
+                stage.outcome = outcome_of(e)
+            except openai.error.APIConnectionError as e:
+                logger.error("Unable to fetch data from AI API!")
+                stage.outcome = outcome_of(e)
+            except AdmissionRejected:
+                if not completion.parts:
+                    logger.error("You have reached a limit to access AI API!")
+                    raise
+                logger.warning("Continuation was not admitted, returning the partial completion.")
+            except Exception as e:
+                logger.error(f"openai error {e}")
+                stage.outcome = outcome_of(e)
+            if not result and completion.parts:
+                # Keep what was generated before a continuation request failed
+                result = completion.result
+            return result, completion.complete
+
+    def stream_completion(self, system_prompt, user_prompt):
+        """
+        Yields the completion text as it is generated, one content delta at a time.
+
+        Unlike `get_completion`, errors are raised to the caller, since a partially
+        delivered stream cannot be turned into an empty result.
+        """
+        response, _ = self._create(self._completion_params(system_prompt, user_prompt), stream=True)
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                yield content
+
+    def _create(self, params, stream=False):
+        """
+        Calls the AI API through `llm_router` once admission control lets the request through.
+
+        The router fails over between deployments and hedges slow requests when admission
+        control has room for the copy (streams are never hedged). When every deployment
+        answered 429, the call is retried up to LLM_RATE_LIMIT_RETRIES times, waiting for the
+        provider's Retry-After when given and a jittered exponential backoff otherwise.
+
+        Returns:
+            (response, the deployment that answered)
+        """
+        tokens = estimated_tokens(params)
+        for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+            try:
+                admission_controller.acquire(self.user, tokens)
+            except AdmissionRejected as e:
+                record_llm_request(outcome_of(e))
+                raise
+            try:
+                res, deployment = llm_router.call(
+                    lambda deployment: openai.ChatCompletion.create(
+                        stream=stream, **dict(params, **deployment.request_options(self.api_key))
+                    ),
+                    openai_failover_delay, hedge=not stream,
+                    admit_hedge=lambda: admission_controller.try_acquire(self.user, tokens),
+                    refund_hedge=lambda: admission_controller.refund(self.user, tokens),
+                )
+            except openai.error.RateLimitError as e:
+                record_llm_request(RATE_LIMITED)
+                admission_controller.refund(self.user, tokens)
+                delay = rate_limit_delay(e.headers, attempt)
+                if delay is None:
+                    raise rate_limit_exhausted(e.headers) from e
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                record_llm_request(outcome_of(e))
+                raise
+
+            self._record_usage(None if stream else res.get("usage"), tokens)
+            return res, deployment
 
-    def get_completion(self, system_prompt, user_prompt):
-        openai.api_type = self.API_TYPE
-        openai.api_version = self.API_VERSION
-        openai.api_base = self.API_BASE
-        openai.api_key = self.api_key
-        
-        result = []
-        try:
-            res = openai.ChatCompletion.create(
-                engine=os.getenv('API_MODEL'),
-                messages = [{"role":"system","content":system_prompt},{"role":"user", "content": user_prompt}],
-                temperature=0.0,
-                max_tokens= 1000,
-                n=1,
-                top_p=0.0,
-                frequency_penalty = 0,
-                presence_penalty = 0,
-                stop=None,
-            )
-            if res and res.choices:
-                result = res.choices[0].message.content
-        except openai.error.RateLimitError:
-            print("Invalid API Key!")
-        except openai.error.APIConnectionError:
-            print("Unable to fetch data from AI API!")
-        except openai.error.RateLimitError:
-            print("You have reached a limit to access AI API!")
-        except Exception as e:
-            print(f"openai error {e}")
-        return result
\ No newline at end of file
+    def _record_usage(self, usage, tokens):
+        """Records a successful request and settles its admission against the tokens it used."""
+        record_llm_request(SUCCESS, usage)
+        if usage:
+            admission_controller.settle(self.user, tokens, usage.get("total_tokens", tokens))
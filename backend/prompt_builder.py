@@ -0,0 +1,94 @@
+import os
+import re
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # optional, a character-based estimate is used without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Token budget for documentation chunks pasted into the test case prompt
+PROMPT_DOCUMENTATION_BUDGET = int(os.getenv("PROMPT_DOCUMENTATION_BUDGET", "3000"))
+# Chunks are only cut to fit the budget if at least this many tokens of them remain
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", "100"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception:
+        _encoding = None
+
+documentation_prompt = """
+Here's a summary of relevant content retrieved from Azure AI Search for your query:
+{}
+**User Query:** {}
+"""
+
+_word = re.compile(r"[a-z0-9]{3,}")
+
+
+def count_tokens(text):
+    """Counts tokens with tiktoken when it is installed, otherwise estimates ~4 characters per token."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def rank_documentation(chunks, search_query):
+    """
+    Orders documentation chunks by how many distinct search query terms they contain.
+
+    Ties keep the order the retrieval service returned, which is already by relevance.
+    """
+    query_terms = set(_word.findall((search_query or "").lower()))
+    scored = []
+    for position, chunk in enumerate(chunks):
+        chunk_terms = set(_word.findall(chunk.lower()))
+        scored.append((-len(query_terms & chunk_terms), position, chunk))
+    scored.sort()
+    return [chunk for _, _, chunk in scored]
+
+
+def select_documentation(chunks, search_query, budget=PROMPT_DOCUMENTATION_BUDGET):
+    """
+    Returns the highest ranked chunks that fit in `budget` tokens.
+
+    The first chunk that does not fit is cut to the remaining budget if a useful part of
+    it (PROMPT_MIN_CHUNK_TOKENS) still fits; lower ranked chunks are dropped.
+    """
+    selected = []
+    remaining = budget
+    for chunk in rank_documentation(chunks, search_query):
+        tokens = count_tokens(chunk)
+        if tokens <= remaining:
+            selected.append(chunk)
+            remaining -= tokens
+            continue
+        if remaining >= PROMPT_MIN_CHUNK_TOKENS:
+            selected.append(truncate_to_tokens(chunk, remaining))
+        break
+    return selected
+
+
+def build_test_case_prompt(user_prompt, documentation, search_query, budget=PROMPT_DOCUMENTATION_BUDGET):
+    """Builds the test case user prompt with as much ranked documentation as the budget allows."""
+    selected = select_documentation(documentation or [], search_query, budget)
+    if not selected:
+        return user_prompt
+
+    logger.info(f"Using {len(selected)} of {len(documentation)} documentation chunks in the prompt.")
+    return documentation_prompt.format("\n\n".join(selected), user_prompt)
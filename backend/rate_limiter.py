@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import threading
+
+# Provider quota shared by the whole deployment; each of the WEB_CONCURRENCY workers admits its share
+LLM_GLOBAL_RPM = float(os.getenv("LLM_GLOBAL_RPM", "60"))
+LLM_GLOBAL_TPM = float(os.getenv("LLM_GLOBAL_TPM", "90000"))
+# Share of the quota a single user (JWT email) may use
+LLM_USER_RPM = float(os.getenv("LLM_USER_RPM", "20"))
+LLM_USER_TPM = float(os.getenv("LLM_USER_TPM", "30000"))
+# Callers allowed to wait for capacity at once, and how long each may wait (seconds)
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "50"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Worker processes serving the app, each with its own buckets
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when an LLM call cannot be admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    """
+    Bucket holding up to `capacity` units that refills continuously at `capacity` per minute.
+
+    Not thread-safe on its own; `AdmissionController` guards all buckets with one lock so
+    a request is debited from every bucket it needs atomically.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        # A request larger than the whole bucket is admitted once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def is_full(self):
+        return self.level >= self.capacity
+
+
+class AdmissionController:
+    """
+    Admits LLM calls against requests-per-minute and tokens-per-minute limits, globally
+    and per user.
+
+    The buckets live in process memory, so every limit is divided by `workers`: the
+    workers together then stay within the configured quota. A user whose requests all
+    reach one worker gets only that worker's share of the per-user limit.
+
+    A call that cannot be admitted right away waits in a bounded queue for up to
+    `queue_timeout` seconds. When the queue is full, or the wait would be longer than
+    that, `AdmissionRejected` is raised with a retry-after hint.
+    """
+
+    def __init__(self, global_rpm=LLM_GLOBAL_RPM, global_tpm=LLM_GLOBAL_TPM,
+                 user_rpm=LLM_USER_RPM, user_tpm=LLM_USER_TPM,
+                 queue_max=LLM_QUEUE_MAX, queue_timeout=LLM_QUEUE_TIMEOUT, workers=WEB_CONCURRENCY):
+        workers = max(1, workers)
+        self.user_rpm = user_rpm / workers
+        self.user_tpm = user_tpm / workers
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self._global = (TokenBucket(global_rpm / workers), TokenBucket(global_tpm / workers))
+        self._users = {}
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, user, tokens):
+        """Blocks until one request of `tokens` tokens is admitted for `user`."""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            wait = self._try_debit(user, tokens)
+            if wait == 0:
+                return
+            if self._waiting >= self.queue_max:
+                raise AdmissionRejected("Too many requests are waiting for the AI API", wait)
+
+            self._waiting += 1
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if wait > remaining:
+                        raise AdmissionRejected("AI API quota exhausted, retry later", wait)
+                    self._condition.wait(wait)
+                    wait = self._try_debit(user, tokens)
+                    if wait == 0:
+                        return
+            finally:
+                self._waiting -= 1
+
+    def try_acquire(self, user, tokens):
+        """Admits one request of `tokens` tokens for `user` only if that is possible right now; True if it did."""
+        with self._condition:
+            return self._try_debit(user, tokens) == 0
+
+    async def acquire_async(self, user, tokens):
+        """`acquire` for event loop callers: waits with asyncio.sleep instead of blocking a thread."""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            wait = self._try_debit(user, tokens)
+            if wait == 0:
+                return
+            if self._waiting >= self.queue_max:
+                raise AdmissionRejected("Too many requests are waiting for the AI API", wait)
+            self._waiting += 1
+
+        try:
+            while True:
+                if wait > deadline - time.monotonic():
+                    raise AdmissionRejected("AI API quota exhausted, retry later", wait)
+                await asyncio.sleep(wait)
+                with self._condition:
+                    wait = self._try_debit(user, tokens)
+                if wait == 0:
+                    return
+        finally:
+            with self._condition:
+                self._waiting -= 1
+
+    def settle(self, user, estimated_tokens, actual_tokens):
+        """Corrects the token buckets once the provider reports the real usage of a call."""
+        difference = actual_tokens - estimated_tokens
+        if not difference:
+            return
+        with self._condition:
+            for bucket in (self._global[1], self._user_buckets(user)[1]):
+                bucket.refill(time.monotonic())
+                bucket.level = min(bucket.capacity, bucket.level - difference)
+            self._condition.notify_all()
+
+    def refund(self, user, tokens):
+        """
+        Credits back an admitted call that was not served: one the provider rejected (429)
+        before it is retried, or a hedged copy that lost.
+        """
+        with self._condition:
+            now = time.monotonic()
+            user_rpm, user_tpm = self._user_buckets(user)
+            global_rpm, global_tpm = self._global
+            for bucket, amount in ((global_rpm, 1), (global_tpm, tokens), (user_rpm, 1), (user_tpm, tokens)):
+                bucket.refill(now)
+                bucket.level = min(bucket.capacity, bucket.level + min(amount, bucket.capacity))
+            self._condition.notify_all()
+
+    def _user_buckets(self, user):
+        # Called with the condition held
+        buckets = self._users.get(user)
+        if buckets is None:
+            if len(self._users) > 1000:
+                self._drop_idle_users()
+            buckets = (TokenBucket(self.user_rpm), TokenBucket(self.user_tpm))
+            self._users[user] = buckets
+        return buckets
+
+    def _drop_idle_users(self):
+        # A full bucket carries no state, so it can be recreated on the next call
+        now = time.monotonic()
+        for user, buckets in list(self._users.items()):
+            for bucket in buckets:
+                bucket.refill(now)
+            if all(bucket.is_full() for bucket in buckets):
+                del self._users[user]
+
+    def _try_debit(self, user, tokens):
+        # Called with the condition held; debits every bucket or none and returns the wait
+        now = time.monotonic()
+        user_rpm, user_tpm = self._user_buckets(user)
+        global_rpm, global_tpm = self._global
+        needs = ((global_rpm, 1), (global_tpm, tokens), (user_rpm, 1), (user_tpm, tokens))
+        for bucket, _ in needs:
+            bucket.refill(now)
+        wait = max(bucket.wait_time(amount) for bucket, amount in needs)
+        if wait > 0:
+            return wait
+        for bucket, amount in needs:
+            bucket.level -= min(amount, bucket.capacity)
+        return 0.0
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+try:
+    import redis
+except ImportError:  # optional, only needed for SHARED_STATE_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Where state shared by all workers lives: "sqlite" (one file per host) or "redis" (any number of hosts)
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "sqlite").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+SHARED_STATE_REDIS_URL = os.getenv("SHARED_STATE_REDIS_URL", "redis://localhost:6379/0")
+# Prefix of every Redis key, so several deployments can share one Redis
+SHARED_STATE_REDIS_PREFIX = os.getenv("SHARED_STATE_REDIS_PREFIX", "testcase-generator:")
+# Seconds between sweeps that delete expired SQLite entries
+SHARED_STATE_EVICT_INTERVAL = float(os.getenv("SHARED_STATE_EVICT_INTERVAL", "60"))
+
+class SharedState(ABC):
+    """
+    Key-value state shared by every worker process, with per-namespace keys and expiry.
+
+    Namespaces keep users apart (use the user's email); values are anything JSON can encode.
+    Every method is atomic, also across processes. An entry stored with a `ttl` in seconds
+    is never returned once it expired, and is deleted shortly after.
+    """
+
+    @abstractmethod
+    def get(self, namespace, key, default=None):
+        """Returns the value of the live entry, or `default`."""
+
+    @abstractmethod
+    def set(self, namespace, key, value, ttl=None):
+        """Stores the value, replacing any entry of the key."""
+
+    @abstractmethod
+    def delete(self, namespace, key):
+        """Deletes the entry; True if there was a live one."""
+
+
+class SQLiteState(SharedState):
+    """
+    SharedState in a SQLite file, for the workers of one host.
+
+    Every thread has its own connection, and read-modify-write operations run in
+    `BEGIN IMMEDIATE` transactions, which serialize them across processes. A daemon thread
+    deletes expired entries every `evict_interval` seconds.
+    """
+
+    def __init__(self, path=SHARED_STATE_PATH, evict_interval=SHARED_STATE_EVICT_INTERVAL):
+        self.path = path
+        self.evict_interval = evict_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._evictor = None
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                if not self._initialized:
+                    connection.executescript(
+                        "CREATE TABLE IF NOT EXISTS state ("
+                        " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+                        " PRIMARY KEY (namespace, key)) WITHOUT ROWID;"
+                        "CREATE INDEX IF NOT EXISTS state_expires ON state (expires_at) WHERE expires_at IS NOT NULL;"
+                    )
+                    self._initialized = True
+                if self._evictor is None and self.evict_interval > 0:
+                    self._evictor = threading.Thread(target=self._evict_forever, name="shared-state-evict", daemon=True)
+                    self._evictor.start()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _live(connection, namespace, key):
+        return connection.execute(
+            "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+
+    @staticmethod
+    def _expires_at(ttl):
+        return None if ttl is None else time.time() + ttl
+
+    def get(self, namespace, key, default=None):
+        row = self._live(self._connection(), namespace, key)
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), self._expires_at(ttl)),
+        )
+
+    def delete(self, namespace, key):
+        with self._transaction() as connection:
+            row = self._live(connection, namespace, key)
+            connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        return row is not None
+
+    def evict_expired(self):
+        """Deletes every expired entry; returns how many."""
+        return self._connection().execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _evict_forever(self):
+        while True:
+            time.sleep(self.evict_interval)
+            try:
+                evicted = self.evict_expired()
+                if evicted:
+                    logger.debug(f"Evicted {evicted} expired shared state entries")
+            except sqlite3.Error as e:
+                logger.warning(f"Shared state eviction failed: {e}")
+
+
+class RedisState(SharedState):
+    """
+    SharedState in Redis (or a Redis-compatible server), for workers on any number of hosts.
+
+    Entries are stored as `<prefix><namespace>:<key>` with native expiry, so Redis evicts
+    them itself.
+    """
+
+    def __init__(self, url=SHARED_STATE_REDIS_URL, prefix=SHARED_STATE_REDIS_PREFIX):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}{namespace}:{key}"
+
+    @staticmethod
+    def _ttl_ms(ttl):
+        return None if ttl is None else max(1, int(ttl * 1000))
+
+    def get(self, namespace, key, default=None):
+        value = self.client.get(self._key(namespace, key))
+        return default if value is None else json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None):
+        self.client.set(self._key(namespace, key), json.dumps(value), px=self._ttl_ms(ttl))
+
+    def delete(self, namespace, key):
+        return self.client.delete(self._key(namespace, key)) == 1
+
+
+def create_shared_state(backend=SHARED_STATE_BACKEND):
+    if backend == "redis":
+        return RedisState()
+    if backend == "sqlite":
+        return SQLiteState()
+    raise ValueError(f"Unknown SHARED_STATE_BACKEND '{backend}', expected 'sqlite' or 'redis'")
+
+
+shared_state = create_shared_state()
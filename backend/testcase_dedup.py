@@ -0,0 +1,173 @@
+import os
+import re
+import logging
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Remove near-duplicate test cases before an Xray import, unless a request opts out
+TESTCASE_DEDUP = os.getenv("TESTCASE_DEDUP", "true").lower() in ("true", "1", "yes")
+# Jaccard similarity of the word shingles above which two test cases count as duplicates
+TESTCASE_DEDUP_THRESHOLD = float(os.getenv("TESTCASE_DEDUP_THRESHOLD", "0.8"))
+# Words per shingle
+TESTCASE_DEDUP_SHINGLE_SIZE = int(os.getenv("TESTCASE_DEDUP_SHINGLE_SIZE", "3"))
+# MinHash signature length; more slots estimate similarity more precisely
+TESTCASE_DEDUP_SIGNATURE_SIZE = int(os.getenv("TESTCASE_DEDUP_SIGNATURE_SIZE", "64"))
+
+_word = re.compile(r"[a-z0-9]+")
+_hash_mask = (1 << 64) - 1
+_hash_space = 1 << 64
+
+
+def test_case_text(test_case):
+    """The parts of a test case compared for duplicates: summary, step actions and expected results."""
+    parts = [test_case.get("summary") or ""]
+    for step in test_case.get("steps") or []:
+        if isinstance(step, dict):
+            parts.append(step.get("action") or "")
+            parts.append(step.get("result") or "")
+    return " ".join(str(part) for part in parts)
+
+
+def shingles(text, size=TESTCASE_DEDUP_SHINGLE_SIZE):
+    """
+    Hashes of the overlapping `size`-word sequences of the text, as a set of 64-bit ints.
+
+    Python's string hashing is salted per process, so the hashes are only comparable
+    within one process, which is all a single deduplication needs.
+    """
+    words = _word.findall(text.lower())
+    if len(words) < size:
+        return {hash(tuple(words)) & _hash_mask} if words else set()
+    return {hash(gram) & _hash_mask for gram in zip(*(words[n:] for n in range(size)))}
+
+
+def minhash(hashed_shingles, size=TESTCASE_DEDUP_SIGNATURE_SIZE):
+    """
+    One-permutation MinHash signature of a set of shingle hashes.
+
+    Each hash goes to one of `size` slots and every slot keeps its smallest value, so a
+    signature costs one pass over the shingles instead of one per slot. Empty slots borrow
+    the value of the next filled slot, offset by the distance, which keeps the chance of
+    two signatures agreeing in a slot close to their Jaccard similarity.
+    """
+    signature = [None] * size
+    for value in hashed_shingles:
+        slot = value % size
+        if signature[slot] is None or value < signature[slot]:
+            signature[slot] = value
+    if all(value is None for value in signature):
+        return signature
+    for slot in range(size):
+        distance = 1
+        while signature[slot] is None:
+            borrowed = signature[(slot + distance) % size]
+            if borrowed is not None:
+                signature[slot] = borrowed + distance * _hash_space
+            distance += 1
+    return signature
+
+
+def lsh_bands(threshold, size=TESTCASE_DEDUP_SIGNATURE_SIZE):
+    """
+    Returns (bands, rows) with bands * rows == size for the LSH index.
+
+    Picks the split whose candidate threshold, (1 / bands) ** (1 / rows), is the highest one
+    still below `threshold`: pairs at the threshold almost always become candidates, and
+    every candidate is checked against the exact similarity afterwards.
+    """
+    best = (size, 1)
+    for rows in range(1, size + 1):
+        if size % rows:
+            continue
+        bands = size // rows
+        if (1 / bands) ** (1 / rows) <= threshold * 0.9:
+            best = (bands, rows)
+    return best
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+@timed("dedup_test_cases")
+def deduplicate_test_cases(test_cases, threshold=TESTCASE_DEDUP_THRESHOLD):
+    """
+    Drops test cases that are near-duplicates of an earlier one.
+
+    Test cases are compared on the word shingles of their summary, step actions and expected
+    results. MinHash signatures in an LSH index find the candidate pairs without comparing
+    every pair, and a candidate counts as a duplicate when the exact Jaccard similarity of
+    the shingles is at least `threshold`.
+
+    Args:
+        test_cases: Test cases in the schema the model returns (list of dicts).
+        threshold (optional): Similarity from 0 to 1 at which cases are merged.
+
+    Returns:
+        A tuple of the kept test cases (in input order) and the merge report, a list of
+        {"kept": {"index", "summary"}, "merged": [{"index", "summary", "similarity"}, ...]}
+        entries, one per kept test case that absorbed others.
+    """
+    shingle_sets = [shingles(test_case_text(test_case)) for test_case in test_cases]
+    bands, rows = lsh_bands(threshold)
+
+    buckets = {}
+    band_keys = []
+    for index, hashed in enumerate(shingle_sets):
+        keys = []
+        if hashed:
+            signature = minhash(hashed, bands * rows)
+            keys = list(enumerate(zip(*[iter(signature)] * rows)))
+        for key in keys:
+            buckets.setdefault(key, []).append(index)
+        band_keys.append(keys)
+
+    # Every case is compared to the kept case it would merge into, so merges do not chain
+    merged_into = {}
+    report = []
+    for index in range(len(test_cases)):
+        if index in merged_into:
+            continue
+        candidates = {other for key in band_keys[index] for other in buckets[key] if other > index}
+        merged = []
+        for other in sorted(candidates):
+            if other in merged_into:
+                continue
+            similarity = jaccard(shingle_sets[index], shingle_sets[other])
+            if similarity >= threshold:
+                merged_into[other] = index
+                merged.append({
+                    "index": other, "summary": test_cases[other].get("summary"),
+                    "similarity": round(similarity, 3),
+                })
+        if merged:
+            report.append({"kept": {"index": index, "summary": test_cases[index].get("summary")}, "merged": merged})
+
+    kept = [test_case for index, test_case in enumerate(test_cases) if index not in merged_into]
+    if merged_into:
+        logger.info(f"Merged {len(merged_into)} near-duplicate test cases, {len(kept)} of {len(test_cases)} left")
+    return kept, report
+
+
+def deduplicate_for_import(test_cases, dedup=None, threshold=None):
+    """
+    Applies `deduplicate_test_cases` to an import request's test cases.
+
+    `dedup` and `threshold` are the request's "dedup" and "dedup_threshold" options;
+    None falls back to TESTCASE_DEDUP and TESTCASE_DEDUP_THRESHOLD.
+
+    Raises:
+        ValueError: If the threshold is not a number between 0 (exclusive) and 1.
+    """
+    if dedup is None:
+        dedup = TESTCASE_DEDUP
+    if not dedup or not isinstance(test_cases, list):
+        return test_cases, []
+    threshold = TESTCASE_DEDUP_THRESHOLD if threshold is None else float(threshold)
+    if not 0 < threshold <= 1:
+        raise ValueError("dedup_threshold must be between 0 and 1")
+    return deduplicate_test_cases(test_cases, threshold)
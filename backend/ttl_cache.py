@@ -0,0 +1,102 @@
+import time
+import threading
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache whose entries expire `ttl` seconds after being stored.
+
+    `get_or_load` deduplicates concurrent misses: when several threads ask for the same
+    missing key at once, one of them runs the loader and the others wait for its result
+    (or its exception) instead of repeating the call.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry["value"]
+
+    def get_entry(self, key):
+        """Returns (value, stored_at) for a live entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= time.monotonic():
+                return None
+            return entry["value"], entry["stored_at"]
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[key] = {
+                "value": value,
+                "stored_at": time.time(),
+                "expires_at": now + (self.ttl if ttl is None else ttl),
+            }
+
+    def invalidate(self, key=None):
+        """Drops one key, or every entry when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_load(self, key, loader, refresh=False):
+        """
+        Returns the cached value for `key`, calling `loader()` to fill it on a miss.
+
+        With `refresh=True` the cached value is ignored and reloaded. Exceptions raised by
+        the loader are propagated to every waiting caller and nothing is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if not refresh and entry is not None and entry["expires_at"] > time.monotonic():
+                return entry["value"]
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = {"event": threading.Event(), "value": None, "error": None}
+                self._inflight[key] = inflight
+
+        if not owner:
+            inflight["event"].wait()
+            if inflight["error"] is not None:
+                raise inflight["error"]
+            return inflight["value"]
+
+        try:
+            value = loader()
+        except Exception as e:
+            inflight["error"] = e
+            raise
+        else:
+            inflight["value"] = value
+            self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight["event"].set()
+
+    def _evict(self, now):
+        # Called with self._lock held: drop expired entries, then the oldest if still full
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda key: self._entries[key]["expires_at"])
+            del self._entries[oldest]
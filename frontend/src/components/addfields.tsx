@@ -23,14 +23,14 @@ const XRayFields: React.FC = () => {
   const [isLoading, setLoading] = useState(false);
   const xrayTestKeys: string[] = localStorage.getItem("xray_test_keys")?.split(",") ?? [];
 
-  const fetchData = async (type: 'labels' | 'components') => {
+  const fetchData = async (type: 'labels' | 'components', refresh = false) => {
     setLoading(true);
     try {
       const storageKey = `jira_${type}`;
       const projectId = type === 'components' && localStorage.getItem("jira_issue_id")?.split("-")[0];
       const response = await axios.get(`/get-jira-${type}`, {
         headers: { Authorization: `Bearer ${Cookies.get("jira")}` },
-        params: projectId ? { project_id: projectId } : {},
+        params: { ...(projectId ? { project_id: projectId } : {}), ...(refresh ? { refresh: true } : {}) },
       });
       const data = response.data[type] || [];
       const formattedOptions = data.map((item: string) => ({ value: item, label: item }));
@@ -162,9 +162,9 @@ const XRayFields: React.FC = () => {
           placement="top"
           overlay={<Tooltip id="button-tooltip">Fetch latest labels if outdated. ~2 Minutes</Tooltip>}
         >
-          <Button onClick={() => fetchData('labels')} disabled={isLoading}>Fetch Labels</Button>
+          <Button onClick={() => fetchData('labels', true)} disabled={isLoading}>Fetch Labels</Button>
         </OverlayTrigger>
-        <Button onClick={() => fetchData('components')} disabled={isLoading}>Fetch Components</Button>
+        <Button onClick={() => fetchData('components', true)} disabled={isLoading}>Fetch Components</Button>
         </div>
       </Form>
     </div>
@@ -74,7 +74,7 @@ const Home: React.FC<Props> = () => {
       );
 
       console.log("Success! Response:", response.data);
-      localStorage.setItem("testcases", response.data as string);
+      localStorage.setItem("testcases", JSON.stringify(response.data));
       localStorage.setItem("jira_issue_id", formData.jira_issue_id);
 
       navigate("/testcases");
@@ -46,7 +46,7 @@ const Settings: React.FC<SettingsProps> = () => {
     }
     const fetchVectorizationKey = async () => {
       try {
-        const response = await axios.get("/get-vectorization-key");
+        const response = await axios.get("/get-vectorization-key", { headers: { Authorization: `Bearer ${Cookies.get("jira")}` } });
         if (response.status === 200 && typeof response.data === "string") {
           setIsSubmitAPIDisabled(true);
         }
@@ -84,7 +84,7 @@ const Settings: React.FC<SettingsProps> = () => {
 
       await axios.post("/store-vectorization-key", {
         vectorization_api_key: vectorizationData.vectorization_api_key,
-      });
+      }, { headers: { Authorization: `Bearer ${Cookies.get("jira")}` } });
       setIsSubmitAPIDisabled(true);
       setVectorizationData({ vectorization_api_key: "" });
     } catch (error) {
@@ -256,7 +256,7 @@ const Settings: React.FC<SettingsProps> = () => {
                       <Button
                         className="btn-custom"
                         onClick={() => {
-                          axios.delete("/clear-vectorization-key");
+                          axios.delete("/clear-vectorization-key", { headers: { Authorization: `Bearer ${Cookies.get("jira")}` } });
                           setIsSubmitAPIDisabled(false);
                         }}
                       >
@@ -44,7 +44,8 @@ const TestCases: React.FC<TestCasesProps> = () => {
         { headers: { Authorization: `Bearer ${Cookies.get("xray")}` } }
       );
       console.log("Added successfully:", response.data);
-      localStorage.setItem("xray_test_keys", response.data)
+      // A partially successful import (207) returns the created keys alongside the errors
+      localStorage.setItem("xray_test_keys", response.data.keys ?? response.data)
       navigate('/add-fields');
     } catch (error) {
       console.error("Authentication for XRay Failed, please retry authenticating");
@@ -75,7 +76,7 @@ const TestCases: React.FC<TestCasesProps> = () => {
         }
       );
       console.log("Regenerated successfully:", response.data);
-      localStorage.setItem('testcases', response.data);
+      localStorage.setItem('testcases', JSON.stringify(response.data));
       setUserPrompt(""); 
       window.location.reload(); 
     } catch (error) {